@@ -1,22 +1,40 @@
-from flask import Flask, jsonify, render_template, request, Response
+from flask import Flask, jsonify, render_template, request, Response, g, has_request_context, stream_with_context
 from flask_cors import CORS
 import pyodbc
 import firebase_admin
 from firebase_admin import credentials, auth, firestore
 from datetime import datetime, timedelta
 import socket
+import ipaddress
 import requests
 import concurrent.futures
 import pandas as pd
 import numpy as np
 import json
+import base64
+import uuid
+import threading
 import time
 import re
-from mlxtend.frequent_patterns import apriori, association_rules
 from sqlalchemy import text  # Add this import
 from datetime import date, datetime
 from decimal import Decimal
 
+from db_pool import ConnectionPool, PoolExhaustedError
+from sales_aggregates import SalesAggregateStore, item_key
+from basket_rules import BasketRuleService, MiningMemoryError, SORT_KEYS
+from response_cache import DataVersions, ResponseCache, cached, conditional, invalidate, invalidates, uncacheable
+from print_spooler import PrintSpooler, SpoolerFullError
+from printer_health import PrinterHealth, PrinterUnavailableError
+from stored_formats import StoredFormatRegistry
+from label_templates import templates as label_templates
+from price_changes import PriceChangeTracker
+from printer_groups import NoPrinterAvailableError, PrinterGroups
+from item_cache import ItemCache
+from firestore_mirror import CollectionMirror
+from firestore_queue import WriteBehindQueue
+from firestore_sync import BatchWriter, FingerprintStore, FIRESTORE_BATCH_LIMIT, UPLOAD, fingerprint, plan_sync
+
 # Import the employee_performance blueprint (assumed to be in a separate file)
 from employee_performance import employee_performance_bp
 
@@ -33,18 +51,266 @@ app.register_blueprint(employee_performance_bp)
 server = 'DESKTOP-ACJEA5K\\PCAMERICA'  # Your server name
 database = 'cresqlp'                   # Your database name
 connection_string = f'DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={server};DATABASE={database};Trusted_Connection=yes;'
-
-def get_db_connection():
-    """Establish and return a database connection."""
-    conn = pyodbc.connect(connection_string)
+DEFAULT_STORE_ID = '1001'              # the store new items are created in
+
+# Connection pool settings (seconds unless noted)
+DB_POOL_MAX_SIZE = 10          # connections
+DB_POOL_CHECKOUT_TIMEOUT = 15
+DB_POOL_MAX_IDLE = 300
+DB_POOL_PING_INTERVAL = 30
+DB_POOL_LEAK_TIMEOUT = 60
+
+db_pool = ConnectionPool(
+    lambda: pyodbc.connect(connection_string),
+    max_size=DB_POOL_MAX_SIZE,
+    checkout_timeout=DB_POOL_CHECKOUT_TIMEOUT,
+    max_idle=DB_POOL_MAX_IDLE,
+    ping_interval=DB_POOL_PING_INTERVAL,
+    leak_timeout=DB_POOL_LEAK_TIMEOUT,
+)
+
+def get_db_connection(owner=None):
+    """Check out a pooled database connection; close() returns it to the pool."""
+    if owner is None:
+        owner = f"{request.method} {request.path}" if has_request_context() else "background"
+    conn = db_pool.connection(owner=owner)
+    if has_request_context():
+        g.setdefault('db_connections', []).append(conn)
     return conn
 
+@app.teardown_request
+def release_db_connections(exc):
+    """Return any connection a route forgot to close once the request ends."""
+    for conn in g.pop('db_connections', []):
+        conn.close()
+
+@app.errorhandler(PoolExhaustedError)
+def handle_pool_exhausted(e):
+    print("Connection pool exhausted:", str(e))
+    return jsonify({"error": "Database busy, please retry", "details": str(e)}), 503
+
+# Per-item sales aggregates, advanced from the last Invoice_Number seen
+SALES_AGGREGATE_SNAPSHOT = 'sales_aggregates.json'
+SALES_AGGREGATE_REFRESH_INTERVAL = 5   # seconds between incremental refreshes
+SALES_AGGREGATE_RESCAN_WINDOW = 500    # newest invoice numbers re-read on every refresh (open/held invoices)
+TOP_SELLING_LIMIT = 10
+TOP_SELLING_LOOKUP_CHUNK = 50
+
+sales_aggregates = SalesAggregateStore(
+    snapshot_path=SALES_AGGREGATE_SNAPSHOT,
+    refresh_interval=SALES_AGGREGATE_REFRESH_INTERVAL,
+    rescan_window=SALES_AGGREGATE_RESCAN_WINDOW,
+)
+
+# Market basket rules: mined once, re-mined in the background after enough new invoices
+BASKET_REFRESH_THRESHOLD = 50      # new invoices before a background re-mine
+BASKET_CHECK_INTERVAL = 60         # seconds between new-invoice checks
+BASKET_MINING_MEMORY_LIMIT_MB = 512  # refuse mining runs estimated above this
+BASKET_RESCAN_WINDOW = 500         # newest invoice numbers whose baskets are re-read on every load
+DEFAULT_RULES_LIMIT = 20
+DEFAULT_RECOMMENDATIONS = 5
+MAX_CART_ITEMS = 200
+MAX_RULES_LIMIT = 1000
+
+basket_rules = BasketRuleService(
+    refresh_threshold=BASKET_REFRESH_THRESHOLD,
+    check_interval=BASKET_CHECK_INTERVAL,
+    max_bytes=BASKET_MINING_MEMORY_LIMIT_MB * 1024 * 1024,
+    rescan_window=BASKET_RESCAN_WINDOW,
+)
+
+# Dashboard response cache; item write routes clear it
+RESPONSE_CACHE_MAX_ENTRIES = 256
+DASHBOARD_CACHE_TTLS = {          # seconds
+    'summary': 30,
+    'top_selling_items': 60,
+    'low_stock': 30,
+    'store_sales': 60,
+    'inventory_dashboard': 120,
+}
+
+response_cache = ResponseCache(max_entries=RESPONSE_CACHE_MAX_ENTRIES)
+
+# Inventory rows for item lookups (scanning) and label printing; item write routes clear both
+ITEM_CACHE_MAX_ENTRIES = 10000
+ITEM_CACHE_TTL = 300                # seconds; bounds staleness from edits made at the register
+ITEM_CACHE_NEGATIVE_TTL = 30        # seconds an unknown ItemNum is remembered as missing
+LABEL_ITEM_CACHE_TTL = 30           # seconds; a printed price may lag a register edit this long at most
+
+item_cache = ItemCache(
+    max_entries=ITEM_CACHE_MAX_ENTRIES,
+    ttl=ITEM_CACHE_TTL,
+    negative_ttl=ITEM_CACHE_NEGATIVE_TTL,
+)
+label_item_cache = ItemCache(       # ItemName and Price only, see load_label_items()
+    max_entries=ITEM_CACHE_MAX_ENTRIES,
+    ttl=LABEL_ITEM_CACHE_TTL,
+    negative_ttl=ITEM_CACHE_NEGATIVE_TTL,
+)
+
+# Version tokens behind the ETags of catalog and analytics routes
+DATA_VERSION_TTL = 2   # seconds a probed version is reused across requests
+
+# Metadata only: the row count from sys.partitions and the last write SQL Server
+# recorded against Inventory's indexes. Neither reads the table itself.
+INVENTORY_VERSION_QUERY = """
+    SELECT
+        HAS_PERMS_BY_NAME(NULL, NULL, 'VIEW SERVER STATE'),
+        (SELECT SUM(rows) FROM sys.partitions
+         WHERE object_id = OBJECT_ID('Inventory') AND index_id IN (0, 1)),
+        (SELECT MAX(last_user_update) FROM sys.dm_db_index_usage_stats
+         WHERE database_id = DB_ID() AND object_id = OBJECT_ID('Inventory'))
+"""
+
+def probe_inventory_version():
+    """
+    Row count plus the time of the last write to Inventory, both read from
+    catalog views. Without VIEW SERVER STATE the usage stats are invisible,
+    so it falls back to a checksum of the whole table (a full scan).
+    """
+    conn = get_db_connection(owner="data version probe")
+    try:
+        cursor = conn.cursor()
+        cursor.execute(INVENTORY_VERSION_QUERY)
+        can_view_stats, count, last_update = cursor.fetchone()
+        if can_view_stats:
+            # last_update is NULL until the first write after a server restart.
+            return f"{count}:{last_update.isoformat() if last_update else 0}"
+        cursor.execute("SELECT COUNT_BIG(*), CHECKSUM_AGG(BINARY_CHECKSUM(*)) FROM Inventory")
+        count, checksum = cursor.fetchone()
+        return f"{count}:{checksum}"
+    finally:
+        conn.close()
+
+def probe_invoice_version():
+    """
+    Latest Invoice_Number (new sales always get a higher one) plus the line
+    count of the invoices still in the sales rescan window, so lines added to
+    an open or held invoice change the version too.
+    """
+    conn = get_db_connection(owner="data version probe")
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT ISNULL(MAX(Invoice_Number), 0) FROM invoice_totals")
+        latest = cursor.fetchone()[0]
+        cursor.execute(
+            "SELECT COUNT_BIG(*) FROM invoice_itemized WHERE Invoice_Number > ?",
+            (latest - SALES_AGGREGATE_RESCAN_WINDOW,)
+        )
+        return f"{latest}:{cursor.fetchone()[0]}"
+    finally:
+        conn.close()
+
+data_versions = DataVersions(
+    {'inventory': probe_inventory_version, 'invoices': probe_invoice_version},
+    ttl=DATA_VERSION_TTL,
+)
+
+# Print spooler: one queue, worker and reusable connection per printer IP
+PRINTER_PORT = 9100                 # Default Zebra port
+PRINTER_CONNECT_TIMEOUT = 5         # seconds
+PRINTER_SEND_TIMEOUT = 10           # seconds
+PRINTER_IDLE_CLOSE = 30             # seconds before an idle printer connection is released
+PRINT_JOB_RETRIES = 2
+PRINT_JOB_HISTORY = 1000            # finished jobs kept for the status endpoint
+PRINT_QUEUE_MAX_JOBS = 100          # jobs waiting per printer before new ones get a 503
+PRINT_SPOOLER_MAX_PRINTERS = 64
+PRINTER_REAP_AFTER = 600            # seconds an idle printer's worker thread is kept
+# Optional allow-list of printer networks, e.g. ['192.168.1.0/24', '100.64.0.0/10'];
+# empty allows any IP address. Printer group members are always allowed.
+PRINTER_NETWORKS = []
+PRINTER_FAILURE_THRESHOLD = 3       # consecutive errors before a printer's circuit opens
+PRINTER_RESET_TIMEOUT = 30          # seconds an open circuit waits before a trial send
+PRINTER_PROBE_INTERVAL = 15         # seconds between background reachability probes
+PRINTER_PROBE_TIMEOUT = 2           # seconds
+
+printer_health = PrinterHealth(
+    port=PRINTER_PORT,
+    failure_threshold=PRINTER_FAILURE_THRESHOLD,
+    reset_timeout=PRINTER_RESET_TIMEOUT,
+    probe_interval=PRINTER_PROBE_INTERVAL,
+    probe_timeout=PRINTER_PROBE_TIMEOUT,
+)
+
+# Stored label formats (^DF once per printer, then ^XF + field data per label)
+STORED_FORMAT_DEVICE = 'E'          # printer flash, survives a power cycle
+STORED_FORMAT_TTL = 3600            # seconds before a format is downloaded again anyway
+
+stored_formats = StoredFormatRegistry(ttl=STORED_FORMAT_TTL)
+printer_health.add_failure_listener(stored_formats.forget)
+
+# Price change detection for "labels for everything that changed since ..."
+PRICE_CHANGE_SNAPSHOT = 'price_changes.json'
+PRICE_CHANGE_SCAN_INTERVAL = 300    # seconds between Inventory price scans
+
+price_changes = PriceChangeTracker(
+    store_id=DEFAULT_STORE_ID,
+    snapshot_path=PRICE_CHANGE_SNAPSHOT,
+    scan_interval=PRICE_CHANGE_SCAN_INTERVAL,
+)
+
+@app.before_request
+def start_price_change_scan():
+    """Start scanning with the first request rather than on import (tooling, reloader parent)."""
+    price_changes.start(get_db_connection)
+
+print_spooler = PrintSpooler(
+    port=PRINTER_PORT,
+    connect_timeout=PRINTER_CONNECT_TIMEOUT,
+    send_timeout=PRINTER_SEND_TIMEOUT,
+    idle_close=PRINTER_IDLE_CLOSE,
+    max_retries=PRINT_JOB_RETRIES,
+    max_finished_jobs=PRINT_JOB_HISTORY,
+    health=printer_health,
+    max_queued_jobs=PRINT_QUEUE_MAX_JOBS,
+    max_printers=PRINT_SPOOLER_MAX_PRINTERS,
+    reap_after=PRINTER_REAP_AFTER,
+)
+# The prober's TCP connect would compete with the spooler's open 9100 connection.
+printer_health.skip_probes_while(print_spooler.connected)
+
+# Printer groups: one name for several printers, jobs split by queue depth and send rate
+PRINTER_GROUPS_FILE = 'printer_groups.json'
+PRINTER_GROUP_CHUNK = 100           # labels per job when a batch is split across a group
+
+printer_groups = PrinterGroups(
+    print_spooler,
+    printer_health,
+    snapshot_path=PRINTER_GROUPS_FILE,
+    chunk_size=PRINTER_GROUP_CHUNK,
+)
+
+UPDATED_AT_FIELD = 'updatedAt'         # server timestamp stamped on every Firestore Inventory write
+
+# Write-behind queue for item uploads to Firestore (journaled locally, flushed in batches)
+FIRESTORE_QUEUE_DB = 'firestore_queue.sqlite3'
+FIRESTORE_QUEUE_FLUSH_INTERVAL = 0.5   # seconds the worker waits when the journal is empty
+FIRESTORE_QUEUE_MAX_ATTEMPTS = 5       # per document, counted only when Firestore rejects the document itself
+FIRESTORE_QUEUE_MAX_BACKOFF = 60       # seconds; longest wait between retries while Firestore is down
+
+inventory_write_queue = WriteBehindQueue(
+    FIRESTORE_QUEUE_DB,
+    "Inventory",
+    flush_interval=FIRESTORE_QUEUE_FLUSH_INTERVAL,
+    max_attempts=FIRESTORE_QUEUE_MAX_ATTEMPTS,
+    max_backoff=FIRESTORE_QUEUE_MAX_BACKOFF,
+    stamp_field=UPDATED_AT_FIELD,
+    on_written=lambda documents: record_uploaded_fingerprints(documents),
+)
+
+# In-memory mirror of the Firestore Inventory collection, kept current by a snapshot listener
+FIRESTORE_MIRROR_CHECK_INTERVAL = 30   # seconds between checks that the listener is still running
+
+inventory_mirror = CollectionMirror("Inventory", check_interval=FIRESTORE_MIRROR_CHECK_INTERVAL)
+
 # ------------------------------------------------------------------------------
 # Firebase Initialization
 # ------------------------------------------------------------------------------
 cred = credentials.Certificate("firebase-adminsdk.json")  # Ensure this file is secured
 firebase_admin.initialize_app(cred)
 db = firestore.client()
+inventory_write_queue.start(db)
+inventory_mirror.start(db)
 
 # ------------------------------------------------------------------------------
 # Helper Functions
@@ -58,39 +324,200 @@ def to_bit(value):
 def send_zpl_to_printer(ip_address, zpl_code):
     """Send ZPL code to a Zebra printer at the given IP address."""
     try:
-        printer_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        printer_socket.connect((ip_address, 9100))  # Default Zebra port
-        printer_socket.sendall(zpl_code.encode('utf-8'))
-        printer_socket.close()
+        stream_zpl_to_printer(ip_address, [zpl_code])
         return "Print command sent successfully."
     except Exception as e:
         return f"Error sending print command: {e}"
 
-def get_existing_items():
-    """Query local DB to get existing items (used in Firebase sync)."""
-    connection = get_db_connection()
-    cursor = connection.cursor()
-    cursor.execute("SELECT ItemNum, ItemName, Cost, Price FROM Inventory")
-    items = cursor.fetchall()
-    connection.close()
-    return [{'ItemNum': item[0], 'ItemName': item[1], 'Cost': item[2], 'Price': item[3]} for item in items]
+def stream_zpl_to_printer(ip_address, zpl_documents, on_sent=None):
+    """
+    Send several ZPL documents over a single printer connection, one sendall()
+    per document. ``on_sent(index)`` is called after each document is handed to
+    the socket; a connection or send error propagates to the caller, and
+    PrinterUnavailableError is raised without connecting while the printer's
+    circuit is open.
+    """
+    printer_health.allow(ip_address)
+    try:
+        with socket.create_connection((ip_address, PRINTER_PORT), timeout=PRINTER_CONNECT_TIMEOUT) as printer_socket:
+            printer_socket.settimeout(PRINTER_SEND_TIMEOUT)
+            for index, zpl_code in enumerate(zpl_documents):
+                printer_socket.sendall(zpl_code.encode('utf-8'))
+                if on_sent:
+                    on_sent(index)
+    except OSError as e:
+        printer_health.record_failure(ip_address, e)
+        raise
+    else:
+        printer_health.record_success(ip_address)
+    finally:
+        printer_health.release_trial(ip_address)
+
+# ------------------------------------------------------------------------------
+# Keyset Pagination Helpers
+# ------------------------------------------------------------------------------
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+
+def encode_page_cursor(key_values):
+    """Encode the last row's key values as an opaque next-page token."""
+    raw = json.dumps(key_values, default=str).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_page_cursor(token):
+    """Decode a token produced by encode_page_cursor()."""
+    try:
+        key_values = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+    except (ValueError, UnicodeError):
+        raise ValueError("Invalid 'after' cursor.")
+    if not isinstance(key_values, list):
+        raise ValueError("Invalid 'after' cursor.")
+    return key_values
+
+def parse_page_args():
+    """
+    Read the ``limit``/``after`` query parameters.
+    Returns None when the client did not ask for pagination, else (limit, after_key).
+    """
+    if 'limit' not in request.args and 'after' not in request.args:
+        return None
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValueError("'limit' must be an integer.")
+    if limit < 1:
+        raise ValueError("'limit' must be at least 1.")
+    limit = min(limit, MAX_PAGE_SIZE)
+    after = request.args.get('after')
+    after_key = decode_page_cursor(after) if after else None
+    return limit, after_key
+
+def fetch_keyset_page(cursor, columns, table, key_columns, limit, after_key=None, descending=False):
+    """
+    Fetch one page of ``columns`` from ``table`` ordered by ``key_columns``,
+    starting strictly after ``after_key``. The key columns are appended to the
+    select list so existing index-based row mapping is unaffected.
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    if after_key is not None and len(after_key) != len(key_columns):
+        raise ValueError("Invalid 'after' cursor.")
+    key_select = ", ".join(f"{col} AS _page_key{i}" for i, col in enumerate(key_columns))
+    direction = " DESC" if descending else ""
+    op = "<" if descending else ">"
+    params = [limit + 1]
+    where = ""
+    if after_key is not None:
+        # (k1 > ?) OR (k1 = ? AND k2 > ?) ... so a composite key seeks in one index range.
+        clauses = []
+        for i, col in enumerate(key_columns):
+            terms = [f"{key_columns[j]} = ?" for j in range(i)] + [f"{col} {op} ?"]
+            clauses.append("(" + " AND ".join(terms) + ")")
+            params.extend(after_key[:i + 1])
+        where = " WHERE " + " OR ".join(clauses)
+    order_by = ", ".join(col + direction for col in key_columns)
+    cursor.execute(f"SELECT TOP (?) {columns}, {key_select} FROM {table}{where} ORDER BY {order_by}", params)
+    rows = cursor.fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_page_cursor([last[len(last) - len(key_columns) + i] for i in range(len(key_columns))])
+    return rows, next_cursor
+
+def page_response(data, next_cursor, limit):
+    """Standard envelope for paginated list responses."""
+    return jsonify({"data": data, "next_cursor": next_cursor, "limit": limit})
 
-def fetch_inventory_data():
-    """Fetch inventory data from the database."""
-    with pyodbc.connect(connection_string) as conn:
+# ------------------------------------------------------------------------------
+# Streaming Response Helpers
+# ------------------------------------------------------------------------------
+STREAM_BATCH_SIZE = 1000
+STREAM_FORMATS = ('ndjson', 'json')
+
+def requested_stream_format():
+    """
+    Read the ``stream`` query parameter.
+    Returns None when streaming was not requested, else 'ndjson' or 'json'.
+    Streaming always returns the full result, so it cannot be combined with
+    the keyset paging parameters.
+    """
+    stream_format = request.args.get('stream')
+    if stream_format is None:
+        return None
+    if stream_format not in STREAM_FORMATS:
+        raise ValueError(f"'stream' must be one of: {', '.join(STREAM_FORMATS)}.")
+    if 'limit' in request.args or 'after' in request.args:
+        raise ValueError("'stream' cannot be combined with 'limit' or 'after'.")
+    return stream_format
+
+def stream_query(stream_format, query, row_to_dict, params=()):
+    """
+    Execute ``query`` and stream its rows to the client ``STREAM_BATCH_SIZE``
+    at a time via cursor.fetchmany(), so only one batch is ever in memory.
+    'ndjson' writes one object per line; 'json' writes a single array in chunks.
+    """
+    # Run the query before the response starts so SQL errors still return a 500.
+    conn = get_db_connection()
+    try:
         cursor = conn.cursor()
-        cursor.execute("SELECT TOP 100 itemNum, itemName, cost, price FROM Inventory")
-        rows = cursor.fetchall()
-        inventory_data = []
-        for row in rows:
-            item = {
-                'itemNum': row[0],
-                'itemName': row[1],
-                'cost': row[2],
-                'price': row[3]
-            }
-            inventory_data.append(item)
-    return inventory_data
+        cursor.execute(query, params)
+        columns = [column[0] for column in cursor.description]
+    except Exception:
+        conn.close()
+        raise
+
+    def generate():
+        try:
+            first = True
+            if stream_format == 'json':
+                yield "["
+            while True:
+                rows = cursor.fetchmany(STREAM_BATCH_SIZE)
+                if not rows:
+                    break
+                encoded = [app.json.dumps(row_to_dict(row, columns)) for row in rows]
+                if stream_format == 'ndjson':
+                    yield "\n".join(encoded) + "\n"
+                else:
+                    yield ("" if first else ",") + ",".join(encoded)
+                first = False
+            if stream_format == 'json':
+                yield "]"
+        except Exception as e:
+            # Headers are already sent, so the best we can do is log and end the stream.
+            print("Error while streaming response:", str(e))
+        finally:
+            conn.close()
+
+    mimetype = 'application/x-ndjson' if stream_format == 'ndjson' else 'application/json'
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+
+# ------------------------------------------------------------------------------
+# Database Pool Stats API
+# ------------------------------------------------------------------------------
+@app.route('/api/db_pool/stats', methods=['GET'])
+def get_db_pool_stats():
+    """
+    Returns connection pool occupancy, counters and any connections held past the leak deadline.
+    """
+    return jsonify(db_pool.stats()), 200
+
+
+# ------------------------------------------------------------------------------
+# Response Cache Stats API
+# ------------------------------------------------------------------------------
+@app.route('/api/response_cache/stats', methods=['GET'])
+def get_response_cache_stats():
+    """
+    Returns per-endpoint hit/miss/expiry counters and the last invalidation.
+    """
+    return jsonify(response_cache.stats()), 200
+
+@app.route('/api/response_cache/clear', methods=['POST'])
+def clear_response_cache():
+    response_cache.invalidate(reason="manual clear")
+    return jsonify({"success": True}), 200
 
 
 # ------------------------------------------------------------------------------
@@ -191,12 +618,28 @@ def get_invoice_totals():
 
 @app.route('/api/invoices', methods=['GET'])
 def get_invoices():
+    try:
+        page = parse_page_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute("SELECT invoice_number, total_price, DateTime FROM invoice_totals ORDER BY DateTime DESC")
-        invoices = [{"invoice_number": row[0], "total_price": row[1], "DateTime": row[2]} for row in cursor.fetchall()]
+        if page:
+            limit, after_key = page
+            # Newest first, keyed on Invoice_Number so each page is an index seek.
+            rows, next_cursor = fetch_keyset_page(
+                cursor, "invoice_number, total_price, DateTime", "invoice_totals",
+                ["Invoice_Number"], limit, after_key, descending=True
+            )
+        else:
+            # Same order as the paged mode, so limit only changes how much comes back.
+            cursor.execute("SELECT invoice_number, total_price, DateTime FROM invoice_totals ORDER BY Invoice_Number DESC")
+            rows = cursor.fetchall()
+        invoices = [{"invoice_number": row[0], "total_price": row[1], "DateTime": row[2]} for row in rows]
         conn.close()
+        if page:
+            return page_response(invoices, next_cursor, limit)
         return jsonify(invoices)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -217,23 +660,21 @@ def get_invoice_details(invoice_number):
 # Dashboard & Inventory Insights APIs
 # ------------------------------------------------------------------------------
 @app.route('/api/dashboard/summary', methods=['GET'])
+@conditional(data_versions, 'inventory', 'invoices')
+@cached(response_cache, ttl=DASHBOARD_CACHE_TTLS['summary'])
 def dashboard_summary():
     """
     Returns a summary with overall total revenue and total inventory value.
     """
     try:
+        sales_aggregates.refresh_if_stale(get_db_connection)
         conn = get_db_connection()
         cursor = conn.cursor()
-        query = """
-            SELECT 
-                (SELECT ISNULL(SUM(PricePer * Quantity), 0) FROM invoice_itemized) AS TotalRevenue,
-                (SELECT ISNULL(SUM(In_Stock * Cost), 0) FROM inventory) AS TotalInventoryValue;
-        """
-        cursor.execute(query)
+        cursor.execute("SELECT ISNULL(SUM(In_Stock * Cost), 0) AS TotalInventoryValue FROM inventory")
         result = cursor.fetchone()
         summary = {
-            "TotalRevenue": float(result[0]),
-            "TotalInventoryValue": float(result[1])
+            "TotalRevenue": float(sales_aggregates.revenue),
+            "TotalInventoryValue": float(result[0])
         }
         conn.close()
         return jsonify(summary)
@@ -245,34 +686,42 @@ def dashboard_summary():
 
 
 @app.route('/api/dashboard/top-selling-items', methods=['GET'])
+@conditional(data_versions, 'inventory', 'invoices')
+@cached(response_cache, ttl=DASHBOARD_CACHE_TTLS['top_selling_items'])
 def top_selling_items():
     """
     Returns the top 10 selling items based on total quantity sold and revenue.
     """
     try:
+        sales_aggregates.refresh_if_stale(get_db_connection)
+        ranked = sales_aggregates.ranked_by_units()
         conn = get_db_connection()
         cursor = conn.cursor()
-        query = """
-            SELECT TOP 10
-                i.ItemNum, i.ItemName, 
-                SUM(ii.Quantity) AS TotalSold, 
-                SUM(ii.Quantity * ii.PricePer) AS TotalRevenue
-            FROM invoice_itemized ii
-            JOIN inventory i ON ii.ItemNum = i.ItemNum
-            GROUP BY i.ItemNum, i.ItemName
-            ORDER BY TotalSold DESC;
-        """
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        items = [
-            {
-                "ItemNum": row[0],
-                "ItemName": row[1],
-                "TotalSold": float(row[2]),
-                "TotalRevenue": float(row[3])
-            }
-            for row in rows
-        ]
+        items = []
+        # Walk the ranking a chunk at a time; items sold but no longer in inventory
+        # are skipped, as the old JOIN against inventory did.
+        for start in range(0, len(ranked), TOP_SELLING_LOOKUP_CHUNK):
+            chunk = ranked[start:start + TOP_SELLING_LOOKUP_CHUNK]
+            placeholders = ", ".join("?" for _ in chunk)
+            cursor.execute(
+                f"SELECT ItemNum, ItemName FROM inventory WHERE ItemNum IN ({placeholders})",
+                [entry[0] for entry in chunk]
+            )
+            names = {item_key(row[0]): row for row in cursor.fetchall()}
+            for item_num, total_sold, total_revenue in chunk:
+                match = names.get(item_key(item_num))
+                if match is None:
+                    continue
+                items.append({
+                    "ItemNum": match[0],
+                    "ItemName": match[1],
+                    "TotalSold": float(total_sold),
+                    "TotalRevenue": float(total_revenue)
+                })
+                if len(items) == TOP_SELLING_LIMIT:
+                    break
+            if len(items) == TOP_SELLING_LIMIT:
+                break
         conn.close()
         return jsonify(items)
     except Exception as e:
@@ -281,26 +730,16 @@ def top_selling_items():
     
 
 @app.route('/api/dashboard/item/<itemNum>', methods=['GET'])
+@conditional(data_versions, 'inventory', 'invoices')
 def item_performance(itemNum):
     """
     Retrieves detailed performance data for a specific item.
     """
     try:
+        sales_aggregates.refresh_if_stale(get_db_connection)
         conn = get_db_connection()
         cursor = conn.cursor()
-        query = """
-            SELECT i.*, 
-                   COALESCE(s.TotalSold, 0) AS TotalSold,
-                   COALESCE(s.TotalRevenue, 0) AS TotalRevenue
-            FROM inventory i
-            LEFT JOIN (
-                SELECT ItemNum, SUM(Quantity) AS TotalSold, SUM(Quantity * PricePer) AS TotalRevenue
-                FROM invoice_itemized
-                GROUP BY ItemNum
-            ) s ON i.ItemNum = s.ItemNum
-            WHERE i.ItemNum = ?;
-        """
-        cursor.execute(query, (itemNum,))
+        cursor.execute("SELECT * FROM inventory WHERE ItemNum = ?", (itemNum,))
         row = cursor.fetchone()
         if row is None:
             conn.close()
@@ -308,10 +747,10 @@ def item_performance(itemNum):
 
         columns = [column[0] for column in cursor.description]
         item = {columns[i]: row[i] for i in range(len(columns))}
-        if 'TotalSold' in item and item['TotalSold'] is not None:
-            item['TotalSold'] = float(item['TotalSold'])
-        if 'TotalRevenue' in item and item['TotalRevenue'] is not None:
-            item['TotalRevenue'] = float(item['TotalRevenue'])
+        sales = sales_aggregates.get(itemNum)
+        item['TotalSold'] = float(sales['TotalSold'])
+        item['TotalRevenue'] = float(sales['TotalRevenue'])
+        item['LastSaleDate'] = sales['LastSold']
         conn.close()
         return jsonify(item)
     except Exception as e:
@@ -320,38 +759,34 @@ def item_performance(itemNum):
     
 
 @app.route('/api/dashboard/low-stock', methods=['GET'])
+@conditional(data_versions, 'inventory', 'invoices')
+@cached(response_cache, ttl=DASHBOARD_CACHE_TTLS['low_stock'])
 def low_stock():
     """
     Returns inventory items below reorder level along with sales information.
     """
     try:
+        sales_aggregates.refresh_if_stale(get_db_connection)
         conn = get_db_connection()
         cursor = conn.cursor()
         query = """
-            SELECT i.ItemNum, i.ItemName, i.In_Stock, i.Reorder_Level,
-                   COALESCE(s.TotalSold, 0) AS TotalSold,
-                   COALESCE(s.TotalRevenue, 0) AS TotalRevenue
-            FROM inventory i
-            LEFT JOIN (
-                SELECT ItemNum, SUM(Quantity) AS TotalSold, SUM(Quantity * PricePer) AS TotalRevenue
-                FROM invoice_itemized
-                GROUP BY ItemNum
-            ) s ON i.ItemNum = s.ItemNum
-            WHERE i.In_Stock < i.Reorder_Level;
+            SELECT ItemNum, ItemName, In_Stock, Reorder_Level
+            FROM inventory
+            WHERE In_Stock < Reorder_Level;
         """
         cursor.execute(query)
         rows = cursor.fetchall()
-        items = [
-            {
+        items = []
+        for row in rows:
+            sales = sales_aggregates.get(row[0])
+            items.append({
                 "ItemNum": row[0],
                 "ItemName": row[1],
                 "In_Stock": float(row[2]),
                 "Reorder_Level": float(row[3]),
-                "TotalSold": float(row[4]),
-                "TotalRevenue": float(row[5])
-            }
-            for row in rows
-        ]
+                "TotalSold": float(sales['TotalSold']),
+                "TotalRevenue": float(sales['TotalRevenue'])
+            })
         conn.close()
         return jsonify(items)
     except Exception as e:
@@ -359,6 +794,8 @@ def low_stock():
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/dashboard/store-sales/<storeId>', methods=['GET'])
+@conditional(data_versions, 'inventory', 'invoices')
+@cached(response_cache, ttl=DASHBOARD_CACHE_TTLS['store_sales'])
 def store_sales(storeId):
     """
     Provides a sales summary for a given store.
@@ -390,46 +827,108 @@ def store_sales(storeId):
         print("Error in /api/dashboard/store-sales/<storeId>:", str(e))
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/sales_aggregates/status', methods=['GET'])
+def sales_aggregates_status():
+    """
+    Returns the aggregate store's size, Invoice_Number high-water mark and last refresh cost.
+    """
+    try:
+        sales_aggregates.refresh_if_stale(get_db_connection)
+        return jsonify(sales_aggregates.stats()), 200
+    except Exception as e:
+        print("Error in /api/sales_aggregates/status:", str(e))
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/sales_aggregates/rebuild', methods=['POST'])
+def sales_aggregates_rebuild():
+    """
+    Re-aggregates the full invoice history, e.g. after past invoices were edited or voided.
+    """
+    try:
+        sales_aggregates.rebuild(get_db_connection)
+        return jsonify({"success": True, **sales_aggregates.stats()}), 200
+    except Exception as e:
+        print("Error in /api/sales_aggregates/rebuild:", str(e))
+        return jsonify({"error": str(e)}), 500
+
 # ------------------------------------------------------------------------------
 # Invoice Itemized, Inventory, and Customer APIs
 # ------------------------------------------------------------------------------
+def invoice_itemized_row(row, columns=None):
+    return {
+        'id': row[0],
+        'invoice_id': row[1],
+        'item_name': row[2],
+        'quantity': row[3],
+        'price': row[4]
+    }
+
 @app.route('/api/invoice_itemized', methods=['GET'])
 def get_invoice_itemized():
     try:
-        with pyodbc.connect(connection_string) as conn:
+        page = parse_page_args()
+        stream_format = requested_stream_format()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        if stream_format:
+            return stream_query(stream_format, "SELECT * FROM Invoice_Itemized", invoice_itemized_row)
+        with get_db_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT * FROM Invoice_Itemized")
-            rows = cursor.fetchall()
-            invoice_list = []
-            for row in rows:
-                invoice_list.append({
-                    'id': row[0],
-                    'invoice_id': row[1],
-                    'item_name': row[2],
-                    'quantity': row[3],
-                    'price': row[4]
-                })
+            if page:
+                limit, after_key = page
+                rows, next_cursor = fetch_keyset_page(
+                    cursor, "*", "Invoice_Itemized", ["Invoice_Number", "LineNum"], limit, after_key
+                )
+            else:
+                cursor.execute("SELECT * FROM Invoice_Itemized")
+                rows = cursor.fetchall()
+            invoice_list = [invoice_itemized_row(row) for row in rows]
+            if page:
+                return page_response(invoice_list, next_cursor, limit)
             return jsonify(invoice_list)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def inventory_row(row, columns=None):
+    return {
+        'id': row[0],
+        'name': row[1],
+        'quantity': row[2],
+        'price': row[3],
+        'In_Stock' : row[4],
+        'cost': row[5]
+    }
+
 @app.route('/api/inventory', methods=['GET'])
+@conditional(data_versions, 'inventory')
 def get_inventory():
     try:
-        with pyodbc.connect(connection_string) as conn:
+        page = parse_page_args()
+        stream_format = requested_stream_format()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        if stream_format:
+            return stream_query(
+                stream_format,
+                "SELECT itemnum, itemname, In_Stock, QuantityRequired, price, cost FROM Inventory",
+                inventory_row
+            )
+        with get_db_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT itemnum, itemname, In_Stock, QuantityRequired, price, cost FROM Inventory")
-            rows = cursor.fetchall()
-            inventory_list = []
-            for row in rows:
-                inventory_list.append({
-                    'id': row[0],
-                    'name': row[1],
-                    'quantity': row[2],
-                    'price': row[3],
-                    'In_Stock' : row[4],
-                    'cost': row[5]
-                })
+            if page:
+                limit, after_key = page
+                rows, next_cursor = fetch_keyset_page(
+                    cursor, "itemnum, itemname, In_Stock, QuantityRequired, price, cost", "Inventory",
+                    ["ItemNum", "Store_ID"], limit, after_key
+                )
+            else:
+                cursor.execute("SELECT itemnum, itemname, In_Stock, QuantityRequired, price, cost FROM Inventory")
+                rows = cursor.fetchall()
+            inventory_list = [inventory_row(row) for row in rows]
+            if page:
+                return page_response(inventory_list, next_cursor, limit)
             return jsonify(inventory_list)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -437,10 +936,20 @@ def get_inventory():
 @app.route('/api/customers', methods=['GET'])
 def get_customers():
     try:
-        with pyodbc.connect(connection_string) as conn:
+        page = parse_page_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        with get_db_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT * FROM Customer")
-            rows = cursor.fetchall()
+            if page:
+                limit, after_key = page
+                rows, next_cursor = fetch_keyset_page(
+                    cursor, "*", "Customer", ["CustNum"], limit, after_key
+                )
+            else:
+                cursor.execute("SELECT * FROM Customer")
+                rows = cursor.fetchall()
             customer_list = []
             for row in rows:
                 customer_list.append({
@@ -449,6 +958,8 @@ def get_customers():
                     'email': row[2],
                     'phone': row[3]
                 })
+            if page:
+                return page_response(customer_list, next_cursor, limit)
             return jsonify(customer_list)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -456,7 +967,7 @@ def get_customers():
 @app.route('/api/setup', methods=['GET'])
 def get_setup():
     try:
-        with pyodbc.connect(connection_string) as conn:
+        with get_db_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT * FROM Setup")
             rows = cursor.fetchall()
@@ -471,223 +982,711 @@ def get_setup():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# ------------------------------------------------------------------------------
+# Item Lookup Cache
+# ------------------------------------------------------------------------------
+def load_inventory_item(item_num):
+    """One Inventory row as a column -> value dict, or None."""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM Inventory WHERE ItemNum = ?", (item_num,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        columns = [column[0] for column in cursor.description]
+        return dict(zip(columns, row))
+
+def lookup_item(item_num):
+    """Cached Inventory row for ``item_num`` (None if it does not exist)."""
+    return item_cache.get(item_num, load_inventory_item)
+
+@app.route('/api/item_cache/stats', methods=['GET'])
+def get_item_cache_stats():
+    return jsonify({**item_cache.stats(), "label_cache": label_item_cache.stats()}), 200
+
 # ------------------------------------------------------------------------------
 # Label Printing API
 # ------------------------------------------------------------------------------
+def on_printer_network(address):
+    """True when PRINTER_NETWORKS is empty or one of its networks contains ``address``."""
+    return not PRINTER_NETWORKS or any(address in ipaddress.ip_network(net) for net in PRINTER_NETWORKS)
+
+def printer_address_error(ip_address):
+    """None if labels may be sent to ``ip_address``, otherwise the reason they may not."""
+    if not isinstance(ip_address, str):
+        return "ip_address must be a string"
+    if ip_address in printer_groups.members():
+        return None
+    try:
+        address = ipaddress.ip_address(ip_address)
+    except ValueError:
+        return f"'{ip_address}' is not an IP address"
+    if not on_printer_network(address):
+        return f"{ip_address} is not on a printer network"
+    return None
+
+def queue_requested(data):
+    """Queueing is opt-in: "queue": true in the body or ?async=1; otherwise labels are sent synchronously."""
+    return bool(data.get('queue')) or request.args.get('async', '').lower() in ('1', 'true')
+
+def dispatch_label(data, ip_address, zpl_code, item_num):
+    """
+    Send a label to the printer and wait for it (200), or with "queue": true
+    / ?async=1 hand it to the print spooler and return the job ID (202).
+    Printer "group" labels are always queued.
+    """
+    group = data.get('group')
+    if group:
+        try:
+            job = printer_groups.submit(group, [zpl_code], labels=[{"item_num": item_num}])[0]
+        except (NoPrinterAvailableError, SpoolerFullError) as e:
+            return jsonify({"error": str(e)}), 503
+        return jsonify({"message": "Print job queued.", "job_id": job.id, "printer": job.printer}), 202
+    if queue_requested(data):
+        try:
+            job = print_spooler.submit(ip_address, [zpl_code], labels=[{"item_num": item_num}])
+        except SpoolerFullError as e:
+            return jsonify({"error": str(e)}), 503
+        return jsonify({"message": "Print job queued.", "job_id": job.id}), 202
+    result = send_zpl_to_printer(ip_address, zpl_code)
+    return jsonify({"message": result}), 200
+
+# ------------------------------------------------------------------------------
+# Stored Label Formats
+# ------------------------------------------------------------------------------
+def stored_format_name(design):
+    return f"{STORED_FORMAT_DEVICE}:{design.upper()}.ZPL"
+
+def prepare_stored_format(printer, design):
+    """
+    Return the ^DF download document if ``printer`` does not hold the current
+    version of ``design`` yet, otherwise None. Nothing is recorded here: the
+    caller calls mark_stored_format() once the download has been sent.
+    """
+    template = label_templates.get(design)
+    name = stored_format_name(design)
+    if stored_formats.holds(printer, name, template.stored_version):
+        return None
+    return template.download(name)
+
+def mark_stored_format(printer, design):
+    """Record that the ^DF download of ``design`` reached ``printer``'s socket."""
+    stored_formats.mark(printer, stored_format_name(design), label_templates.get(design).stored_version)
+
+def mark_format_on_first_send(printer, design):
+    """Spooler on_sent hook for a job whose first document is the ^DF download."""
+    def on_sent(job, index):
+        if index == 0:
+            mark_stored_format(printer, design)
+    return on_sent
+
+def print_single_label(design):
+    """Shared body of /print_label and /print_design1-5: look up one item and print it."""
+    data = request.get_json() or {}
+    ip_address = data.get('ip_address')
+    item_num = data.get('item_num')
+    if not (ip_address or data.get('group')) or item_num is None:
+        return jsonify({"error": "ip_address (or group) and item_num are required"}), 400
+    if data.get('group') and data['group'] not in printer_groups:
+        return jsonify({"error": f"Unknown printer group '{data['group']}'"}), 404
+    if not data.get('group'):
+        address_error = printer_address_error(ip_address)
+        if address_error:
+            return jsonify({"error": address_error}), 400
+    try:
+        item = fetch_label_items([str(item_num)]).get(item_key(item_num))
+    except Exception as e:
+        print(f"Error printing {design}:", str(e))
+        return jsonify({"error": str(e)}), 500
+    if item is None:
+        return jsonify({"error": "Item not found"}), 404
+    item_name, price = item
+    zpl_code = label_templates.render(design, item_num, item_name, price)
+    return dispatch_label(data, ip_address, zpl_code, item_num)
+
 @app.route('/print_label', methods=['POST'])
 def print_label():
-    data = request.get_json()
-    ip_address = data['ip_address']
-    item_num = data['item_num']
-    
-    # Fetch item data from DB
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT itemname, price FROM inventory WHERE itemnum = ?", (item_num,))
-    item = cursor.fetchone()
-    
-    if item:
-        item_name, price = item
-        zpl_code = f"""
-        XA
-        ^FO10,20^A0N,50,50^FD Product Name: {item_name} ^FS
-        ^FO10,100^A0N,40,40^FD Barcode: ^FS
-        ^BY3,3,100^FO10,150^BCN,100,Y,N,N^FD {item_num} ^FS
-        ^FO10,200^A0N,50,50^FD Price: {price} ^FS
-        ^XZ
-        """
-        result = send_zpl_to_printer(ip_address, zpl_code)
-        return jsonify({"message": result}), 200
-    else:
-        return jsonify({"error": "Item not found"}), 404
-    
+    return print_single_label('label')
+
 # ------------------------------------------------------------------------------
-# Other designs API
+# Other designs API (layouts live in label_templates.py)
 # ------------------------------------------------------------------------------
 
 # Design 1: Uses cash_price and card_price
 @app.route('/print_design1', methods=['POST'])
 def print_design1():
-    data = request.get_json()
-    ip_address = data['ip_address']
-    item_num = data['item_num']
-
-    # Fetch item data from DB including cash and card prices
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT itemname, price FROM inventory WHERE itemnum = ?", (item_num,))
-    row = cursor.fetchone()
-    
-    if row:
-        item_name, price = row
-        cash_price = float(price)
-        card_price = round(cash_price * 1.05, 2)
-
-        zpl_code = f"""
-^XA
-^PW457           ; Set label width (approx 2.25 inches at 203 dpi)
-^LL254           ; Set label length (approx 1.25 inches at 203 dpi)
-
-^CF0,30         ; Increase product name font to 30 dots tall
-^FO10,15^FD{item_name}^FS
-
-^FO10,45
-^BY2,2,40       ; Adjust barcode module width, ratio and height
-^BCN,40,Y,N,N^FD{item_num}^FS
-
-^CF0,35         ; Increase price details font to 35 dots tall
-^FO10,150^FDCash: ${cash_price}^FS
-^FO240,150^FDCredit: ${card_price}^FS
-^XZ
-"""
-        result = send_zpl_to_printer(ip_address, zpl_code)
-        return jsonify({"message": result}), 200
-    else:
-        return jsonify({"error": "Item not found"}), 404
-
+    return print_single_label('design1')
 
 # Design 2: Uses a single price field
 @app.route('/print_design2', methods=['POST'])
 def print_design2():
-    data = request.get_json()
-    ip_address = data['ip_address']
-    item_num = data['item_num']
-
-    # Fetch item data from DB including price
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT itemname, price FROM inventory WHERE itemnum = ?", (item_num,))
-    row = cursor.fetchone()
-    
-    if row:
-        item_name, price = row
-        price = float(price)
-    
-        zpl_code = f"""
-^XA
-^CF0,30            ; Increased font for product name to 30-dots height
-^FO10,15^FD{item_name}^FS
-
-^CF0,16            ; Slightly smaller font for the "Barcode:" label
-^FO10,35^FD ^FS
-
-^BY2,2,50         ; Set barcode module width and height (adjust if needed)
-^FO10,50^BCN,50,Y,N,N^FD{item_num}^FS
-
-^CF0,70            ; Increased font for the price to 30-dots height
-^FO10,140^FD${price}^FS
-^XZ
-
-"""
-        result = send_zpl_to_printer(ip_address, zpl_code)
-        return jsonify({"message": result}), 200
-    else:
-        return jsonify({"error": "Item not found"}), 404
+    return print_single_label('design2')
 
 # Design 3: Uses cash_price and card_price
 @app.route('/print_design3', methods=['POST'])
 def print_design3():
-    data = request.get_json()
-    ip_address = data.get('ip_address')
-    item_num = data.get('item_num')
+    return print_single_label('design3')
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT itemname, price FROM inventory WHERE itemnum = ?",
-        (item_num,)
-    )
-    row = cursor.fetchone()
+# Design 4: Uses a single price field and prints a rotated barcode
+@app.route('/print_design4', methods=['POST'])
+def print_design4():
+    return print_single_label('design4')
 
-    if not row:
-        return jsonify({"error": "Item not found"}), 404
+# Design 5: Uses a single price field with a formatted field block for item name and price
+@app.route('/print_design5', methods=['POST'])
+def print_design5():
+    return print_single_label('design5')
 
-    item_name, price = row
-    cash_price = float(price)
-    credit_price = round(cash_price * 1.05, 2)
 
-    zpl_code = f"""
-^XA
-^CF0,20
-^FO10,15^FD{item_name}^FS
 
-^BY2,2,50
-^FO10,55^BCN,50,N,N,N^FD{item_num}^FS
+# ------------------------------------------------------------------------------
+# Batch Label Printing API
+# ------------------------------------------------------------------------------
+MAX_BATCH_LABELS = 1000     # distinct items per request
+MAX_LABEL_COPIES = 100      # copies per item
+LABEL_LOOKUP_CHUNK = 2000   # SQL Server allows ~2100 parameters per statement
+
+def parse_label_batch(items):
+    """Normalise [{"item_num", "copies"}] / ["ItemNum", ...] into [(item_num, copies)]."""
+    if not isinstance(items, list) or not items:
+        raise ValueError("items must be a non-empty list")
+    if len(items) > MAX_BATCH_LABELS:
+        raise ValueError(f"at most {MAX_BATCH_LABELS} items per batch")
+    batch = []
+    for entry in items:
+        if isinstance(entry, dict):
+            item_num = entry.get('item_num')
+            copies = entry.get('copies', 1)
+        else:
+            item_num, copies = entry, 1
+        if item_num is None or str(item_num).strip() == "":
+            raise ValueError("every item needs an item_num")
+        if not isinstance(copies, int) or isinstance(copies, bool) or not 1 <= copies <= MAX_LABEL_COPIES:
+            raise ValueError(f"copies must be an integer between 1 and {MAX_LABEL_COPIES}")
+        batch.append((str(item_num), copies))
+    return batch
+
+def load_label_items(item_nums):
+    """
+    item_key -> {"ItemName", "Price"} for the given items, one IN query per
+    chunk. DEFAULT_STORE_ID's row wins when an item is stocked by several
+    stores.
+    """
+    found = {}
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        for start in range(0, len(item_nums), LABEL_LOOKUP_CHUNK):
+            chunk = item_nums[start:start + LABEL_LOOKUP_CHUNK]
+            placeholders = ", ".join("?" for _ in chunk)
+            cursor.execute(f"""
+                SELECT ItemNum, ItemName, Price FROM Inventory
+                WHERE ItemNum IN ({placeholders})
+                ORDER BY CASE WHEN Store_ID = ? THEN 0 ELSE 1 END
+            """, chunk + [DEFAULT_STORE_ID])
+            for item_num, item_name, price in cursor.fetchall():
+                found.setdefault(item_key(item_num), {'ItemName': item_name, 'Price': price})
+    return found
+
+def fetch_label_items(item_nums):
+    """
+    item_key -> (ItemName, Price) for every requested item that exists,
+    through label_item_cache (only the misses reach SQL Server).
+    """
+    rows = label_item_cache.get_many(item_nums, load_label_items)
+    return {key: (row['ItemName'], row['Price']) for key, row in rows.items()}
 
-^CF0,35
-^FO10,150^FDCash: ${cash_price:.2f}^FS
-^FO240,150^FDCredit: ${credit_price:.2f}^FS
-^XZ
-"""
-    result = send_zpl_to_printer(ip_address, zpl_code)
-    return jsonify({"message": result}), 200
+@app.route('/print_batch', methods=['POST'])
+def print_batch():
+    """
+    Print labels for many items over one printer connection.
+    Body: {"ip_address": "...", "design": "design1", "queue": true, "stored_format": true,
+           "items": [{"item_num": "123", "copies": 2}, "456", ...]}
+    "group": "<name>" instead of ip_address splits the labels across that
+    printer group (always queued).
+    By default the labels are sent now and each label is reported; with
+    "queue": true (or ?async=1) they go to the print spooler as one job and
+    the job ID is returned right away. Designs with a stored format are sent as
+    ^XF recalls (after a one-time ^DF download) unless "stored_format" is false.
+    """
+    data = request.get_json() or {}
+    ip_address = data.get('ip_address')
+    group = data.get('group')
+    design = data.get('design', 'label')
+    if not (ip_address or group):
+        return jsonify({"error": "ip_address or group is required"}), 400
+    if group and group not in printer_groups:
+        return jsonify({"error": f"Unknown printer group '{group}'"}), 404
+    if not group and printer_address_error(ip_address):
+        return jsonify({"error": printer_address_error(ip_address)}), 400
+    if design not in label_templates:
+        return jsonify({"error": f"design must be one of {label_templates.names()}"}), 400
+    try:
+        batch = parse_label_batch(data.get('items'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
+    try:
+        found = fetch_label_items([item_num for item_num, _ in batch])
+    except Exception as e:
+        print("Error in /print_batch:", str(e))
+        return jsonify({"error": str(e)}), 500
 
-# Design 4: Uses a single price field and prints a rotated barcode
-@app.route('/print_design4', methods=['POST'])
-def print_design4():
-    data = request.get_json()
-    ip_address = data['ip_address']
-    item_num = data['item_num']
+    use_stored_format = label_templates.get(design).has_stored_format and data.get('stored_format', True)
+    results = []
+    documents = []      # (index into results, or None for the format download; ZPL)
+    for item_num, copies in batch:
+        item = found.get(item_key(item_num))
+        if item is None:
+            results.append({"item_num": item_num, "copies": copies, "status": "not_found"})
+            continue
+        item_name, price = item
+        results.append({"item_num": item_num, "copies": copies, "status": "pending"})
+        if use_stored_format:
+            zpl_code = label_templates.recall(design, stored_format_name(design), item_num, item_name, price, copies)
+        else:
+            zpl_code = label_templates.render(design, item_num, item_name, price, copies)
+        documents.append((len(results) - 1, zpl_code))
 
-    # Fetch item data from DB including price
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT itemname, price FROM inventory WHERE itemnum = ?", (item_num,))
-    row = cursor.fetchone()
-    
-    if row:
-        item_name, price = row
-        price = float(price)
-        zpl_code = f"""
-^XA
-^CF0,30                        ; Set font for product name
-^FO10,15^FD{item_name}^FS       ; Print product name at (10,10)
-
-^CF0,60                       ; Use a slightly smaller font for the price
-^FO10,70^FD${price}^FS           ; Print price at (10,50)
-
-^BY2,2,80                      ; Set barcode parameters (module width, ratio, height)
-^FO300,10                      ; Position the barcode on the right (X=300, Y=10)
-^BCR,80,Y,N,N                  ; Print the barcode rotated 90° with height 80
-^FD{item_num}^FS               ; Barcode data
-^XZ
-"""
-        result = send_zpl_to_printer(ip_address, zpl_code)
-        return jsonify({"message": result}), 200
-    else:
-        return jsonify({"error": "Item not found"}), 404
+    if group:
+        preamble = (lambda printer: [prepare_stored_format(printer, design)]) if use_stored_format else None
+        try:
+            jobs = printer_groups.submit(
+                group,
+                [zpl_code for _, zpl_code in documents],
+                labels=[{"item_num": results[index]["item_num"], "copies": results[index]["copies"]}
+                        for index, _ in documents],
+                preamble=preamble,
+                on_preamble_sent=lambda printer: mark_stored_format(printer, design),
+            )
+        except (NoPrinterAvailableError, SpoolerFullError) as e:
+            return jsonify({"error": str(e)}), 503
+        for index, _ in documents:
+            results[index]["status"] = "queued"
+        return jsonify({
+            "design": design,
+            "group": group,
+            "stored_format": use_stored_format,
+            "requested": len(batch),
+            "queued": len(documents),
+            "not_found": len(batch) - len(documents),
+            "jobs": [{"job_id": job.id, "printer": job.printer, "documents": job.document_count} for job in jobs],
+            "results": results,
+        }), 202 if jobs else 200
+
+    format_downloaded = False
+    if use_stored_format and documents:
+        download = prepare_stored_format(ip_address, design)
+        if download:
+            documents.insert(0, (None, download))
+            format_downloaded = True
+
+    if queue_requested(data):
+        job = None
+        if documents:
+            try:
+                job = print_spooler.submit(
+                    ip_address,
+                    [zpl_code for _, zpl_code in documents],
+                    labels=[
+                        {"item_num": results[index]["item_num"], "copies": results[index]["copies"]}
+                        if index is not None else {"format": stored_format_name(design)}
+                        for index, _ in documents
+                    ],
+                    on_sent=mark_format_on_first_send(ip_address, design) if format_downloaded else None,
+                )
+            except SpoolerFullError as e:
+                return jsonify({"error": str(e)}), 503
+            for index, _ in documents:
+                if index is not None:
+                    results[index]["status"] = "queued"
+        queued = sum(1 for result in results if result["status"] == "queued")
+        return jsonify({
+            "design": design,
+            "stored_format": use_stored_format,
+            "format_downloaded": format_downloaded,
+            "bytes": sum(len(zpl_code) for _, zpl_code in documents),
+            "requested": len(batch),
+            "queued": queued,
+            "not_found": len(batch) - queued,
+            "job_id": job.id if job else None,
+            "results": results,
+        }), 202 if job else 200
+
+    printer_error = None
+    if documents:
+        def mark_sent(index):
+            if documents[index][0] is not None:
+                results[documents[index][0]]["status"] = "sent"
+            else:
+                mark_stored_format(ip_address, design)
+        try:
+            stream_zpl_to_printer(ip_address, (zpl_code for _, zpl_code in documents), on_sent=mark_sent)
+        except Exception as e:
+            if format_downloaded:
+                # The printer may not have stored the format; download it again next time.
+                stored_formats.forget(ip_address, reason=str(e))
+            printer_error = f"Error sending print command: {e}"
+            printer_down = isinstance(e, PrinterUnavailableError)
+            print("Error in /print_batch:", printer_error)
+            for result in results:
+                if result["status"] == "pending":
+                    result["status"] = "failed"
+                    result["error"] = printer_error
+
+    sent = sum(1 for result in results if result["status"] == "sent")
+    response = {
+        "design": design,
+        "stored_format": use_stored_format,
+        "format_downloaded": format_downloaded,
+        "bytes": sum(len(zpl_code) for _, zpl_code in documents),
+        "requested": len(batch),
+        "sent": sent,
+        "labels_sent": sum(result["copies"] for result in results if result["status"] == "sent"),
+        "not_found": sum(1 for result in results if result["status"] == "not_found"),
+        "failed": sum(1 for result in results if result["status"] == "failed"),
+        "results": results,
+    }
+    if printer_error:
+        response["error"] = printer_error
+        if sent:
+            return jsonify(response), 207
+        return jsonify(response), 503 if printer_down else 502
+    return jsonify(response), 200
 
-# Design 5: Uses a single price field with a formatted field block for item name and price
-@app.route('/print_design5', methods=['POST'])
-def print_design5():
-    data = request.get_json()
-    ip_address = data['ip_address']
-    item_num = data['item_num']
 
-    # Fetch item data from DB including price
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT itemname, price FROM inventory WHERE itemnum = ?", (item_num,))
-    row = cursor.fetchone()
-    
-    if row:
-        item_name, price = row
-        price = float(price) 
-        zpl_code = f"""
-^XA
-^CF0,30                              ; Set a smaller font for the item name
-^FO0,30^FB457,1,0,L^FD{item_name}^FS    ; Left align the item name in a 457-dot wide field
-
-^CF0,80                              ; Set a larger font for the price
-^FO0,110^FB457,1,0,C^FD${price}^FS       ; Center the price below the item name
-^XZ
-"""
-        result = send_zpl_to_printer(ip_address, zpl_code)
-        return jsonify({"message": result}), 200
-    else:
-        return jsonify({"error": "Item not found"}), 404
+# ------------------------------------------------------------------------------
+# Print Jobs by Query (department, item list, price changes, sale window)
+# ------------------------------------------------------------------------------
+LABEL_RUN_PAGE_SIZE = 2000       # rows read per query; the connection is released between pages
+LABEL_RUN_FETCH_SIZE = 500       # rows per fetchmany() call and labels per print job
+LABEL_RUN_MAX_QUEUED_JOBS = 4    # stop reading while this many jobs wait for the printer
+LABEL_RUN_HISTORY = 100
+label_run_executor = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix='label-run')
+label_runs = {}                  # run id -> run state, oldest first
+label_runs_lock = threading.Lock()
+
+def parse_label_selector(selector):
+    """Validate the selector; every given criterion must match (AND)."""
+    if not isinstance(selector, dict):
+        raise ValueError("selector must be an object")
+    parsed = {
+        'dept_id': selector.get('dept_id'),
+        'store_id': selector.get('store_id') or DEFAULT_STORE_ID,
+        'item_nums': selector.get('item_nums'),
+        'changed_since': None,
+        'on_sale_from': None,
+        'on_sale_to': None,
+    }
+    if parsed['item_nums'] is not None:
+        if not isinstance(parsed['item_nums'], list) or not parsed['item_nums']:
+            raise ValueError("item_nums must be a non-empty list")
+        parsed['item_nums'] = [str(item_num) for item_num in parsed['item_nums']]
+    try:
+        if selector.get('changed_since'):
+            parsed['changed_since'] = datetime.fromisoformat(selector['changed_since'])
+        if selector.get('on_sale_from') or selector.get('on_sale_to'):
+            parsed['on_sale_from'] = datetime.fromisoformat(selector.get('on_sale_from') or selector['on_sale_to'])
+            parsed['on_sale_to'] = datetime.fromisoformat(selector.get('on_sale_to') or selector['on_sale_from'])
+    except ValueError:
+        raise ValueError("changed_since, on_sale_from and on_sale_to must be ISO dates")
+    if not any(parsed[key] for key in ('dept_id', 'item_nums', 'changed_since', 'on_sale_from')):
+        raise ValueError("selector needs dept_id, item_nums, changed_since or on_sale_from/on_sale_to")
+    return parsed
+
+def label_selector_item_chunks(selector):
+    """
+    Item lists to restrict the query to, in chunks that fit one IN clause;
+    [None] means no item restriction.
+    """
+    item_nums = selector['item_nums']
+    if selector['changed_since']:
+        changed = price_changes.changed_since(selector['changed_since'])
+        if item_nums is not None:
+            wanted = {item_key(item_num) for item_num in item_nums}
+            changed = [item_num for item_num in changed if item_key(item_num) in wanted]
+        item_nums = changed
+    if item_nums is None:
+        return [None]
+    return [item_nums[start:start + LABEL_LOOKUP_CHUNK] for start in range(0, len(item_nums), LABEL_LOOKUP_CHUNK)]
+
+def label_selector_query(selector, items, after_item):
+    """One keyset page of matching items; (ItemNum, Store_ID) is unique, so one row per ItemNum."""
+    conditions = ["ISNULL(i.IsDeleted, 0) = 0"]
+    params = [LABEL_RUN_PAGE_SIZE]
+    if selector['dept_id']:
+        conditions.append("i.Dept_ID = ?")
+        params.append(selector['dept_id'])
+    conditions.append("i.Store_ID = ?")
+    params.append(selector['store_id'])
+    if items is not None:
+        conditions.append(f"i.ItemNum IN ({', '.join('?' for _ in items)})")
+        params.extend(items)
+    if selector['on_sale_from']:
+        conditions.append("""EXISTS (
+            SELECT 1 FROM Inventory_Onsale_Info s
+            WHERE s.ItemNum = i.ItemNum AND s.Store_ID = i.Store_ID
+              AND s.Sale_Start <= ? AND s.Sale_End >= ?
+        )""")
+        params.extend([selector['on_sale_to'], selector['on_sale_from']])
+    if after_item is not None:
+        conditions.append("i.ItemNum > ?")
+        params.append(after_item)
+    query = f"""
+        SELECT TOP (?) i.ItemNum, i.ItemName, i.Price
+        FROM Inventory i
+        WHERE {' AND '.join(conditions)}
+        ORDER BY i.ItemNum
+    """
+    return query, params
+
+def iter_label_rows(selector):
+    """Yield lists of (ItemNum, ItemName, Price) rows, at most LABEL_RUN_FETCH_SIZE at a time."""
+    for items in label_selector_item_chunks(selector):
+        after_item = None
+        while True:
+            query, params = label_selector_query(selector, items, after_item)
+            page = []
+            with get_db_connection(owner="label run") as conn:
+                cursor = conn.cursor()
+                cursor.execute(query, params)
+                while True:
+                    rows = cursor.fetchmany(LABEL_RUN_FETCH_SIZE)
+                    if not rows:
+                        break
+                    page.append(rows)
+            # Printing happens after the connection is back in the pool.
+            for rows in page:
+                yield rows
+            row_count = sum(len(rows) for rows in page)
+            if row_count < LABEL_RUN_PAGE_SIZE:
+                break
+            after_item = page[-1][-1][0]
+
+def label_run_backlogged(run):
+    """True while the run's printer (or group) already has enough labels waiting."""
+    printers = printer_groups.printers(run['group']) if run['group'] else [run['printer']]
+    pending = sum(print_spooler.pending_documents(printer) for printer in printers)
+    return pending >= LABEL_RUN_MAX_QUEUED_JOBS * LABEL_RUN_FETCH_SIZE * max(len(printers), 1)
+
+def run_label_query(run, selector, copies, use_stored_format):
+    ip_address = run['printer']
+    design = run['design']
+    # printer -> this run's job carrying the ^DF download. Each printer has one FIFO
+    # queue, so later pages rely on it instead of downloading again, unless it failed.
+    format_jobs = {}
+    queued = object()   # placeholder until submit returns the job
+
+    def download_for(printer):
+        job = format_jobs.get(printer)
+        if job is queued or (job is not None and job.status != 'failed'):
+            return None
+        download = prepare_stored_format(printer, design)
+        if download:
+            format_jobs[printer] = queued
+        return download
 
+    try:
+        for rows in iter_label_rows(selector):
+            documents = []
+            download = None
+            if use_stored_format and not run['group']:
+                download = download_for(ip_address)
+                if download:
+                    documents.append(download)
+            for item_num, item_name, price in rows:
+                if use_stored_format:
+                    documents.append(label_templates.recall(
+                        design, stored_format_name(design), item_num, item_name, price, copies
+                    ))
+                else:
+                    documents.append(label_templates.render(design, item_num, item_name, price, copies))
+            # Back-pressure: keep only a few batches of ZPL queued per printer.
+            while label_run_backlogged(run):
+                time.sleep(0.2)
+            if run['group']:
+                preamble = (lambda printer: [download_for(printer)]) if use_stored_format else None
+                jobs = printer_groups.submit(
+                    run['group'], documents, preamble=preamble,
+                    on_preamble_sent=lambda printer: mark_stored_format(printer, design),
+                )
+                for job in jobs:
+                    if format_jobs.get(job.printer) is queued:
+                        format_jobs[job.printer] = job
+                run['job_ids'].extend(job.id for job in jobs)
+            else:
+                job = print_spooler.submit(
+                    ip_address, documents, labels=[{"items": len(rows)}],
+                    on_sent=mark_format_on_first_send(ip_address, design) if download else None,
+                )
+                if download:
+                    format_jobs[ip_address] = job
+                run['job_ids'].append(job.id)
+            run['items'] += len(rows)
+        run['status'] = 'queued'
+    except Exception as e:
+        print(f"Label run {run['id']} failed:", str(e))
+        run['status'] = 'failed'
+        run['error'] = str(e)
+    run['finished_reading_at'] = datetime.now().isoformat()
+
+def label_run_status(run):
+    jobs = [print_spooler.job(job_id) for job_id in run['job_ids']]
+    jobs = [job for job in jobs if job is not None]
+    status = run['status']
+    if status == 'queued' and jobs and all(job.status in ('done', 'failed') for job in jobs):
+        status = 'failed' if any(job.status == 'failed' for job in jobs) else 'done'
+    return {
+        **{key: value for key, value in run.items() if key != 'job_ids'},
+        "status": status,
+        "jobs": len(run['job_ids']),
+        "jobs_done": sum(1 for job in jobs if job.status == 'done'),
+        "jobs_failed": sum(1 for job in jobs if job.status == 'failed'),
+        "job_ids": run['job_ids'],
+    }
+
+@app.route('/print_query', methods=['POST'])
+def print_query():
+    """
+    Queue labels for every item matching a selector.
+    Body: {"ip_address": "..." or "group": "...", "design": "design2", "copies": 1,
+           "selector": {"dept_id": "DAIRY", "store_id": "1001", "item_nums": [...],
+                        "changed_since": "2024-05-01T00:00:00",
+                        "on_sale_from": "2024-05-01", "on_sale_to": "2024-05-07"}}
+    Rows are read in pages and rendered batch by batch into print jobs while
+    the request returns a run ID at once; poll /api/label_runs/<run_id>.
+    """
+    data = request.get_json() or {}
+    ip_address = data.get('ip_address')
+    group = data.get('group')
+    design = data.get('design', 'label')
+    copies = data.get('copies', 1)
+    if not (ip_address or group):
+        return jsonify({"error": "ip_address or group is required"}), 400
+    if group and group not in printer_groups:
+        return jsonify({"error": f"Unknown printer group '{group}'"}), 404
+    if not group and printer_address_error(ip_address):
+        return jsonify({"error": printer_address_error(ip_address)}), 400
+    if design not in label_templates:
+        return jsonify({"error": f"design must be one of {label_templates.names()}"}), 400
+    if not isinstance(copies, int) or isinstance(copies, bool) or not 1 <= copies <= MAX_LABEL_COPIES:
+        return jsonify({"error": f"copies must be an integer between 1 and {MAX_LABEL_COPIES}"}), 400
+    try:
+        selector = parse_label_selector(data.get('selector'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    run = {
+        "id": uuid.uuid4().hex,
+        "printer": ip_address,
+        "group": group,
+        "design": design,
+        "copies": copies,
+        "selector": data.get('selector'),
+        "status": "reading",
+        "items": 0,
+        "error": None,
+        "started_at": datetime.now().isoformat(),
+        "finished_reading_at": None,
+        "job_ids": [],
+    }
+    with label_runs_lock:
+        label_runs[run['id']] = run
+        while len(label_runs) > LABEL_RUN_HISTORY:
+            label_runs.pop(next(iter(label_runs)))
+    use_stored_format = label_templates.get(design).has_stored_format and data.get('stored_format', True)
+    label_run_executor.submit(run_label_query, run, selector, copies, use_stored_format)
+    return jsonify({"run_id": run['id'], "status": run['status']}), 202
+
+@app.route('/api/label_runs/<run_id>', methods=['GET'])
+def get_label_run(run_id):
+    with label_runs_lock:
+        run = label_runs.get(run_id)
+    if run is None:
+        return jsonify({"error": "Label run not found"}), 404
+    return jsonify(label_run_status(run)), 200
+
+@app.route('/api/price_changes/status', methods=['GET'])
+def get_price_change_status():
+    return jsonify(price_changes.stats()), 200
+
+# ------------------------------------------------------------------------------
+# Print Spooler API
+# ------------------------------------------------------------------------------
+@app.route('/api/print_jobs/<job_id>', methods=['GET'])
+def get_print_job(job_id):
+    job = print_spooler.job(job_id)
+    if job is None:
+        return jsonify({"error": "Print job not found"}), 404
+    return jsonify(job.status_dict()), 200
+
+@app.route('/api/printers/health', methods=['GET'])
+def get_printer_health():
+    """
+    Circuit state and last probe result for every printer seen so far.
+    ?ip=<address>&probe=true probes that printer now instead of waiting for
+    the background prober.
+    """
+    ip_address = request.args.get('ip')
+    if ip_address:
+        if request.args.get('probe', 'false').lower() == 'true':
+            address_error = printer_address_error(ip_address)
+            if address_error:
+                return jsonify({"error": address_error}), 400
+            printer_health.probe(ip_address)
+        status = printer_health.status(ip_address)
+        if status is None:
+            return jsonify({"error": "Printer not seen yet; pass probe=true to check it"}), 404
+        return jsonify(status), 200
+    return jsonify(printer_health.status()), 200
+
+@app.route('/api/stored_formats', methods=['GET'])
+def get_stored_formats():
+    """Current format versions and which printers are known to hold them."""
+    return jsonify({
+        "versions": {
+            stored_format_name(design): label_templates.get(design).stored_version
+            for design in label_templates.stored_format_names()
+        },
+        **stored_formats.stats(),
+    }), 200
+
+@app.route('/api/stored_formats/<path:ip_address>', methods=['DELETE'])
+def forget_stored_formats(ip_address):
+    """Force the next batch to this printer to download its formats again."""
+    stored_formats.forget(ip_address, reason="manual reset")
+    return jsonify({"success": True}), 200
+
+@app.route('/api/printer_groups', methods=['GET'])
+def get_printer_groups():
+    """Group members with availability, pending labels and measured labels per second."""
+    return jsonify(printer_groups.stats()), 200
+
+@app.route('/api/printer_groups/<name>', methods=['PUT'])
+def put_printer_group(name):
+    data = request.get_json() or {}
+    printers = data.get('printers')
+    if not isinstance(printers, list) or not printers or not all(isinstance(p, str) and p for p in printers):
+        return jsonify({"error": "printers must be a non-empty list of printer addresses"}), 400
+    for printer in printers:
+        try:
+            address = ipaddress.ip_address(printer)
+        except ValueError:
+            return jsonify({"error": f"'{printer}' is not an IP address"}), 400
+        if not on_printer_network(address):
+            return jsonify({"error": f"{printer} is not on a printer network"}), 400
+    printer_groups.set_group(name, printers)
+    return jsonify({"name": name, "printers": printer_groups.printers(name)}), 200
+
+@app.route('/api/printer_groups/<name>', methods=['DELETE'])
+def delete_printer_group(name):
+    if not printer_groups.delete_group(name):
+        return jsonify({"error": "Printer group not found"}), 404
+    return jsonify({"success": True}), 200
+
+@app.route('/api/print_spooler/stats', methods=['GET'])
+def get_print_spooler_stats():
+    """Queue depth, connection state and counters per printer."""
+    return jsonify(print_spooler.stats()), 200
 
 
 @app.route('/mix-and-match', methods=['GET'])
@@ -747,7 +1746,7 @@ def mix_and_match():
 @app.route('/api/kit_details', methods=['GET'])
 def get_kit_details():
     try:
-        with pyodbc.connect(connection_string) as conn:
+        with get_db_connection() as conn:
             cursor = conn.cursor()
             query = '''
             SELECT
@@ -800,127 +1799,446 @@ def get_kit_details():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-# ------------------------------------------------------------------------------
-# Firebase Sync & Item APIs
-# ------------------------------------------------------------------------------
-@app.route('/api/sync_inventory', methods=['POST'])
-def sync_inventory_to_firebase():
+# ------------------------------------------------------------------------------
+# Firebase Sync & Item APIs
+# ------------------------------------------------------------------------------
+FIRESTORE_SYNC_PAGE_SIZE = 5000    # SQL rows per keyset page; the connection is released between pages
+FIRESTORE_SYNC_FETCH_SIZE = 500    # rows per fetchmany() call
+FIRESTORE_SYNC_WORKERS = 4         # batches committed concurrently
+FIRESTORE_FINGERPRINT_DB = 'firestore_sync.sqlite3'
+DELTA_SAMPLE_SIZE = 20             # doc ids listed per change type in dry-run reports
+
+inventory_fingerprints = FingerprintStore(FIRESTORE_FINGERPRINT_DB, "Inventory")
+inventory_sync_lock = threading.Lock()   # one writing sync at a time
+
+def record_uploaded_fingerprints(documents):
+    """
+    Fingerprint {doc_id: document} written outside the sync (item uploads), so
+    the next sync compares SQL Server against what Firestore now holds. They
+    are recorded as UPLOAD: the sync never deletes them, since SQL Server may
+    not have imported them yet.
+    """
+    inventory_fingerprints.record(
+        {doc_id: fingerprint(document) for doc_id, document in documents.items()}, [], source=UPLOAD
+    )
+
+def iter_inventory_rows(columns):
+    """
+    Stream ``ItemNum, <columns>`` for DEFAULT_STORE_ID's Inventory rows in
+    ItemNum order, one keyset page per query and fetchmany() within it. One
+    store only: Firestore documents are keyed by ItemNum alone, so each item
+    has exactly one row and no item can span two pages or two batches.
+    """
+    after = None
+    while True:
+        params = [FIRESTORE_SYNC_PAGE_SIZE, DEFAULT_STORE_ID]
+        where = "WHERE Store_ID = ?"
+        if after is not None:
+            where += " AND ItemNum > ?"
+            params.append(after)
+        page = []
+        with get_db_connection(owner="firestore sync") as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT TOP (?) ItemNum, {columns} FROM Inventory {where} ORDER BY ItemNum",
+                params
+            )
+            while True:
+                rows = cursor.fetchmany(FIRESTORE_SYNC_FETCH_SIZE)
+                if not rows:
+                    break
+                page.extend(rows)
+        yield from page
+        if len(page) < FIRESTORE_SYNC_PAGE_SIZE:
+            return
+        after = page[-1][0]
+
+def stocked_in_any_store(item_nums):
+    """item_key of each of ``item_nums`` that still has an Inventory row in some store."""
+    stocked = set()
+    with get_db_connection(owner="firestore sync") as conn:
+        cursor = conn.cursor()
+        for start in range(0, len(item_nums), LABEL_LOOKUP_CHUNK):
+            chunk = item_nums[start:start + LABEL_LOOKUP_CHUNK]
+            cursor.execute(
+                f"SELECT DISTINCT ItemNum FROM Inventory WHERE ItemNum IN ({', '.join('?' for _ in chunk)})", chunk
+            )
+            stocked.update(item_key(row[0]) for row in cursor.fetchall())
+    return stocked
+
+def inventory_document(row):
+    """Firestore document for an ``iter_inventory_rows('ItemName, Cost, Price')`` row."""
+    return {
+        'itemNum': row[0],
+        'itemName': row[1],
+        'cost': float(row[2]) if row[2] is not None else 0.0,
+        'price': float(row[3]) if row[3] is not None else 0.0,
+    }
+
+def iter_inventory_documents():
+    """(doc_id, document) per ItemNum of DEFAULT_STORE_ID."""
+    for row in iter_inventory_rows("ItemName, Cost, Price"):
+        yield str(row[0]), inventory_document(row)
+
+@app.route('/api/sync_inventory', methods=['POST'])
+def sync_inventory_to_firebase():
+    """
+    Bring the Firestore "Inventory" collection up to date with SQL Server.
+    Only documents whose fingerprint changed since the last sync are written,
+    and documents the sync wrote for items that disappeared are deleted
+    (uploaded documents SQL Server does not have yet are kept, and so are
+    items only other stores than DEFAULT_STORE_ID still stock).
+    ?dry_run=true reports the delta without writing anything.
+    ?full=true rewrites every document and rebuilds the fingerprint table.
+    Only one writing sync runs at a time; another one gets a 409.
+    """
+    dry_run = request.args.get('dry_run', 'false').lower() == 'true'
+    full = request.args.get('full', 'false').lower() == 'true'
+    if not dry_run and not inventory_sync_lock.acquire(blocking=False):
+        return jsonify({"error": "An inventory sync is already running."}), 409
+    try:
+        synced = inventory_fingerprints.load()
+        delta = {"inserted": 0, "changed": 0, "unchanged": 0, "deleted": 0, "other_store": 0}
+        samples = {"inserted": [], "changed": [], "deleted": []}
+        new_fingerprints = {}
+        claimed = {}                     # uploads SQL Server now holds unchanged: owned by the sync from now on
+        writer = None if dry_run else BatchWriter(
+            db, "Inventory", batch_size=FIRESTORE_BATCH_LIMIT, workers=FIRESTORE_SYNC_WORKERS
+        )
+        try:
+            deletions = []
+            for kind, doc_id, document, value in plan_sync(iter_inventory_documents(), synced):
+                if kind == "deleted":
+                    deletions.append(doc_id)
+                    continue
+                if kind == "claimed":
+                    claimed[doc_id] = value
+                    kind = "unchanged"
+                if kind == "unchanged" and not full:
+                    delta["unchanged"] += 1
+                    continue
+                delta[kind] += 1
+                if kind in samples and len(samples[kind]) < DELTA_SAMPLE_SIZE:
+                    samples[kind].append(doc_id)
+                if writer:
+                    writer.set(doc_id, {**document, UPDATED_AT_FIELD: firestore.SERVER_TIMESTAMP})
+                    new_fingerprints[doc_id] = value
+            # Only DEFAULT_STORE_ID is synced; an item another store still stocks keeps its document.
+            stocked = stocked_in_any_store(deletions) if deletions else set()
+            for doc_id in deletions:
+                if item_key(doc_id) in stocked:
+                    delta["other_store"] += 1
+                    continue
+                delta["deleted"] += 1
+                if len(samples["deleted"]) < DELTA_SAMPLE_SIZE:
+                    samples["deleted"].append(doc_id)
+                if writer:
+                    writer.delete(doc_id)
+        finally:
+            report = writer.close() if writer else {}
+
+        if dry_run:
+            return jsonify({
+                "success": True,
+                "dry_run": True,
+                "full": full,
+                **delta,
+                "to_write": delta["inserted"] + delta["changed"] + (delta["unchanged"] if full else 0),
+                "to_delete": delta["deleted"],
+                "samples": samples,
+            }), 200
+
+        # Only batches that committed move the fingerprints forward; failed ones retry next sync.
+        if full and not report["failed_batches"]:
+            inventory_fingerprints.clear()
+        committed = {doc_id: new_fingerprints[doc_id] for doc_id, deleted in writer.committed if not deleted}
+        removed = [doc_id for doc_id, deleted in writer.committed if deleted]
+        inventory_fingerprints.record({**claimed, **committed}, removed)
+        report.update(delta)
+        report["full"] = full
+        if report["failed_batches"]:
+            return jsonify({"success": False, "message": "Some batches failed to sync", **report}), 207
+        return jsonify({"success": True, "message": "Data synced to Firebase successfully", **report}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if not dry_run:
+            inventory_sync_lock.release()
+
+@app.route('/api/sync_inventory/status', methods=['GET'])
+def sync_inventory_status():
+    """How many Inventory documents the fingerprint table knows about, and when the last sync wrote."""
+    try:
+        return jsonify(inventory_fingerprints.stats()), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+FIRESTORE_ITEM_FIELDS = ['itemNum', 'itemName', 'cost', 'price']
+
+def parse_updated_since():
+    """Read ``updated_since`` (ISO date or datetime, local time unless it has an offset)."""
+    value = request.args.get('updated_since')
+    if not value:
+        return None
+    try:
+        since = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError("'updated_since' must be an ISO date or datetime.")
+    return since if since.tzinfo else since.astimezone()
+
+def firestore_page_key(doc_id, fields, updated_since):
+    # Sort key of a document, and the key values its next-page cursor carries.
+    if updated_since:
+        return (fields[UPDATED_AT_FIELD], doc_id)
+    return (doc_id,)
+
+def decode_firestore_cursor(after_key, updated_since):
+    if after_key is None:
+        return None
+    if len(after_key) != (2 if updated_since else 1):
+        raise ValueError("Invalid 'after' cursor.")
+    if updated_since:
+        try:
+            return (datetime.fromisoformat(after_key[0]), after_key[1])
+        except (TypeError, ValueError):
+            raise ValueError("Invalid 'after' cursor.")
+    return tuple(after_key)
+
+def firestore_inventory_documents(fields=None, page=None, updated_since=None):
+    """
+    (doc id, field dict) for Firestore Inventory documents, with ``fields``
+    limiting which fields come back (all when None). ``page`` is
+    (limit, after_key) from parse_page_args(); ``updated_since`` keeps only
+    documents written at or after that time (documents never stamped with
+    updatedAt are excluded). Served from the mirror when it is loaded;
+    otherwise a projected Firestore query ordered by document ID, or by
+    (updatedAt, document ID) when filtering, resumed with start_after.
+    Returns (documents, next_cursor, source).
+    """
+    limit, after_key = page or (None, None)
+    after = decode_firestore_cursor(after_key, updated_since)
+    wanted = fields + [UPDATED_AT_FIELD] if fields and updated_since else fields
+
+    if inventory_mirror.ready():
+        documents = inventory_mirror.documents()
+        if updated_since:
+            documents = [
+                (doc_id, item) for doc_id, item in documents
+                if item.get(UPDATED_AT_FIELD) and item[UPDATED_AT_FIELD] >= updated_since
+            ]
+        if page or updated_since:
+            documents.sort(key=lambda doc: firestore_page_key(doc[0], doc[1], updated_since))
+        if after:
+            documents = [doc for doc in documents if firestore_page_key(doc[0], doc[1], updated_since) > after]
+        if limit:
+            documents = documents[:limit + 1]
+        if wanted:
+            documents = [(doc_id, {field: item.get(field) for field in wanted}) for doc_id, item in documents]
+        source = 'mirror'
+    else:
+        query = db.collection("Inventory")
+        if wanted:
+            query = query.select(wanted)
+        if updated_since:
+            query = query.where(filter=firestore.FieldFilter(UPDATED_AT_FIELD, '>=', updated_since))
+            query = query.order_by(UPDATED_AT_FIELD)
+        if page or updated_since:
+            query = query.order_by(firestore.FieldPath.document_id())
+        if after:
+            cursor_fields = {'__name__': after[-1]}
+            if updated_since:
+                cursor_fields[UPDATED_AT_FIELD] = after[0]
+            query = query.start_after(cursor_fields)
+        if limit:
+            query = query.limit(limit + 1)
+        documents = [(doc.id, doc.to_dict()) for doc in query.stream()]
+        source = 'firestore'
+
+    next_cursor = None
+    if limit and len(documents) > limit:
+        documents = documents[:limit]
+        doc_id, item = documents[-1]
+        next_cursor = encode_page_cursor(list(firestore_page_key(doc_id, item, updated_since)))
+    return documents, next_cursor, source
+
+@app.route('/api/firestore_mirror/stats', methods=['GET'])
+def firestore_mirror_stats():
+    """Size of the in-memory Inventory mirror and how far behind Firestore it is."""
     try:
-        inventory_data = fetch_inventory_data()
-        for item in inventory_data:
-            item['cost'] = float(item['cost'])
-            item['price'] = float(item['price'])
-            db.collection("Inventory").document(str(item['itemNum'])).set(item)
-        return jsonify({"success": True, "message": "Data synced to Firebase successfully", "data": inventory_data}), 200
+        return jsonify(inventory_mirror.stats()), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/get_inventory', methods=['GET'])
 def fetch_inventory():
+    """
+    Firestore Inventory documents. ?limit=&after= pages the result,
+    ?updated_since= keeps documents written since then.
+    """
+    try:
+        page = parse_page_args()
+        updated_since = parse_updated_since()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     try:
-        inventory_ref = db.collection("Inventory")
-        docs = inventory_ref.stream()
-        inventory_data = []
-        for doc in docs:
-            item = doc.to_dict()
-            item['itemNum'] = doc.id
-            inventory_data.append(item)
-        return jsonify(inventory_data), 200
+        documents, next_cursor, source = firestore_inventory_documents(page=page, updated_since=updated_since)
+        inventory_data = [{**item, 'itemNum': doc_id} for doc_id, item in documents]
+        response = page_response(inventory_data, next_cursor, page[0]) if page else jsonify(inventory_data)
+        response.headers['X-Data-Source'] = source
+        return response, 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/get_item/<string:item_num>', methods=['GET'])
 def get_item(item_num):
     try:
-        with pyodbc.connect(connection_string) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT itemName, cost, price FROM Inventory WHERE itemNum = ?", (item_num,))
-            row = cursor.fetchone()
-            if row:
-                item_data = {
-                    'itemName': row[0],
-                    'cost': float(row[1]),
-                    'price': float(row[2])
-                }
-                return jsonify(item_data), 200
-            else:
-                return jsonify({"error": "Item not found"}), 404
+        item = lookup_item(item_num)
+        if item:
+            item_data = {
+                'itemName': item['ItemName'],
+                'cost': float(item['Cost']),
+                'price': float(item['Price'])
+            }
+            return jsonify(item_data), 200
+        else:
+            return jsonify({"error": "Item not found"}), 404
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def validate_firebase_item(item_data):
+    """(item document, None) for a valid upload entry, or (None, error message)."""
+    if not isinstance(item_data, dict):
+        return None, "Each item must be a dictionary."
+    item_num = item_data.get('itemNum')
+    item_name = item_data.get('itemName')
+    if not item_num or not item_name:
+        return None, "Item number and item name are required."
+    # The item number is the Firestore document ID.
+    doc_id = str(item_num)
+    if not doc_id.strip() or '/' in doc_id or doc_id in ('.', '..') or re.fullmatch(r'__.*__', doc_id):
+        return None, "Item number cannot be blank, '.', '..', contain '/' or look like __name__."
+    cost_str = item_data.get('cost', '')
+    price_str = item_data.get('price', '')
+    if cost_str == '' or price_str == '':
+        return None, "Cost and Price fields cannot be empty."
+    try:
+        cost = float(cost_str)
+        price = float(price_str)
+    except (TypeError, ValueError):
+        return None, "Cost and Price must be valid numbers."
+    return {
+        'itemNum': item_num,
+        'itemName': item_name,
+        'cost': cost,
+        'price': price
+    }, None
+
 @app.route('/api/add_item_to_firebase', methods=['POST'])
 def add_item_to_firebase():
+    """
+    Body: a list of {"itemNum", "itemName", "cost", "price"}.
+    With ?queue=true the whole list is validated first (every invalid entry is
+    reported and nothing is written), then journaled to the write-behind queue;
+    the response is a job ID to poll at /api/firebase_jobs/<job_id>.
+    """
     try:
         item_data_list = request.json
         if not isinstance(item_data_list, list):
             return jsonify({"error": "Expected a list of items."}), 400
 
+        if request.args.get('queue', 'false').lower() == 'true':
+            documents = []
+            errors = []
+            for index, item_data in enumerate(item_data_list):
+                item, error = validate_firebase_item(item_data)
+                if error:
+                    errors.append({"index": index, "error": error})
+                else:
+                    documents.append((item['itemNum'], item))
+            if errors:
+                return jsonify({"error": "Some items are invalid; nothing was queued.", "errors": errors}), 400
+            job_id = inventory_write_queue.enqueue(documents)
+            return jsonify({"success": True, "job_id": job_id, "queued": len(documents)}), 202
+
         results = []
         for item_data in item_data_list:
-            if not isinstance(item_data, dict):
-                return jsonify({"error": "Each item must be a dictionary."}), 400
-            item_num = item_data.get('itemNum')
-            item_name = item_data.get('itemName')
-            if not item_num or not item_name:
-                return jsonify({"error": "Item number and item name are required."}), 400
-            cost_str = item_data.get('cost', '')
-            price_str = item_data.get('price', '')
-            if cost_str == '' or price_str == '':
-                return jsonify({"error": "Cost and Price fields cannot be empty."}), 400
-            try:
-                cost = float(cost_str)
-                price = float(price_str)
-            except ValueError:
-                return jsonify({"error": "Cost and Price must be valid numbers."}), 400
-            item = {
-                'itemNum': item_num,
-                'itemName': item_name,
-                'cost': cost,
-                'price': price
-            }
-            db.collection("Inventory").document(str(item_num)).set(item)
-            results.append({"itemNum": item_num, "status": "added"})
+            item, error = validate_firebase_item(item_data)
+            if error:
+                return jsonify({"error": error}), 400
+            db.collection("Inventory").document(str(item['itemNum'])).set(
+                {**item, UPDATED_AT_FIELD: firestore.SERVER_TIMESTAMP}
+            )
+            record_uploaded_fingerprints({str(item['itemNum']): item})
+            results.append({"itemNum": item['itemNum'], "status": "added"})
         return jsonify({"success": True, "results": results}), 201
     except Exception as e:
         print(f"Error occurred: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/firebase_jobs/<job_id>', methods=['GET'])
+def get_firebase_job(job_id):
+    """Progress of a queued /api/add_item_to_firebase upload."""
+    try:
+        job = inventory_write_queue.job(job_id)
+        if job is None:
+            return jsonify({"error": "Unknown job ID."}), 404
+        return jsonify(job), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/firebase_jobs/retry', methods=['POST'])
+def retry_firebase_jobs():
+    """Requeue failed writes. Body: {"job_id": "..."} for one job, or empty for every job."""
+    try:
+        job_id = (request.get_json(silent=True) or {}).get('job_id')
+        if job_id is not None and inventory_write_queue.job(job_id) is None:
+            return jsonify({"error": "Unknown job ID."}), 404
+        return jsonify({"success": True, "requeued": inventory_write_queue.requeue_failed(job_id)}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/firebase_jobs/stats', methods=['GET'])
+def firebase_queue_stats():
+    try:
+        return jsonify(inventory_write_queue.stats()), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/get_item_details/<item_num>', methods=['GET'])
 def get_item_details(item_num):
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM Inventory WHERE ItemNum = ?", (item_num,))
-            item = cursor.fetchone()
-            if item:
-                item_details = {
-                    "itemNum": item[0],
-                    "itemName": item[1],
-                    "storeID": item[2],
-                    "cost": item[3],
-                    "price": item[4],
-                    "retailPrice": item[5],
-                    "inStock": item[6],
-                    "reorderLevel": item[7],
-                    "reorderQuantity": item[8],
-                    "invNumBarcodeLabels": item[9],
-                    "tax1": item[10],
-                    "tax2": item[11],
-                    "tax3": item[12],
-                    "vendorNumber": item[13],
-                    "deptID": item[14],
-                    "isKit": item[15],
-                    "isModifier": item[16],
-                    "numBoxes": item[17],
-                }
-                return jsonify(item_details), 200
-            else:
-                return jsonify({"error": "Item not found."}), 404
+        row = lookup_item(item_num)
+        if row:
+            item = list(row.values())   # SELECT * column order
+            item_details = {
+                "itemNum": item[0],
+                "itemName": item[1],
+                "storeID": item[2],
+                "cost": item[3],
+                "price": item[4],
+                "retailPrice": item[5],
+                "inStock": item[6],
+                "reorderLevel": item[7],
+                "reorderQuantity": item[8],
+                "invNumBarcodeLabels": item[9],
+                "tax1": item[10],
+                "tax2": item[11],
+                "tax3": item[12],
+                "vendorNumber": item[13],
+                "deptID": item[14],
+                "isKit": item[15],
+                "isModifier": item[16],
+                "numBoxes": item[17],
+            }
+            return jsonify(item_details), 200
+        else:
+            return jsonify({"error": "Item not found."}), 404
     except Exception as e:
         print(f"Error occurred: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/update_item_in_inventory/<item_num>', methods=['PUT'])
+@invalidates(response_cache, data_versions, item_cache, label_item_cache)
 def update_item_in_inventory(item_num):
     try:
         item_data = request.json
@@ -1082,10 +2400,20 @@ def update_item_in_inventory(item_num):
 @app.route('/api/label_inventory', methods=['GET'])
 def get_inventory_for_label():
     try:
-        with pyodbc.connect(connection_string) as conn:
+        page = parse_page_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        with get_db_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT ItemNum, ItemName, Cost, Price FROM Inventory")
-            rows = cursor.fetchall()
+            if page:
+                limit, after_key = page
+                rows, next_cursor = fetch_keyset_page(
+                    cursor, "ItemNum, ItemName, Cost, Price", "Inventory", ["ItemNum", "Store_ID"], limit, after_key
+                )
+            else:
+                cursor.execute("SELECT ItemNum, ItemName, Cost, Price FROM Inventory")
+                rows = cursor.fetchall()
             inventory_list = []
             for row in rows:
                 inventory_list.append({
@@ -1095,11 +2423,14 @@ def get_inventory_for_label():
                     'cost': row[2],
                     'price': row[3]
                 })
+            if page:
+                return page_response(inventory_list, next_cursor, limit)
             return jsonify(inventory_list)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/add_item_to_inventory', methods=['POST'])
+@invalidates(response_cache, data_versions, item_cache, label_item_cache)
 def add_item_to_inventory():
     try:
         item_data = request.json
@@ -1187,82 +2518,67 @@ def add_item_to_inventory():
     
 
 
-@app.route('/add-item', methods=['POST'])
-def add_item():
-    data = request.get_json()
-    # Get required fields from the request payload
-    ItemNum = data.get('ItemNum')
-    ItemName = data.get('ItemName')
-    Cost = data.get('Cost')
-    Price = data.get('Price')
-    
-    # Check if the department is provided; if not, use the default 'NONE'
-    Dept_ID = data.get('Dept_ID') if data.get('Dept_ID') is not None else 'NONE'
-    
-    # Check if all required fields are provided
-    if not all([ItemNum, ItemName, Cost, Price]):
-        return jsonify({'error': 'Missing required fields'}), 400
-
-    # Build the INSERT query. Adjust column names and order according to your schema.
-    query = """
-        INSERT INTO Inventory (
-            ItemNum, ItemName, Store_ID, Cost,           -- 1-4
-            Price, Retail_Price, In_Stock, Reorder_Level,  -- 5-8
-            Reorder_Quantity, Tax_1, Tax_2, Tax_3,         -- 9-12
-            Vendor_Number, Dept_ID, IsKit, IsModifier,     -- 13-16
-            Kit_Override, Inv_Num_Barcode_Labels, Use_Serial_Numbers, Num_Bonus_Points,  -- 17-20
-            IsRental, Use_Bulk_Pricing, Print_Ticket, Print_Voucher,  -- 21-24
-            Num_Days_Valid, IsMatrixItem, Vendor_Part_Num, Location, -- 25-28
-            AutoWeigh, numBoxes, Dirty, Tear,             -- 29-32
-            NumPerCase, FoodStampable, ReOrder_Cost, Helper_ItemNum,  -- 33-36
-            ItemName_Extra, Exclude_Acct_Limit, Check_ID, Old_InStock,  -- 37-40
-            Date_Created, ItemType, Prompt_Price, Prompt_Quantity, -- 41-44
-            Inactive, Allow_BuyBack, Last_Sold, Unit_Type,  -- 45-48
-            Unit_Size, Fixed_Tax, DOB, Special_Permission,  -- 49-52
-            Prompt_Description, Check_ID2, Count_This_Item, Transfer_Cost_Markup,  -- 53-56
-            Print_On_Receipt, Transfer_Markup_Enabled, As_Is, InStock_Committed, -- 57-60
-            RequireCustomer, PromptCompletionDate, PromptInvoiceNotes, Prompt_DescriptionOverDollarAmt,  -- 61-64
-            Exclude_From_Loyalty, BarTaxInclusive, ScaleSingleDeduct, GLNumber, -- 65-68
-            ModifierType, Position, numberOfFreeToppings, ScaleItemType,  -- 69-72
-            DiscountType, AllowReturns, SuggestedDeposit, Liability,  -- 73-76
-            IsDeleted, ItemLocale, QuantityRequired, AllowOnDepositInvoices,  -- 77-80
-            Import_Markup, PricePerMeasure, UnitMeasure, ShipCompliantProductType, -- 81-84
-            AlcoholContent, AvailableOnline, AllowOnFleetCard, DoughnutTax,  -- 85-88
-            DisplayTaxInPrice, NeverPrintInKitchen, Tax_4, Tax_5,  -- 89-92
-            Tax_6, DisableInventoryUpload, InvoiceLimitQty, ItemCategory,  -- 93-96
-            IsRestrictedPerInvoice, TagStatus              -- 97-98
-        ) VALUES (
-            ?, ?, ?, ?,                             -- 1-4
-            ?, ?, ?, ?,                             -- 5-8
-            ?, ?, ?, ?,                             -- 9-12
-            ?, ?, ?, ?,                             -- 13-16
-            ?, ?, ?, ?,                             -- 17-20
-            ?, ?, ?, ?,                             -- 21-24
-            ?, ?, ?, ?,                             -- 25-28
-            ?, ?, ?, ?,                             -- 29-32
-            ?, ?, ?, ?,                             -- 33-36
-            ?, ?, ?, ?,                             -- 37-40
-            ?, ?, ?, ?,                             -- 41-44
-            ?, ?, ?, ?,                             -- 45-48
-            ?, ?, ?, ?,                             -- 49-52
-            ?, ?, ?, ?,                             -- 53-56
-            ?, ?, ?, ?,                             -- 57-60
-            ?, ?, ?, ?,                             -- 61-64
-            ?, ?, ?, ?,                             -- 65-68
-            ?, ?, ?, ?,                             -- 69-72
-            ?, ?, ?, ?,                             -- 73-76
-            ?, ?, ?, ?,                             -- 77-80
-            ?, ?, ?, ?,                             -- 81-84
-            ?, ?, ?, ?,                             -- 85-88
-            ?, ?, ?, ?,                             -- 89-92
-            ?, ?, ?, ?,                             -- 93-96
-            ?, ?                                    -- 97-98
-        )
-    """
+# Build the INSERT query. Adjust column names and order according to your schema.
+INVENTORY_INSERT_QUERY = """
+    INSERT INTO Inventory (
+        ItemNum, ItemName, Store_ID, Cost,           -- 1-4
+        Price, Retail_Price, In_Stock, Reorder_Level,  -- 5-8
+        Reorder_Quantity, Tax_1, Tax_2, Tax_3,         -- 9-12
+        Vendor_Number, Dept_ID, IsKit, IsModifier,     -- 13-16
+        Kit_Override, Inv_Num_Barcode_Labels, Use_Serial_Numbers, Num_Bonus_Points,  -- 17-20
+        IsRental, Use_Bulk_Pricing, Print_Ticket, Print_Voucher,  -- 21-24
+        Num_Days_Valid, IsMatrixItem, Vendor_Part_Num, Location, -- 25-28
+        AutoWeigh, numBoxes, Dirty, Tear,             -- 29-32
+        NumPerCase, FoodStampable, ReOrder_Cost, Helper_ItemNum,  -- 33-36
+        ItemName_Extra, Exclude_Acct_Limit, Check_ID, Old_InStock,  -- 37-40
+        Date_Created, ItemType, Prompt_Price, Prompt_Quantity, -- 41-44
+        Inactive, Allow_BuyBack, Last_Sold, Unit_Type,  -- 45-48
+        Unit_Size, Fixed_Tax, DOB, Special_Permission,  -- 49-52
+        Prompt_Description, Check_ID2, Count_This_Item, Transfer_Cost_Markup,  -- 53-56
+        Print_On_Receipt, Transfer_Markup_Enabled, As_Is, InStock_Committed, -- 57-60
+        RequireCustomer, PromptCompletionDate, PromptInvoiceNotes, Prompt_DescriptionOverDollarAmt,  -- 61-64
+        Exclude_From_Loyalty, BarTaxInclusive, ScaleSingleDeduct, GLNumber, -- 65-68
+        ModifierType, Position, numberOfFreeToppings, ScaleItemType,  -- 69-72
+        DiscountType, AllowReturns, SuggestedDeposit, Liability,  -- 73-76
+        IsDeleted, ItemLocale, QuantityRequired, AllowOnDepositInvoices,  -- 77-80
+        Import_Markup, PricePerMeasure, UnitMeasure, ShipCompliantProductType, -- 81-84
+        AlcoholContent, AvailableOnline, AllowOnFleetCard, DoughnutTax,  -- 85-88
+        DisplayTaxInPrice, NeverPrintInKitchen, Tax_4, Tax_5,  -- 89-92
+        Tax_6, DisableInventoryUpload, InvoiceLimitQty, ItemCategory,  -- 93-96
+        IsRestrictedPerInvoice, TagStatus              -- 97-98
+    ) VALUES (
+        ?, ?, ?, ?,                             -- 1-4
+        ?, ?, ?, ?,                             -- 5-8
+        ?, ?, ?, ?,                             -- 9-12
+        ?, ?, ?, ?,                             -- 13-16
+        ?, ?, ?, ?,                             -- 17-20
+        ?, ?, ?, ?,                             -- 21-24
+        ?, ?, ?, ?,                             -- 25-28
+        ?, ?, ?, ?,                             -- 29-32
+        ?, ?, ?, ?,                             -- 33-36
+        ?, ?, ?, ?,                             -- 37-40
+        ?, ?, ?, ?,                             -- 41-44
+        ?, ?, ?, ?,                             -- 45-48
+        ?, ?, ?, ?,                             -- 49-52
+        ?, ?, ?, ?,                             -- 53-56
+        ?, ?, ?, ?,                             -- 57-60
+        ?, ?, ?, ?,                             -- 61-64
+        ?, ?, ?, ?,                             -- 65-68
+        ?, ?, ?, ?,                             -- 69-72
+        ?, ?, ?, ?,                             -- 73-76
+        ?, ?, ?, ?,                             -- 77-80
+        ?, ?, ?, ?,                             -- 81-84
+        ?, ?, ?, ?,                             -- 85-88
+        ?, ?, ?, ?,                             -- 89-92
+        ?, ?, ?, ?,                             -- 93-96
+        ?, ?                                    -- 97-98
+    )
+"""
 
-    # Prepare parameters with the user-supplied values and defaults.
+def inventory_insert_params(ItemNum, ItemName, Cost, Price, Dept_ID='NONE'):
+    """Parameters for INVENTORY_INSERT_QUERY: the given fields plus the defaults for every other column."""
     # Note: Here, we override Dept_ID with the provided value if any.
-    params = [
+    return [
         ItemNum, ItemName, 1001, Cost,            # 1-4
         Price, 0.00, 0.00, 0,                       # 5-8
         0, 0, 0, 0,                               # 9-12
@@ -1289,11 +2605,30 @@ def add_item():
         0, 0, 0, 0,                                # 93-96
         0, None                                   # 97-98
     ]
+
+@app.route('/add-item', methods=['POST'])
+@invalidates(response_cache, data_versions, item_cache, label_item_cache)
+def add_item():
+    data = request.get_json()
+    # Get required fields from the request payload
+    ItemNum = data.get('ItemNum')
+    ItemName = data.get('ItemName')
+    Cost = data.get('Cost')
+    Price = data.get('Price')
+    
+    # Check if the department is provided; if not, use the default 'NONE'
+    Dept_ID = data.get('Dept_ID') if data.get('Dept_ID') is not None else 'NONE'
+    
+    # Check if all required fields are provided
+    if not all([ItemNum, ItemName, Cost, Price]):
+        return jsonify({'error': 'Missing required fields'}), 400
+
+    params = inventory_insert_params(ItemNum, ItemName, Cost, Price, Dept_ID)
     
     try:
         connection = get_db_connection()
         cursor = connection.cursor()
-        cursor.execute(query, params)
+        cursor.execute(INVENTORY_INSERT_QUERY, params)
         connection.commit()
         return jsonify({'message': 'Item added successfully'}), 201
     except pyodbc.Error as e:
@@ -1309,6 +2644,7 @@ def add_item():
 
 
 @app.route('/delete-item', methods=['DELETE'])
+@invalidates(response_cache, data_versions, item_cache, label_item_cache)
 def delete_item():
     data = request.get_json()
     # Get the ItemNum from the request payload
@@ -1379,19 +2715,30 @@ def delete_item():
 # ------------------------------------------------------------------------------
 @app.route('/api/get_firebase_items', methods=['GET'])
 def get_firebase_items():
+    """
+    The four item fields of every Firestore Inventory document (projected, so
+    cold reads skip the rest). ?limit=&after= pages, ?updated_since= filters.
+    """
     try:
-        items_ref = db.collection('Inventory')
-        docs = items_ref.stream()
+        page = parse_page_args()
+        updated_since = parse_updated_since()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        documents, next_cursor, source = firestore_inventory_documents(
+            FIRESTORE_ITEM_FIELDS, page=page, updated_since=updated_since
+        )
         data = []
-        for doc in docs:
-            item_data = doc.to_dict()
+        for _, item_data in documents:
             data.append({
                 'itemNum': item_data.get('itemNum'),
                 'itemName': item_data.get('itemName'),
                 'cost': item_data.get('cost'),
                 'price': item_data.get('price')
             })
-        return jsonify({'data': data}), 200
+        response = page_response(data, next_cursor, page[0]) if page else jsonify({'data': data})
+        response.headers['X-Data-Source'] = source
+        return response, 200
     except Exception as e:
         print(f"Error occurred: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -1399,59 +2746,135 @@ def get_firebase_items():
 
 
 
-def fetch_items_from_firebase():
-    """Fetch items from the Firebase endpoint."""
-    response = requests.get('http://localhost:5000/api/get_firebase_items')
-    if response.status_code != 200:
-        raise Exception("Failed to fetch items from Firebase")
-    return response.json().get('data', [])
+FIRESTORE_IMPORT_CHUNK = 1000    # rows per fast_executemany call; all chunks share one transaction
 
-def add_item_to_inventory(item_payload):
-    """Send a POST request to add an item to the inventory."""
-    response = requests.post('http://localhost:5000/add-item', json=item_payload)
-    return response.status_code == 201, response.text
+def existing_item_keys(cursor):
+    """item_key of every ItemNum already in Inventory."""
+    cursor.execute("SELECT ItemNum FROM Inventory")
+    keys = set()
+    while True:
+        rows = cursor.fetchmany(5000)
+        if not rows:
+            break
+        keys.update(item_key(row[0]) for row in rows)
+    return keys
 
+def transaction_open(cursor):
+    """True while the connection's transaction is still open and committable."""
+    cursor.execute("SELECT @@TRANCOUNT, XACT_STATE()")
+    trancount, state = cursor.fetchone()
+    return trancount > 0 and state == 1
 
+def insert_inventory_items(conn, items):
+    """
+    Insert (payload, params) pairs in one transaction and return
+    [(payload, error), ...] for the rows that failed. The whole set goes
+    through fast_executemany first; if SQL Server rejects any row, that is
+    rolled back and the rows are inserted one at a time on the same
+    connection so each failure can be reported and the others still commit.
+    Most errors only undo the failing statement, but some roll back (or
+    doom) the whole transaction; then the rows inserted so far are gone
+    too, so the pass starts over without the rows that failed.
+    """
+    cursor = conn.cursor()
+    cursor.fast_executemany = True
+    try:
+        for start in range(0, len(items), FIRESTORE_IMPORT_CHUNK):
+            cursor.executemany(INVENTORY_INSERT_QUERY, [params for _, params in items[start:start + FIRESTORE_IMPORT_CHUNK]])
+        conn.commit()
+        return []
+    except pyodbc.Error as e:
+        conn.rollback()
+        print(f"Bulk insert rejected ({e}); retrying row by row")
+    failed = []
+    remaining = list(items)
+    while True:
+        cursor = conn.cursor()
+        rejected = set()
+        lost = False
+        for index, (payload, params) in enumerate(remaining):
+            try:
+                cursor.execute(INVENTORY_INSERT_QUERY, params)
+            except pyodbc.Error as e:
+                failed.append((payload, str(e)))
+                rejected.add(index)
+                if not transaction_open(cursor):
+                    lost = True
+                    break
+        if not lost:
+            conn.commit()
+            return failed
+        conn.rollback()
+        print(f"Insert of {payload.get('ItemNum')} ended the transaction; retrying the other rows")
+        remaining = [item for index, item in enumerate(remaining) if index not in rejected]
 
 @app.route('/api/fetch_and_add_items', methods=['POST'])
 def fetch_and_add_items():
+    """
+    Import Firestore Inventory items that SQL Server does not have yet.
+    Firestore is read in-process (the mirror when loaded) and the new items
+    are inserted over one connection in a single transaction. The caches are
+    cleared whenever rows were inserted, including the 409/500 responses
+    that report skipped or failed items next to committed ones.
+    """
     try:
-        # Fetch items from Firebase
-        fetched_items = fetch_items_from_firebase()
-        print("Fetched items:", fetched_items)
-
-        # Retrieve existing items and collect their item numbers for duplicate checking
-        existing_items = get_existing_items()
-        existing_item_nums = {item['ItemNum'] for item in existing_items}
-
-        # Partition items into duplicates and unique items
-        duplicate_items = [item for item in fetched_items if item.get('itemNum') in existing_item_nums]
-        unique_items = [item for item in fetched_items if item.get('itemNum') not in existing_item_nums]
-
-        failed_items = []
-        # Process unique items: add each one individually
-        for item in unique_items:
-            item_payload = {
-                'ItemNum': item.get('itemNum'),
-                'ItemName': item.get('itemName'),
-                'Cost': item.get('cost'),
-                'Price': item.get('price'),
-            }
-            success, response_text = add_item_to_inventory(item_payload)
-            if not success:
-                failed_items.append(item_payload)
-                print(f"Failed to add item: {item_payload}, Response: {response_text}")
-
+        started = time.monotonic()
+        documents, _, source = firestore_inventory_documents(FIRESTORE_ITEM_FIELDS)
+        fetched_items = [item for _, item in documents]
+
+        with get_db_connection(owner="firestore import") as conn:
+            existing_keys = existing_item_keys(conn.cursor())
+
+            duplicate_items = []
+            failed_items = []
+            to_insert = []
+            seen = set()
+            for item in fetched_items:
+                item_payload = {
+                    'ItemNum': item.get('itemNum'),
+                    'ItemName': item.get('itemName'),
+                    'Cost': item.get('cost'),
+                    'Price': item.get('price'),
+                }
+                if not all(item_payload.values()):
+                    failed_items.append({**item_payload, 'error': 'Missing required fields'})
+                    continue
+                key = item_key(item_payload['ItemNum'])
+                if key in existing_keys or key in seen:
+                    duplicate_items.append(item)
+                    continue
+                seen.add(key)
+                params = inventory_insert_params(
+                    item_payload['ItemNum'], item_payload['ItemName'], item_payload['Cost'], item_payload['Price']
+                )
+                to_insert.append((item_payload, params))
+
+            rejected = insert_inventory_items(conn, to_insert) if to_insert else []
+        for item_payload, error in rejected:
+            print(f"Failed to add item: {item_payload}, Error: {error}")
+            failed_items.append({**item_payload, 'error': error})
+
+        report = {
+            'source': source,
+            'fetched': len(fetched_items),
+            'inserted': len(to_insert) - len(rejected),
+            'duplicates': len(duplicate_items),
+            'failed': len(failed_items),
+            'seconds': round(time.monotonic() - started, 3),
+        }
+        if report['inserted']:
+            invalidate(response_cache, data_versions, item_cache, label_item_cache)
         # Determine response based on results
         if failed_items:
-            return jsonify({'error': 'Some items failed to add', 'failed_items': failed_items}), 500
+            return jsonify({'error': 'Some items failed to add', 'failed_items': failed_items, **report}), 500
         if duplicate_items:
             return jsonify({
                 'warning': 'Some items already exist in the inventory and were skipped',
-                'duplicate_items': duplicate_items
+                'duplicate_items': duplicate_items,
+                **report
             }), 409
 
-        return jsonify({'message': 'Items fetched and added to inventory successfully!'}), 201
+        return jsonify({'message': 'Items fetched and added to inventory successfully!', **report}), 201
 
     except Exception as e:
         print("Error occurred:", str(e))
@@ -1462,12 +2885,23 @@ def fetch_and_add_items():
 
 
 @app.route('/api/label_data', methods=['GET'])
+@conditional(data_versions, 'inventory')
 def get_label_data():
     try:
-        with pyodbc.connect(connection_string) as conn:
+        page = parse_page_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        with get_db_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT itemNum, itemName, price FROM Inventory")
-            rows = cursor.fetchall()
+            if page:
+                limit, after_key = page
+                rows, next_cursor = fetch_keyset_page(
+                    cursor, "itemNum, itemName, price", "Inventory", ["ItemNum", "Store_ID"], limit, after_key
+                )
+            else:
+                cursor.execute("SELECT itemNum, itemName, price FROM Inventory")
+                rows = cursor.fetchall()
             label_data = []
             for row in rows:
                 label_data.append({
@@ -1475,6 +2909,8 @@ def get_label_data():
                     'itemName': row[1],
                     'price': row[2]
                 })
+            if page:
+                return page_response(label_data, next_cursor, limit)
             return jsonify(label_data)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -1482,97 +2918,117 @@ def get_label_data():
 # ------------------------------------------------------------------------------
 # Market Basket Analysis & Recommendation APIs
 # ------------------------------------------------------------------------------
+def parse_rule_query_args():
+    """Read paging, sorting and filtering parameters for the rules listing."""
+    args = request.args
+    sort_by = args.get('sort_by', 'lift')
+    if sort_by not in SORT_KEYS:
+        raise ValueError(f"'sort_by' must be one of: {', '.join(SORT_KEYS)}.")
+    order = args.get('order', 'desc')
+    if order not in ('asc', 'desc'):
+        raise ValueError("'order' must be 'asc' or 'desc'.")
+    try:
+        offset = int(args.get('offset', 0))
+        limit = int(args.get('limit', DEFAULT_RULES_LIMIT))
+        thresholds = {
+            name: float(args[name]) if name in args else None
+            for name in ('min_support', 'min_confidence', 'min_lift')
+        }
+    except ValueError:
+        raise ValueError("'offset'/'limit' must be integers and thresholds must be numbers.")
+    if offset < 0 or limit < 1:
+        raise ValueError("'offset' must be >= 0 and 'limit' >= 1.")
+    if thresholds['min_support'] is not None and not 0 < thresholds['min_support'] <= 1:
+        raise ValueError("'min_support' must be in (0, 1].")
+    return {
+        'sort_by': sort_by,
+        'descending': order == 'desc',
+        'offset': offset,
+        'limit': min(limit, MAX_RULES_LIMIT),
+        'item': args.get('item'),
+        **thresholds
+    }
+
 @app.route('/api/market_basket', methods=['GET'])
 def market_basket_analysis():
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT invoice_number, diffitemname FROM invoice_itemized")
-        rows = cursor.fetchall()
-        conn.close()
-        data = [(str(row[0]), str(row[1])) for row in rows]
-        print(f"Data sample: {data[:5] if data else 'No data'}")
-        print(f"Data length: {len(data)}")
-        df = pd.DataFrame(data, columns=["invoice_number", "item_name"])
-        basket = pd.crosstab(index=df['invoice_number'], columns=df['item_name']).astype(bool)
-        frequent_itemsets = apriori(basket, min_support=0.01, use_colnames=True)
-        if frequent_itemsets.empty:
+        rule_query = parse_rule_query_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        # Thresholds looser than the cached model's trigger a one-off sparse FP-growth mine.
+        model = basket_rules.model_for(
+            get_db_connection,
+            min_support=rule_query['min_support'],
+            min_confidence=rule_query['min_confidence'],
+            min_lift=rule_query['min_lift']
+        )
+        if model.itemset_count == 0:
             return jsonify({
                 "success": False,
                 "message": "No frequent itemsets found. Try lowering the support threshold.",
-                "data_sample": df.head(10).to_dict('records')
+                "model": model.info()
             }), 200
-        rules = association_rules(frequent_itemsets, metric="lift", min_threshold=1.0)
-        if rules.empty:
+        if not model.rules:
             return jsonify({
                 "success": False,
                 "message": "No association rules found. Try lowering the lift threshold.",
-                "itemsets_found": len(frequent_itemsets)
+                "itemsets_found": model.itemset_count
             }), 200
-        rules = rules.replace([float('inf'), float('-inf')], 999.99)
-        results = []
-        for _, row in rules.iterrows():
-            results.append({
-                'antecedents': list(row['antecedents']),
-                'consequents': list(row['consequents']),
-                'support': float(row['support']),
-                'confidence': float(row['confidence']),
-                'lift': float(row['lift'])
-            })
+        total, rules = model.query(**rule_query)
         return jsonify({
             "success": True,
-            "rules_count": len(results),
-            "rules": results[:20]
+            "rules_count": len(model.rules),
+            "matching_rules": total,
+            "offset": rule_query['offset'],
+            "limit": rule_query['limit'],
+            "rules": rules,
+            "model": model.info()
         })
+    except MiningMemoryError as e:
+        return jsonify({"success": False, "error": str(e)}), 422
     except Exception as e:
         print("Error:", str(e))
         import traceback
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/market_basket/status', methods=['GET'])
+def market_basket_status():
+    """
+    Returns the cached rule model's watermark, size and background refresh state.
+    """
+    return jsonify(basket_rules.status()), 200
+
+@app.route('/api/market_basket/refresh', methods=['POST'])
+def market_basket_refresh():
+    """
+    Starts a background re-mine regardless of how many new invoices have arrived.
+    """
+    started = basket_rules.refresh_async(get_db_connection)
+    return jsonify({"success": True, "started": started, **basket_rules.status()}), 202
+
 @app.route('/api/recommend/<item_id>', methods=['GET'])
 def recommend_item(item_id):
     try:
         print(f"Received recommendation request for item_id: {item_id}")
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT invoice_number, diffitemname FROM invoice_itemized")
-        rows = cursor.fetchall()
-        conn.close()
-        data = [(str(row[0]), str(row[1])) for row in rows]
-        print(f"Data sample for recommendation: {data[:5] if data else 'No data'}")
-        print(f"Data length: {len(data)}")
-        df = pd.DataFrame(data, columns=["invoice_number", "item_name"])
-        basket = pd.crosstab(index=df['invoice_number'], columns=df['item_name']).astype(bool)
-        frequent_itemsets = apriori(basket, min_support=0.01, use_colnames=True)
-        if frequent_itemsets.empty:
+        model = basket_rules.model(get_db_connection)
+        if model.itemset_count == 0:
             result = {
                 "success": False,
                 "message": "No frequent itemsets found. Try lowering the support threshold.",
                 "item_id": item_id
             }
             return Response(json.dumps(result), mimetype='application/json')
-        rules = association_rules(frequent_itemsets, metric="lift", min_threshold=1.0)
-        if rules.empty:
+        if not model.rules:
             result = {
                 "success": False,
                 "message": "No association rules found. Try lowering the lift threshold.",
                 "item_id": item_id
             }
             return Response(json.dumps(result), mimetype='application/json')
-        rules = rules.replace([float('inf'), float('-inf')], 999.99)
-        recommendations = []
-        for _, row in rules.iterrows():
-            antecedents = list(row['antecedents'])
-            if item_id in antecedents:
-                for item in list(row['consequents']):
-                    recommendations.append({
-                        "item": item,
-                        "confidence": float(row['confidence']),
-                        "lift": float(row['lift'])
-                    })
-        recommendations.sort(key=lambda x: x["lift"], reverse=True)
-        recommendations = recommendations[:5]
+        limit = request.args.get('limit', DEFAULT_RECOMMENDATIONS, type=int)
+        recommendations = model.recommend(item_id, limit=max(limit, 1))
         result = {
             "success": True,
             "item_id": item_id,
@@ -1590,13 +3046,294 @@ def recommend_item(item_id):
         response.headers['Content-Type'] = 'application/json'
         return response
 
+@app.route('/api/recommend_cart', methods=['POST'])
+def recommend_for_cart():
+    """
+    Suggests up to ``k`` items for the whole cart at checkout.
+    Expects JSON {"items": [ItemNum or item name, ...], "k": 5}; items already in
+    the cart are excluded and every rule whose antecedents are all in the cart counts.
+    """
+    data = request.get_json(silent=True) or {}
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        return jsonify({"success": False, "error": "Expected a non-empty list of cart items."}), 400
+    if len(items) > MAX_CART_ITEMS:
+        return jsonify({"success": False, "error": f"A cart may contain at most {MAX_CART_ITEMS} items."}), 400
+    try:
+        k = int(data.get('k', DEFAULT_RECOMMENDATIONS))
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "error": "'k' must be an integer."}), 400
+    try:
+        model = basket_rules.model(get_db_connection)
+        cart, unmatched = basket_rules.resolve_items(items)
+        recommendations = model.recommend_for_cart(cart, k=max(k, 1))
+        return jsonify({
+            "success": True,
+            "cart": cart,
+            "unmatched": unmatched,
+            "recommendations": recommendations
+        }), 200
+    except Exception as e:
+        print("Error in /api/recommend_cart:", str(e))
+        return jsonify({"success": False, "error": str(e)}), 500
+
 # ------------------------------------------------------------------------------
 # Inventory Dashboard API
 # ------------------------------------------------------------------------------
+DASHBOARD_QUERY_TIMEOUT = 20   # seconds per section, counted from when the section starts
+DASHBOARD_WORKERS = 4          # sections (and pooled connections) in flight at once
+DASHBOARD_MAX_CONCURRENT = 1   # dashboard requests computed at once; others wait their turn
+DASHBOARD_QUEUE_TIMEOUT = 30   # seconds a request waits for its turn before a 503
+dashboard_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=DASHBOARD_WORKERS, thread_name_prefix='inventory-dashboard'
+)
+dashboard_slots = threading.BoundedSemaphore(DASHBOARD_MAX_CONCURRENT)
+
+def timed_section(started, name, fn, *args):
+    """Run one section on a worker, recording when it actually started."""
+    started[name] = time.monotonic()
+    return fn(*args)
+
+def run_dashboard_sections(sections):
+    """
+    Run every section on the shared executor. A section times out
+    DASHBOARD_QUERY_TIMEOUT seconds after it starts, so time spent queued
+    behind the other sections does not count against it.
+    Returns ({name: result}, {name: error}) for the finished and failed sections.
+    """
+    started = {}
+    futures = {
+        dashboard_executor.submit(timed_section, started, name, fn, *args): name
+        for name, (fn, args, _) in sections.items()
+    }
+    results = {}
+    errors = {}
+    pending = set(futures)
+    while pending:
+        done, pending = concurrent.futures.wait(pending, timeout=0.5)
+        for future in done:
+            name = futures[future]
+            if future.exception() is not None:
+                errors[name] = str(future.exception())
+            else:
+                results[name] = future.result()
+        now = time.monotonic()
+        for future in list(pending):
+            name = futures[future]
+            if name in started and now - started[name] > DASHBOARD_QUERY_TIMEOUT:
+                future.cancel()
+                errors[name] = f"Timed out after {DASHBOARD_QUERY_TIMEOUT}s"
+                pending.discard(future)
+    return results, errors
+
+def run_dashboard_query(section, query, params=()):
+    """Run one dashboard query on its own pooled connection with a server-side timeout."""
+    with get_db_connection(owner=f"GET /api/inventory_dashboard [{section}]") as conn:
+        conn.timeout = DASHBOARD_QUERY_TIMEOUT
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        return cursor.fetchall()
+
+def dashboard_inventory_summary(department):
+    inventory_query = """
+        SELECT 
+            COUNT(*) as total_items,
+            SUM(In_Stock) as total_stock,
+            SUM(Cost * In_Stock) as total_inventory_cost,
+            SUM(Price * In_Stock) as total_inventory_value,
+            AVG(In_Stock) as avg_stock_per_item,
+            SUM(CASE WHEN In_Stock <= Reorder_Level THEN 1 ELSE 0 END) as items_to_reorder,
+            SUM(CASE WHEN In_Stock = 0 THEN 1 ELSE 0 END) as out_of_stock_items
+        FROM Inventory
+    """
+    if department:
+        inventory_query += " WHERE Dept_ID = ?"
+        rows = run_dashboard_query('inventory_summary', inventory_query, (department,))
+    else:
+        rows = run_dashboard_query('inventory_summary', inventory_query)
+    inventory_summary = rows[0]
+    return {
+        'total_items': inventory_summary[0],
+        'total_stock': inventory_summary[1],
+        'total_inventory_cost': float(inventory_summary[2]) if inventory_summary[2] else 0,
+        'total_inventory_value': float(inventory_summary[3]) if inventory_summary[3] else 0,
+        'avg_stock_per_item': float(inventory_summary[4]) if inventory_summary[4] else 0,
+        'items_to_reorder': inventory_summary[5],
+        'out_of_stock_items': inventory_summary[6]
+    }
+
+def dashboard_departments():
+    dept_query = """
+        SELECT 
+            Dept_ID,
+            COUNT(*) as item_count,
+            SUM(In_Stock) as total_stock,
+            SUM(Cost * In_Stock) as inventory_cost,
+            SUM(Price * In_Stock) as inventory_value,
+            SUM(CASE WHEN In_Stock <= Reorder_Level THEN 1 ELSE 0 END) as items_to_reorder
+        FROM Inventory
+        WHERE Dept_ID IS NOT NULL AND Dept_ID != 'NONE'
+        GROUP BY Dept_ID
+        ORDER BY inventory_value DESC
+    """
+    departments = []
+    for row in run_dashboard_query('departments', dept_query):
+        departments.append({
+            'department': row[0],
+            'item_count': row[1],
+            'total_stock': row[2],
+            'inventory_cost': float(row[3]) if row[3] else 0,
+            'inventory_value': float(row[4]) if row[4] else 0,
+            'items_to_reorder': row[5]
+        })
+    return departments
+
+def dashboard_top_selling_items(start_date, end_date, department):
+    top_selling_query = """
+        SELECT TOP 20
+            i.ItemNum,
+            i.ItemName,
+            SUM(ii.Quantity) as total_quantity_sold,
+            COUNT(DISTINCT ii.Invoice_Number) as order_count,
+            i.In_Stock as current_stock,
+            i.Price as unit_price,
+            i.Cost as unit_cost,
+            SUM(ii.Quantity * ii.PricePer) as total_revenue,
+            SUM(ii.Quantity * i.Cost) as total_cost
+        FROM Invoice_Itemized ii
+        JOIN Inventory i ON ii.ItemNum = i.ItemNum
+        JOIN Invoice_Totals it ON ii.Invoice_Number = it.Invoice_Number
+        WHERE it.DateTime BETWEEN ? AND ?{department_filter}
+        GROUP BY i.ItemNum, i.ItemName, i.In_Stock, i.Price, i.Cost 
+        ORDER BY total_quantity_sold DESC
+    """
+    if department:
+        rows = run_dashboard_query(
+            'top_selling_items',
+            top_selling_query.format(department_filter=" AND i.Dept_ID = ?"),
+            (start_date, end_date, department)
+        )
+    else:
+        rows = run_dashboard_query(
+            'top_selling_items',
+            top_selling_query.format(department_filter=""),
+            (start_date, end_date)
+        )
+    top_selling_items = []
+    for row in rows:
+        total_revenue = float(row[7]) if row[7] else 0
+        total_cost = float(row[8]) if row[8] else 0
+        profit = total_revenue - total_cost
+        profit_margin = (profit / total_revenue * 100) if total_revenue > 0 else 0
+        top_selling_items.append({
+            'item_num': row[0],
+            'item_name': row[1],
+            'quantity_sold': row[2],
+            'order_count': row[3],
+            'current_stock': row[4],
+            'unit_price': float(row[5]) if row[5] else 0,
+            'unit_cost': float(row[6]) if row[6] else 0,
+            'total_revenue': total_revenue,
+            'total_cost': total_cost,
+            'profit': profit,
+            'profit_margin': profit_margin
+        })
+    return top_selling_items
+
+def dashboard_items_to_reorder(department):
+    reorder_query = """
+        SELECT 
+            ItemNum,
+            ItemName,
+            In_Stock,
+            Reorder_Level,
+            Reorder_Quantity,
+            Cost,
+            Price,
+            Dept_ID,
+            (Reorder_Level - In_Stock) as shortage
+        FROM Inventory
+        WHERE In_Stock <= Reorder_Level
+    """
+    if department:
+        reorder_query += " AND Dept_ID = ? ORDER BY shortage DESC"
+        rows = run_dashboard_query('items_to_reorder', reorder_query, (department,))
+    else:
+        reorder_query += " ORDER BY shortage DESC"
+        rows = run_dashboard_query('items_to_reorder', reorder_query)
+    items_to_reorder = []
+    for row in rows:
+        items_to_reorder.append({
+            'item_num': row[0],
+            'item_name': row[1],
+            'current_stock': row[2],
+            'reorder_level': row[3],
+            'reorder_quantity': row[4],
+            'unit_cost': float(row[5]) if row[5] else 0,
+            'unit_price': float(row[6]) if row[6] else 0,
+            'department': row[7],
+            'shortage': row[8]
+        })
+    return items_to_reorder
+
+def dashboard_inventory_turnover(start_date, end_date):
+    turnover_query = """
+        SELECT 
+            inv.Dept_ID,
+            SUM(ii.Quantity) as total_sold,
+            AVG(inv.In_Stock) as avg_inventory,
+            CASE WHEN AVG(inv.In_Stock) > 0 THEN SUM(ii.Quantity) / AVG(inv.In_Stock) ELSE 0 END as turnover_ratio
+        FROM Invoice_Itemized ii
+        JOIN Inventory inv ON ii.ItemNum = inv.ItemNum
+        JOIN Invoice_Totals it ON ii.Invoice_Number = it.Invoice_Number
+        WHERE it.DateTime BETWEEN ? AND ?
+        GROUP BY inv.Dept_ID
+        ORDER BY turnover_ratio DESC
+    """
+    inventory_turnover = []
+    for row in run_dashboard_query('inventory_turnover', turnover_query, (start_date, end_date)):
+        inventory_turnover.append({
+            'department': row[0],
+            'total_sold': row[1],
+            'avg_inventory': float(row[2]) if row[2] else 0,
+            'turnover_ratio': float(row[3]) if row[3] else 0
+        })
+    return inventory_turnover
+
+def dashboard_sales_trend(start_date, end_date):
+    trend_query = """
+        SELECT 
+            CAST(it.DateTime AS DATE) as sale_date,
+            COUNT(DISTINCT it.Invoice_Number) as order_count,
+            SUM(it.Total_Price) as total_sales,
+            COUNT(DISTINCT ii.ItemNum) as unique_items_sold,
+            SUM(ii.Quantity) as total_quantity_sold
+        FROM Invoice_Totals it
+        JOIN Invoice_Itemized ii ON it.Invoice_Number = ii.Invoice_Number
+        WHERE it.DateTime BETWEEN ? AND ?
+        GROUP BY CAST(it.DateTime AS DATE)
+        ORDER BY sale_date
+    """
+    sales_trend = []
+    for row in run_dashboard_query('sales_trend', trend_query, (start_date, end_date)):
+        sales_trend.append({
+            'date': row[0].isoformat() if row[0] else None,
+            'order_count': row[1],
+            'total_sales': float(row[2]) if row[2] else 0,
+            'unique_items_sold': row[3],
+            'total_quantity_sold': row[4]
+        })
+    return sales_trend
+
 @app.route('/api/inventory_dashboard', methods=['GET'])
+@conditional(data_versions, 'inventory', 'invoices')
+@cached(response_cache, ttl=DASHBOARD_CACHE_TTLS['inventory_dashboard'])
 def get_inventory_dashboard():
     """
     Provides comprehensive inventory metrics and insights.
+    The six sections are independent queries and run concurrently on separate
+    connections; a section that fails or times out is reported under 'errors'
+    and the rest of the dashboard is still returned.
     """
     try:
         start_date_str = request.args.get('start_date')
@@ -1604,213 +3341,44 @@ def get_inventory_dashboard():
         department = request.args.get('department')
         start_date = datetime.strptime(start_date_str, '%Y-%m-%d') if start_date_str else datetime.now() - timedelta(days=720)
         end_date = datetime.strptime(end_date_str, '%Y-%m-%d') if end_date_str else datetime.now()
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            inventory_query = """
-                SELECT 
-                    COUNT(*) as total_items,
-                    SUM(In_Stock) as total_stock,
-                    SUM(Cost * In_Stock) as total_inventory_cost,
-                    SUM(Price * In_Stock) as total_inventory_value,
-                    AVG(In_Stock) as avg_stock_per_item,
-                    SUM(CASE WHEN In_Stock <= Reorder_Level THEN 1 ELSE 0 END) as items_to_reorder,
-                    SUM(CASE WHEN In_Stock = 0 THEN 1 ELSE 0 END) as out_of_stock_items
-                FROM Inventory
-            """
-            if department:
-                inventory_query += " WHERE Dept_ID = ?"
-                cursor.execute(inventory_query, (department,))
-            else:
-                cursor.execute(inventory_query)
-            inventory_summary = cursor.fetchone()
-            dept_query = """
-                SELECT 
-                    Dept_ID,
-                    COUNT(*) as item_count,
-                    SUM(In_Stock) as total_stock,
-                    SUM(Cost * In_Stock) as inventory_cost,
-                    SUM(Price * In_Stock) as inventory_value,
-                    SUM(CASE WHEN In_Stock <= Reorder_Level THEN 1 ELSE 0 END) as items_to_reorder
-                FROM Inventory
-                WHERE Dept_ID IS NOT NULL AND Dept_ID != 'NONE'
-                GROUP BY Dept_ID
-                ORDER BY inventory_value DESC
-            """
-            cursor.execute(dept_query)
-            dept_rows = cursor.fetchall()
-            departments = []
-            for row in dept_rows:
-                departments.append({
-                    'department': row[0],
-                    'item_count': row[1],
-                    'total_stock': row[2],
-                    'inventory_cost': float(row[3]) if row[3] else 0,
-                    'inventory_value': float(row[4]) if row[4] else 0,
-                    'items_to_reorder': row[5]
-                })
-            if department:
-                top_selling_query = """
-                    SELECT TOP 20
-                        i.ItemNum,
-                        i.ItemName,
-                        SUM(ii.Quantity) as total_quantity_sold,
-                        COUNT(DISTINCT ii.Invoice_Number) as order_count,
-                        i.In_Stock as current_stock,
-                        i.Price as unit_price,
-                        i.Cost as unit_cost,
-                        SUM(ii.Quantity * ii.PricePer) as total_revenue,
-                        SUM(ii.Quantity * i.Cost) as total_cost
-                    FROM Invoice_Itemized ii
-                    JOIN Inventory i ON ii.ItemNum = i.ItemNum
-                    JOIN Invoice_Totals it ON ii.Invoice_Number = it.Invoice_Number
-                    WHERE it.DateTime BETWEEN ? AND ? AND i.Dept_ID = ?
-                    GROUP BY i.ItemNum, i.ItemName, i.In_Stock, i.Price, i.Cost 
-                    ORDER BY total_quantity_sold DESC
-                """
-                cursor.execute(top_selling_query, (start_date, end_date, department))
-            else:
-                top_selling_query = """
-                    SELECT TOP 20
-                        i.ItemNum,
-                        i.ItemName,
-                        SUM(ii.Quantity) as total_quantity_sold,
-                        COUNT(DISTINCT ii.Invoice_Number) as order_count,
-                        i.In_Stock as current_stock,
-                        i.Price as unit_price,
-                        i.Cost as unit_cost,
-                        SUM(ii.Quantity * ii.PricePer) as total_revenue,
-                        SUM(ii.Quantity * i.Cost) as total_cost
-                    FROM Invoice_Itemized ii
-                    JOIN Inventory i ON ii.ItemNum = i.ItemNum
-                    JOIN Invoice_Totals it ON ii.Invoice_Number = it.Invoice_Number
-                    WHERE it.DateTime BETWEEN ? AND ?
-                    GROUP BY i.ItemNum, i.ItemName, i.In_Stock, i.Price, i.Cost 
-                    ORDER BY total_quantity_sold DESC
-                """
-                cursor.execute(top_selling_query, (start_date, end_date))
-            top_selling_rows = cursor.fetchall()
-            top_selling_items = []
-            for row in top_selling_rows:
-                total_revenue = float(row[7]) if row[7] else 0
-                total_cost = float(row[8]) if row[8] else 0
-                profit = total_revenue - total_cost
-                profit_margin = (profit / total_revenue * 100) if total_revenue > 0 else 0
-                top_selling_items.append({
-                    'item_num': row[0],
-                    'item_name': row[1],
-                    'quantity_sold': row[2],
-                    'order_count': row[3],
-                    'current_stock': row[4],
-                    'unit_price': float(row[5]) if row[5] else 0,
-                    'unit_cost': float(row[6]) if row[6] else 0,
-                    'total_revenue': total_revenue,
-                    'total_cost': total_cost,
-                    'profit': profit,
-                    'profit_margin': profit_margin
-                })
-            reorder_query = """
-                SELECT 
-                    ItemNum,
-                    ItemName,
-                    In_Stock,
-                    Reorder_Level,
-                    Reorder_Quantity,
-                    Cost,
-                    Price,
-                    Dept_ID,
-                    (Reorder_Level - In_Stock) as shortage
-                FROM Inventory
-                WHERE In_Stock <= Reorder_Level
-            """
-            if department:
-                reorder_query += " AND Dept_ID = ? ORDER BY shortage DESC"
-                cursor.execute(reorder_query, (department,))
-            else:
-                reorder_query += " ORDER BY shortage DESC"
-                cursor.execute(reorder_query)
-            reorder_rows = cursor.fetchall()
-            items_to_reorder = []
-            for row in reorder_rows:
-                items_to_reorder.append({
-                    'item_num': row[0],
-                    'item_name': row[1],
-                    'current_stock': row[2],
-                    'reorder_level': row[3],
-                    'reorder_quantity': row[4],
-                    'unit_cost': float(row[5]) if row[5] else 0,
-                    'unit_price': float(row[6]) if row[6] else 0,
-                    'department': row[7],
-                    'shortage': row[8]
-                })
-            turnover_query = """
-                SELECT 
-                    inv.Dept_ID,
-                    SUM(ii.Quantity) as total_sold,
-                    AVG(inv.In_Stock) as avg_inventory,
-                    CASE WHEN AVG(inv.In_Stock) > 0 THEN SUM(ii.Quantity) / AVG(inv.In_Stock) ELSE 0 END as turnover_ratio
-                FROM Invoice_Itemized ii
-                JOIN Inventory inv ON ii.ItemNum = inv.ItemNum
-                JOIN Invoice_Totals it ON ii.Invoice_Number = it.Invoice_Number
-                WHERE it.DateTime BETWEEN ? AND ?
-                GROUP BY inv.Dept_ID
-                ORDER BY turnover_ratio DESC
-            """
-            cursor.execute(turnover_query, (start_date, end_date))
-            turnover_rows = cursor.fetchall()
-            inventory_turnover = []
-            for row in turnover_rows:
-                inventory_turnover.append({
-                    'department': row[0],
-                    'total_sold': row[1],
-                    'avg_inventory': float(row[2]) if row[2] else 0,
-                    'turnover_ratio': float(row[3]) if row[3] else 0
-                })
-            trend_query = """
-                SELECT 
-                    CAST(it.DateTime AS DATE) as sale_date,
-                    COUNT(DISTINCT it.Invoice_Number) as order_count,
-                    SUM(it.Total_Price) as total_sales,
-                    COUNT(DISTINCT ii.ItemNum) as unique_items_sold,
-                    SUM(ii.Quantity) as total_quantity_sold
-                FROM Invoice_Totals it
-                JOIN Invoice_Itemized ii ON it.Invoice_Number = ii.Invoice_Number
-                WHERE it.DateTime BETWEEN ? AND ?
-                GROUP BY CAST(it.DateTime AS DATE)
-                ORDER BY sale_date
-            """
-            cursor.execute(trend_query, (start_date, end_date))
-            trend_rows = cursor.fetchall()
-            sales_trend = []
-            for row in trend_rows:
-                sales_trend.append({
-                    'date': row[0].isoformat() if row[0] else None,
-                    'order_count': row[1],
-                    'total_sales': float(row[2]) if row[2] else 0,
-                    'unique_items_sold': row[3],
-                    'total_quantity_sold': row[4]
-                })
-            dashboard_data = {
-                'inventory_summary': {
-                    'total_items': inventory_summary[0],
-                    'total_stock': inventory_summary[1],
-                    'total_inventory_cost': float(inventory_summary[2]) if inventory_summary[2] else 0,
-                    'total_inventory_value': float(inventory_summary[3]) if inventory_summary[3] else 0,
-                    'avg_stock_per_item': float(inventory_summary[4]) if inventory_summary[4] else 0,
-                    'items_to_reorder': inventory_summary[5],
-                    'out_of_stock_items': inventory_summary[6]
-                },
-                'departments': departments,
-                'top_selling_items': top_selling_items,
-                'items_to_reorder': items_to_reorder,
-                'inventory_turnover': inventory_turnover,
-                'sales_trend': sales_trend,
-                'filters': {
-                    'start_date': start_date.isoformat(),
-                    'end_date': end_date.isoformat(),
-                    'department': department
-                }
-            }
-            return jsonify(dashboard_data), 200
+
+        sections = {
+            'inventory_summary': (dashboard_inventory_summary, (department,), None),
+            'departments': (dashboard_departments, (), []),
+            'top_selling_items': (dashboard_top_selling_items, (start_date, end_date, department), []),
+            'items_to_reorder': (dashboard_items_to_reorder, (department,), []),
+            'inventory_turnover': (dashboard_inventory_turnover, (start_date, end_date), []),
+            'sales_trend': (dashboard_sales_trend, (start_date, end_date), []),
+        }
+        # One dashboard at a time gets the workers, so concurrent requests
+        # don't interleave their sections and each holds at most
+        # DASHBOARD_WORKERS pooled connections.
+        if not dashboard_slots.acquire(timeout=DASHBOARD_QUEUE_TIMEOUT):
+            return jsonify({"error": "Dashboard busy, please retry"}), 503
+        try:
+            started = time.monotonic()
+            dashboard_data, errors = run_dashboard_sections(sections)
+        finally:
+            dashboard_slots.release()
+        for name in errors:
+            dashboard_data[name] = sections[name][2]
+            print(f"Inventory dashboard section '{name}' failed: {errors[name]}")
+
+        if len(errors) == len(sections):
+            return jsonify({"error": "All dashboard queries failed", "errors": errors}), 500
+
+        dashboard_data['filters'] = {
+            'start_date': start_date.isoformat(),
+            'end_date': end_date.isoformat(),
+            'department': department
+        }
+        dashboard_data['partial'] = bool(errors)
+        if errors:
+            # Served once, never from the cache: the next poll retries the failed sections.
+            uncacheable()
+        dashboard_data['errors'] = errors
+        dashboard_data['elapsed_ms'] = round((time.monotonic() - started) * 1000, 1)
+        return jsonify(dashboard_data), 200
     except Exception as e:
         print(f"Error in inventory dashboard: {str(e)}")
         import traceback
@@ -1819,6 +3387,7 @@ def get_inventory_dashboard():
 
 
 @app.route('/insert_data', methods=['POST'])
+@invalidates(response_cache, data_versions, item_cache, label_item_cache)
 def insert_data():
     data = request.get_json()
 
@@ -1975,6 +3544,7 @@ def insert_data():
 
 
 @app.route('/insert_basic_item', methods=['POST'])
+@invalidates(response_cache, data_versions, item_cache, label_item_cache)
 def insert_basic_item():
     data = request.get_json()
 
@@ -2232,6 +3802,7 @@ def safe_trim_item(value, max_length=30):
 # ------------------------------------------------------------------------------
 
 @app.route('/insert_items_from_processed_data', methods=['GET'])
+@invalidates(response_cache, data_versions, item_cache, label_item_cache)
 def insert_items_from_processed_data():
     """
     This route:
@@ -2455,53 +4026,66 @@ def make_serializable(results):
         processed_results.append(new_row)
     return processed_results
 
+def receipt_row(row, columns):
+    return make_serializable([dict(zip(columns, row))])[0]
+
 @app.route('/api/receipt', methods=['GET'])
 def receipt():
+    try:
+        stream_format = requested_stream_format()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    query = """
+        SELECT 
+            s.Company_Info_1,
+            s.Company_Info_2,
+            s.Company_Info_3,
+            s.Company_Info_4,
+            s.Company_Info_5,
+            it.Invoice_Number, 
+            ii.ItemNum,
+            ii.DiffItemName,
+            ii.Quantity,
+            it.Store_ID, 
+            it.Total_Price,
+            (it.Total_Tax1 + it.Total_Tax2 + it.Total_Tax3) AS Tax,
+            ct.SurChargeAmount,
+            it.Grand_Total, 
+            it.Amt_Tendered,
+            it.Total_Cost,  
+            it.DateTime,
+            ct.Type,
+            ct.Reference,
+            ct.Approval,
+            ct.tsi_Indicator,
+            ct.type,
+            ct.TruncatedCardNumber,
+            ct.tc_acc,
+            ct.emv_aid,
+            emp.Cashier_ID,
+            emp.First_Name
+        FROM 
+            invoice_totals AS it
+        INNER JOIN 
+            CC_Trans AS ct ON it.Invoice_Number = ct.CRENumber
+        INNER JOIN 
+            invoice_itemized AS ii ON it.Invoice_Number = ii.Invoice_Number
+        INNER JOIN 
+            employee AS emp ON it.cashier_id = emp.Cashier_ID
+        INNER JOIN 
+            setup AS s ON it.Store_ID = s.Store_ID
+        ORDER BY 
+            it.Invoice_Number DESC;
+    """
+    if stream_format:
+        try:
+            return stream_query(stream_format, query, receipt_row)
+        except Exception as e:
+            print("Error executing query:", e)
+            return jsonify({'error': 'Internal Server Error'}), 500
     connection = get_db_connection()
     try:
         cursor = connection.cursor()
-        query = """
-            SELECT 
-                s.Company_Info_1,
-                s.Company_Info_2,
-                s.Company_Info_3,
-                s.Company_Info_4,
-                s.Company_Info_5,
-                it.Invoice_Number, 
-                ii.ItemNum,
-                ii.DiffItemName,
-                ii.Quantity,
-                it.Store_ID, 
-                it.Total_Price,
-                (it.Total_Tax1 + it.Total_Tax2 + it.Total_Tax3) AS Tax,
-                ct.SurChargeAmount,
-                it.Grand_Total, 
-                it.Amt_Tendered,
-                it.Total_Cost,  
-                it.DateTime,
-                ct.Type,
-                ct.Reference,
-                ct.Approval,
-                ct.tsi_Indicator,
-                ct.type,
-                ct.TruncatedCardNumber,
-                ct.tc_acc,
-                ct.emv_aid,
-                emp.Cashier_ID,
-                emp.First_Name
-            FROM 
-                invoice_totals AS it
-            INNER JOIN 
-                CC_Trans AS ct ON it.Invoice_Number = ct.CRENumber
-            INNER JOIN 
-                invoice_itemized AS ii ON it.Invoice_Number = ii.Invoice_Number
-            INNER JOIN 
-                employee AS emp ON it.cashier_id = emp.Cashier_ID
-            INNER JOIN 
-                setup AS s ON it.Store_ID = s.Store_ID
-            ORDER BY 
-                it.Invoice_Number DESC;
-        """
         cursor.execute(query)
         rows = cursor.fetchall()
 
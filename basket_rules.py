@@ -0,0 +1,481 @@
+"""
+Market basket association rules, mined once and served from memory.
+
+The invoice baskets are cached as integer item codes and extended from an
+Invoice_Number watermark. Lines can still be added to held or reopened
+invoices below it, so every load also rebuilds the baskets of the newest
+``rescan_window`` invoice numbers. The rules are re-mined on a background thread
+once enough new invoices have arrived, so /api/market_basket and
+/api/recommend never mine inside a request after the first one.
+
+Mining works on a sparse CSR basket matrix with FP-growth: items below the
+support threshold are dropped before the matrix is built, and a run whose
+estimated footprint exceeds the memory ceiling is refused up front.
+"""
+import itertools
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from mlxtend.frequent_patterns import fpgrowth, association_rules
+
+from sales_aggregates import item_key
+
+MIN_SUPPORT = 0.01
+MIN_CONFIDENCE = 0.0
+MIN_LIFT = 1.0
+SORT_KEYS = ('lift', 'confidence', 'support')
+FETCH_BATCH_SIZE = 10000
+MAX_MINING_BYTES = 512 * 1024 * 1024
+# Rough cost of one FP-tree node in mlxtend (a Python object with a dict of children).
+FP_NODE_BYTES = 256
+CUSTOM_MODEL_CACHE_SIZE = 4
+# Consequents kept per antecedent item in the recommendation index.
+RECOMMENDATION_INDEX_DEPTH = 25
+# Upper bound on antecedent subsets probed for one cart, keeps a scan in the low milliseconds.
+MAX_CART_COMBINATIONS = 20000
+
+
+class MiningMemoryError(Exception):
+    """Raised when a mining run's estimated footprint exceeds the memory ceiling."""
+
+
+class ItemCodebook:
+    """Two-way mapping between item names and dense integer codes."""
+
+    def __init__(self):
+        self.codes = {}
+        self.names = []
+
+    def encode(self, name):
+        code = self.codes.get(name)
+        if code is None:
+            code = len(self.names)
+            self.codes[name] = code
+            self.names.append(name)
+        return code
+
+
+def build_sparse_basket(baskets, n_items, min_support, max_bytes=MAX_MINING_BYTES):
+    """
+    Build a boolean CSR matrix (invoices x frequent items) from ``baskets``
+    (Invoice_Number -> set of item codes). Items that cannot reach
+    ``min_support`` are dropped first. Returns (matrix, kept item codes).
+    """
+    n_invoices = len(baskets)
+    lengths = np.fromiter((len(codes) for codes in baskets.values()), dtype=np.int64, count=n_invoices)
+    indices = np.fromiter(itertools.chain.from_iterable(baskets.values()), dtype=np.int32,
+                          count=int(lengths.sum()))
+    counts = np.bincount(indices, minlength=n_items)
+    kept = np.flatnonzero(counts >= math.ceil(min_support * n_invoices))
+
+    nnz = int(counts[kept].sum())
+    estimated = nnz * (FP_NODE_BYTES + 13) + n_invoices * 16
+    if estimated > max_bytes:
+        raise MiningMemoryError(
+            f"Mining {nnz} basket entries over {len(kept)} items needs about "
+            f"{estimated // (1024 * 1024)} MB, above the {max_bytes // (1024 * 1024)} MB ceiling. "
+            f"Raise min_support to mine fewer items."
+        )
+
+    remap = np.full(n_items, -1, dtype=np.int32)
+    remap[kept] = np.arange(len(kept), dtype=np.int32)
+    columns = remap[indices]
+    rows = np.repeat(np.arange(n_invoices, dtype=np.int32), lengths)
+    mask = columns >= 0
+    # Empty rows are kept: they still count towards the support denominator.
+    matrix = sparse.csr_matrix(
+        (np.ones(int(mask.sum()), dtype=bool), (rows[mask], columns[mask])),
+        shape=(n_invoices, len(kept))
+    )
+    return matrix, kept
+
+
+def mine_rules(baskets, item_names, min_support=MIN_SUPPORT, min_confidence=MIN_CONFIDENCE,
+               min_lift=MIN_LIFT, max_bytes=MAX_MINING_BYTES):
+    """
+    Mine association rules with FP-growth over a sparse basket matrix.
+    Returns (rules, itemset_count) where each rule is a JSON-ready dict.
+    """
+    if not baskets:
+        return [], 0
+    matrix, kept = build_sparse_basket(baskets, len(item_names), min_support, max_bytes)
+    if matrix.shape[1] == 0:
+        return [], 0
+    df = pd.DataFrame.sparse.from_spmatrix(matrix, columns=range(matrix.shape[1]))
+    frequent_itemsets = fpgrowth(df, min_support=min_support, use_colnames=True)
+    if frequent_itemsets.empty:
+        return [], 0
+    rules = association_rules(frequent_itemsets, metric="lift", min_threshold=min_lift)
+    rules = rules[rules['confidence'] >= min_confidence]
+    if rules.empty:
+        return [], len(frequent_itemsets)
+    rules = rules.replace([float('inf'), float('-inf')], 999.99)
+
+    def names(columns):
+        return sorted(item_names[kept[column]] for column in columns)
+
+    results = []
+    for antecedents, consequents, support, confidence, lift in zip(
+            rules['antecedents'], rules['consequents'], rules['support'], rules['confidence'], rules['lift']):
+        results.append({
+            'antecedents': names(antecedents),
+            'consequents': names(consequents),
+            'support': float(support),
+            'confidence': float(confidence),
+            'lift': float(lift)
+        })
+    return results, len(frequent_itemsets)
+
+
+def build_recommendation_index(rules, depth=RECOMMENDATION_INDEX_DEPTH):
+    """
+    Map every antecedent item to its consequents ranked by (lift, confidence),
+    keeping the best-scoring rule per consequent, so a recommendation is a dict hit.
+    """
+    best = {}   # antecedent item -> {consequent: (lift, confidence)}
+    for rule in rules:
+        score = (rule['lift'], rule['confidence'])
+        for antecedent in rule['antecedents']:
+            per_item = best.setdefault(antecedent, {})
+            for consequent in rule['consequents']:
+                current = per_item.get(consequent)
+                if current is None or score > current:
+                    per_item[consequent] = score
+    index = {}
+    for antecedent, per_item in best.items():
+        ranked = sorted(per_item.items(), key=lambda entry: entry[1], reverse=True)[:depth]
+        index[antecedent] = [
+            {"item": consequent, "confidence": confidence, "lift": lift}
+            for consequent, (lift, confidence) in ranked
+        ]
+    return index
+
+
+class RuleModel:
+    """An immutable set of mined rules plus the thresholds and data watermark they were mined at."""
+
+    def __init__(self, rules, itemset_count, watermark, invoice_count, mine_seconds,
+                 min_support=MIN_SUPPORT, min_confidence=MIN_CONFIDENCE, min_lift=MIN_LIFT):
+        self.rules = rules
+        self.itemset_count = itemset_count
+        self.watermark = watermark
+        self.invoice_count = invoice_count
+        self.mine_seconds = mine_seconds
+        self.min_support = min_support
+        self.min_confidence = min_confidence
+        self.min_lift = min_lift
+        self.mined_at = datetime.now()
+        # Pre-sorted (descending) views so requests never sort the full rule list.
+        self.sorted_rules = {
+            key: sorted(rules, key=lambda rule, key=key: rule[key], reverse=True)
+            for key in SORT_KEYS
+        }
+        self.recommendation_index = build_recommendation_index(rules)
+        # Exact-antecedent lookup for cart recommendations.
+        self.rules_by_antecedent = {}
+        for rule in rules:
+            self.rules_by_antecedent.setdefault(frozenset(rule['antecedents']), []).append(
+                (rule['consequents'], rule['confidence'], rule['lift'])
+            )
+        self.antecedent_items = set(itertools.chain.from_iterable(self.rules_by_antecedent))
+        self.max_antecedent_len = max((len(key) for key in self.rules_by_antecedent), default=0)
+
+    def recommend(self, item, limit=5):
+        """Top ``limit`` consequents for rules whose antecedents contain ``item``."""
+        return self.recommendation_index.get(item, [])[:limit]
+
+    def covers(self, min_support=None, min_confidence=None, min_lift=None):
+        """True if these thresholds are at least as strict as the ones this model was mined with."""
+        return ((min_support is None or min_support >= self.min_support)
+                and (min_confidence is None or min_confidence >= self.min_confidence)
+                and (min_lift is None or min_lift >= self.min_lift))
+
+    def recommend_for_cart(self, cart, k=5):
+        """
+        Combine every rule whose whole antecedent set is in ``cart`` (item names).
+        A consequent's score is the noisy-OR of the confidences of the rules that
+        predict it, so agreeing rules reinforce each other; items already in the
+        cart are never suggested.
+        """
+        cart = set(cart)
+        relevant = sorted(cart & self.antecedent_items)
+        scores = {}   # consequent -> [miss probability, best confidence, best lift, rule count]
+        probes = 0
+        for size in range(1, min(self.max_antecedent_len, len(relevant)) + 1):
+            for antecedent in itertools.combinations(relevant, size):
+                probes += 1
+                if probes > MAX_CART_COMBINATIONS:
+                    break
+                for consequents, confidence, lift in self.rules_by_antecedent.get(frozenset(antecedent), ()):
+                    for consequent in consequents:
+                        if consequent in cart:
+                            continue
+                        entry = scores.get(consequent)
+                        if entry is None:
+                            scores[consequent] = [1.0 - confidence, confidence, lift, 1]
+                        else:
+                            entry[0] *= 1.0 - confidence
+                            entry[1] = max(entry[1], confidence)
+                            entry[2] = max(entry[2], lift)
+                            entry[3] += 1
+            if probes > MAX_CART_COMBINATIONS:
+                break
+        ranked = sorted(scores.items(), key=lambda entry: (1.0 - entry[1][0], entry[1][2]), reverse=True)[:k]
+        return [
+            {
+                "item": item,
+                "score": round(1.0 - miss, 6),
+                "confidence": confidence,
+                "lift": lift,
+                "supporting_rules": count
+            }
+            for item, (miss, confidence, lift, count) in ranked
+        ]
+
+    def query(self, sort_by='lift', descending=True, min_support=None, min_confidence=None,
+              min_lift=None, item=None, offset=0, limit=20):
+        """Filter, sort and page the rules. Returns (total_matches, page)."""
+        ordered = self.sorted_rules[sort_by]
+        if not descending:
+            ordered = reversed(ordered)
+        matches = [
+            rule for rule in ordered
+            if (min_support is None or rule['support'] >= min_support)
+            and (min_confidence is None or rule['confidence'] >= min_confidence)
+            and (min_lift is None or rule['lift'] >= min_lift)
+            and (item is None or item in rule['antecedents'] or item in rule['consequents'])
+        ]
+        return len(matches), matches[offset:offset + limit]
+
+    def info(self):
+        return {
+            "watermark": self.watermark,
+            "invoice_count": self.invoice_count,
+            "itemset_count": self.itemset_count,
+            "rules_count": len(self.rules),
+            "indexed_items": len(self.recommendation_index),
+            "min_support": self.min_support,
+            "min_confidence": self.min_confidence,
+            "min_lift": self.min_lift,
+            "mined_at": self.mined_at.isoformat(),
+            "mine_seconds": round(self.mine_seconds, 3),
+        }
+
+
+class BasketRuleService:
+    """Owns the cached baskets and the current RuleModel, and refreshes them in the background."""
+
+    def __init__(self, refresh_threshold=50, check_interval=60.0, min_support=MIN_SUPPORT,
+                 min_confidence=MIN_CONFIDENCE, min_lift=MIN_LIFT, max_bytes=MAX_MINING_BYTES,
+                 rescan_window=500):
+        self.refresh_threshold = refresh_threshold
+        self.rescan_window = rescan_window
+        self.check_interval = check_interval
+        self.min_support = min_support
+        self.min_confidence = min_confidence
+        self.min_lift = min_lift
+        self.max_bytes = max_bytes
+        self._codebook = ItemCodebook()
+        self._baskets = {}                   # Invoice_Number -> set of item codes
+        self._names_by_item_num = {}         # item_key(ItemNum) -> latest DiffItemName
+        self._watermark = 0
+        self._model = None
+        self._custom_models = OrderedDict()  # (support, confidence, lift) -> RuleModel
+        self._lock = threading.Lock()        # guards _model / _refreshing
+        self._mine_lock = threading.Lock()   # one load + mine at a time (bounds peak memory)
+        self._refreshing = False
+        self._last_check = None
+        self.pending_invoices = 0
+        self.last_error = None
+
+    def model(self, get_connection):
+        """Return the current model, mining synchronously only if none exists yet."""
+        model = self._model
+        if model is None:
+            return self._mine(get_connection)
+        self._schedule_check(get_connection)
+        return model
+
+    def model_for(self, get_connection, min_support=None, min_confidence=None, min_lift=None):
+        """
+        Return a model that can answer these thresholds: the shared model when
+        they are at least as strict as its own, else a one-off mine with the
+        looser thresholds (cached per watermark, refused above the memory ceiling).
+        """
+        model = self.model(get_connection)
+        if model.covers(min_support, min_confidence, min_lift):
+            return model
+        key = (
+            self.min_support if min_support is None else min_support,
+            self.min_confidence if min_confidence is None else min_confidence,
+            self.min_lift if min_lift is None else min_lift,
+        )
+        with self._mine_lock:
+            custom = self._custom_models.get(key)
+            if custom is not None and custom.watermark == self._watermark:
+                self._custom_models.move_to_end(key)
+                return custom
+            started = time.monotonic()
+            rules, itemset_count = mine_rules(self._baskets, self._codebook.names, *key, max_bytes=self.max_bytes)
+            custom = RuleModel(rules, itemset_count, self._watermark, len(self._baskets),
+                               time.monotonic() - started, *key)
+            self._custom_models[key] = custom
+            while len(self._custom_models) > CUSTOM_MODEL_CACHE_SIZE:
+                self._custom_models.popitem(last=False)
+            return custom
+
+    def resolve_items(self, entries):
+        """
+        Map cart entries (item names or ItemNums) to the item names rules are mined on.
+        Returns (names, unmatched entries).
+        """
+        names = []
+        unmatched = []
+        for entry in entries:
+            entry = str(entry)
+            if entry in self._codebook.codes:
+                names.append(entry)
+                continue
+            name = self._names_by_item_num.get(item_key(entry))
+            if name is None:
+                unmatched.append(entry)
+            else:
+                names.append(name)
+        return names, unmatched
+
+    def refresh_async(self, get_connection):
+        """Start a background re-mine; returns False if one is already running."""
+        with self._lock:
+            if self._refreshing:
+                return False
+            self._refreshing = True
+
+        def run():
+            try:
+                self._mine(get_connection)
+                self.last_error = None
+            except Exception as e:
+                print(f"Background basket rule refresh failed: {e}")
+                self.last_error = str(e)
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=run, name="basket-rules-refresh", daemon=True).start()
+        return True
+
+    def status(self):
+        model = self._model
+        return {
+            "model": model.info() if model else None,
+            "refreshing": self._refreshing,
+            "pending_invoices": self.pending_invoices,
+            "refresh_threshold": self.refresh_threshold,
+            "distinct_items": len(self._codebook.names),
+            "memory_ceiling_mb": self.max_bytes // (1024 * 1024),
+            "last_error": self.last_error,
+        }
+
+    # --------------------------------------------------------------------------
+    # Internals
+    # --------------------------------------------------------------------------
+    def _schedule_check(self, get_connection):
+        """Run the new-invoice check off the request thread once per ``check_interval``."""
+        now = time.monotonic()
+        with self._lock:
+            if self._refreshing or (self._last_check is not None and now - self._last_check < self.check_interval):
+                return
+            self._last_check = now
+        threading.Thread(target=self._check_for_new_invoices, args=(get_connection,),
+                         name="basket-rules-check", daemon=True).start()
+
+    def _check_for_new_invoices(self, get_connection):
+        try:
+            self._maybe_refresh(get_connection)
+        except Exception as e:
+            print(f"Basket rule staleness check failed: {e}")
+
+    def _maybe_refresh(self, get_connection):
+        conn = get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT COUNT(DISTINCT Invoice_Number) FROM invoice_itemized WHERE Invoice_Number > ?",
+                (self._watermark,)
+            )
+            self.pending_invoices = cursor.fetchone()[0]
+        finally:
+            conn.close()
+        if self.pending_invoices >= self.refresh_threshold:
+            self.refresh_async(get_connection)
+
+    def _load_new_lines(self, get_connection):
+        """
+        Extend the cached baskets with invoice lines above the watermark, and
+        rebuild the baskets of the last ``rescan_window`` invoice numbers below
+        it (baskets are sets, so re-read lines are not counted twice).
+        """
+        conn = get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT ISNULL(MAX(Invoice_Number), 0) FROM invoice_itemized")
+            upper = cursor.fetchone()[0]
+            lower = max(0, self._watermark - self.rescan_window)
+            cursor.execute(
+                "SELECT invoice_number, diffitemname, ItemNum FROM invoice_itemized "
+                "WHERE Invoice_Number > ? AND Invoice_Number <= ?",
+                (lower, upper)
+            )
+            encode = self._codebook.encode
+            names_by_item_num = self._names_by_item_num
+            rescanned = {}
+            while True:
+                rows = cursor.fetchmany(FETCH_BATCH_SIZE)
+                if not rows:
+                    break
+                for row in rows:
+                    name = str(row[1])
+                    rescanned.setdefault(str(row[0]), set()).add(encode(name))
+                    if row[2] is not None:
+                        names_by_item_num[item_key(row[2])] = name
+        finally:
+            conn.close()
+        changed = False
+        for number in range(lower + 1, self._watermark + 1):
+            invoice = str(number)
+            if self._baskets.get(invoice) != rescanned.get(invoice):
+                changed = True
+                if invoice in rescanned:
+                    self._baskets[invoice] = rescanned[invoice]
+                else:
+                    self._baskets.pop(invoice, None)   # voided since it was loaded
+        for invoice, codes in rescanned.items():
+            self._baskets.setdefault(invoice, codes)
+        if changed:
+            # Custom models are cached per watermark; the baskets under it just changed.
+            self._custom_models.clear()
+        self._watermark = max(self._watermark, upper)
+
+    def _mine(self, get_connection):
+        with self._mine_lock:
+            # Another thread may have finished the first mine while we waited.
+            if self._model is not None and not self._refreshing:
+                return self._model
+            started = time.monotonic()
+            self._load_new_lines(get_connection)
+            rules, itemset_count = mine_rules(self._baskets, self._codebook.names, self.min_support,
+                                              self.min_confidence, self.min_lift, self.max_bytes)
+            model = RuleModel(rules, itemset_count, self._watermark, len(self._baskets),
+                              time.monotonic() - started, self.min_support, self.min_confidence, self.min_lift)
+            with self._lock:
+                self._model = model
+            self.pending_invoices = 0
+            print(f"Mined {len(rules)} basket rules from {len(self._baskets)} invoices "
+                  f"in {model.mine_seconds:.2f}s (watermark {self._watermark})")
+            return model
@@ -0,0 +1,286 @@
+"""
+Bounded, health-checked pool of pyodbc connections.
+
+Routes check a connection out with ConnectionPool.connection() and give it
+back with close() (or by leaving a ``with`` block). Idle connections are
+pinged before reuse, evicted after sitting idle too long, and a background
+reaper reports connections that are held past the leak deadline together
+with the route that owns them.
+"""
+import collections
+import threading
+import time
+
+
+class PoolExhaustedError(Exception):
+    """Raised when no connection becomes free within the checkout timeout."""
+
+
+class PooledConnection:
+    """Wrapper around a raw pyodbc connection that returns it to its pool on close()."""
+
+    def __init__(self, pool, raw, owner):
+        self._pool = pool
+        self._raw = raw
+        self.owner = owner
+        self.checked_out_at = time.monotonic()
+        self.leak_reported = False
+        self._closed = False
+
+    def __getattr__(self, name):
+        # Everything else (cursor(), execute(), autocommit, ...) goes straight to pyodbc,
+        # but only while this wrapper still owns the connection.
+        if self.__dict__.get('_closed', True):
+            raise RuntimeError("Connection has already been returned to the pool.")
+        return getattr(self._raw, name)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def timeout(self):
+        """Query timeout in seconds for cursors created from now on (0 = none)."""
+        return self._raw.timeout
+
+    @timeout.setter
+    def timeout(self, seconds):
+        self._raw.timeout = seconds
+
+    def cursor(self):
+        if self._closed:
+            raise RuntimeError("Connection has already been returned to the pool.")
+        return self._raw.cursor()
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def close(self, discard=False):
+        """Return the connection to the pool; safe to call more than once."""
+        if self._closed:
+            return
+        self._closed = True
+        self._pool._checkin(self, discard=discard)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Same transaction semantics as pyodbc's own context manager, but the
+        # connection is handed back to the pool instead of being left open.
+        try:
+            if exc_type is None:
+                self._raw.commit()
+            else:
+                self._raw.rollback()
+        except Exception:
+            self.close(discard=True)
+            raise
+        self.close()
+        return False
+
+
+class ConnectionPool:
+    """Thread-safe pool of at most ``max_size`` connections created by ``connect``."""
+
+    def __init__(self, connect, max_size=10, checkout_timeout=15.0, max_idle=300.0,
+                 ping_interval=30.0, leak_timeout=60.0, reap_interval=10.0):
+        self._connect = connect
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.max_idle = max_idle
+        self.ping_interval = ping_interval
+        self.leak_timeout = leak_timeout
+        self.reap_interval = reap_interval
+
+        self._cond = threading.Condition()
+        self._idle = collections.deque()   # (raw connection, last returned at)
+        self._in_use = {}                  # id(wrapper) -> PooledConnection
+        self._size = 0                     # idle + in use + being created
+        self._reaper = None
+        self._counters = collections.Counter()
+        self._recent_leaks = collections.deque(maxlen=50)
+
+    # --------------------------------------------------------------------------
+    # Checkout / checkin
+    # --------------------------------------------------------------------------
+    def connection(self, owner=None):
+        """Check out a live connection, waiting up to ``checkout_timeout`` seconds."""
+        self._ensure_reaper()
+        deadline = time.monotonic() + self.checkout_timeout
+        raw = None
+        last_used = None
+        with self._cond:
+            while True:
+                if self._idle:
+                    # LIFO: the most recently used connection is the least likely to be stale.
+                    raw, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters['timeouts'] += 1
+                    raise PoolExhaustedError(
+                        f"No database connection available after {self.checkout_timeout}s "
+                        f"({len(self._in_use)} in use)."
+                    )
+                self._counters['waits'] += 1
+                self._cond.wait(remaining)
+
+        # The slot is reserved; validation and connecting happen outside the lock,
+        # and the counters they touch are applied under it afterwards.
+        events = collections.Counter()
+        try:
+            if raw is not None:
+                idle_for = time.monotonic() - last_used
+                if idle_for > self.max_idle:
+                    self._close_quietly(raw)
+                    events['evicted'] += 1
+                    raw = None
+                elif idle_for > self.ping_interval and not self._ping(raw):
+                    self._close_quietly(raw)
+                    events['ping_failures'] += 1
+                    raw = None
+            if raw is None:
+                raw = self._connect()
+                events['created'] += 1
+        except Exception:
+            with self._cond:
+                self._counters.update(events)
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        conn = PooledConnection(self, raw, owner)
+        with self._cond:
+            self._counters.update(events)
+            self._in_use[id(conn)] = conn
+            self._counters['checkouts'] += 1
+        return conn
+
+    def _checkin(self, conn, discard=False):
+        raw = conn._raw
+        if not discard:
+            try:
+                # Never hand an open transaction or a query timeout to the next borrower.
+                raw.rollback()
+                raw.timeout = 0
+            except Exception:
+                discard = True
+        if discard:
+            self._close_quietly(raw)
+        with self._cond:
+            self._in_use.pop(id(conn), None)
+            self._counters['checkins'] += 1
+            if discard:
+                self._size -= 1
+                self._counters['discarded'] += 1
+            else:
+                self._idle.append((raw, time.monotonic()))
+            self._cond.notify()
+
+    # --------------------------------------------------------------------------
+    # Health checks, eviction and leak detection
+    # --------------------------------------------------------------------------
+    @staticmethod
+    def _ping(raw):
+        try:
+            cursor = raw.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_quietly(raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def _ensure_reaper(self):
+        if self._reaper is not None:
+            return
+        with self._cond:
+            if self._reaper is None:
+                self._reaper = threading.Thread(target=self._reap_forever, name="db-pool-reaper", daemon=True)
+                self._reaper.start()
+
+    def _reap_forever(self):
+        while True:
+            time.sleep(self.reap_interval)
+            try:
+                self.reap()
+            except Exception as e:
+                print(f"Connection pool reaper error: {e}")
+
+    def reap(self):
+        """Evict connections idle past ``max_idle`` and report leaked checkouts."""
+        now = time.monotonic()
+        expired = []
+        leaked = []
+        with self._cond:
+            keep = collections.deque()
+            for raw, last_used in self._idle:
+                if now - last_used > self.max_idle:
+                    expired.append(raw)
+                else:
+                    keep.append((raw, last_used))
+            self._idle = keep
+            self._size -= len(expired)
+            self._counters['evicted'] += len(expired)
+            for conn in self._in_use.values():
+                held = now - conn.checked_out_at
+                if held > self.leak_timeout and not conn.leak_reported:
+                    conn.leak_reported = True
+                    leaked.append({"owner": conn.owner, "held_seconds": round(held, 1)})
+            self._counters['leaks'] += len(leaked)
+            self._recent_leaks.extend(leaked)
+            if expired:
+                self._cond.notify_all()
+        for raw in expired:
+            self._close_quietly(raw)
+        for leak in leaked:
+            print(f"Possible connection leak: held {leak['held_seconds']}s by {leak['owner']}")
+        return leaked
+
+    def stats(self):
+        """Snapshot of pool occupancy, lifetime counters and current holders."""
+        now = time.monotonic()
+        with self._cond:
+            return {
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": len(self._in_use),
+                "checkouts": self._counters['checkouts'],
+                "checkins": self._counters['checkins'],
+                "created": self._counters['created'],
+                "discarded": self._counters['discarded'],
+                "evicted": self._counters['evicted'],
+                "ping_failures": self._counters['ping_failures'],
+                "waits": self._counters['waits'],
+                "timeouts": self._counters['timeouts'],
+                "leaks_detected": self._counters['leaks'],
+                "held": [
+                    {"owner": conn.owner, "held_seconds": round(now - conn.checked_out_at, 1)}
+                    for conn in self._in_use.values()
+                ],
+                "recent_leaks": list(self._recent_leaks),
+            }
+
+    def close_all(self):
+        """Close every idle connection (used on shutdown)."""
+        with self._cond:
+            idle = [raw for raw, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+        for raw in idle:
+            self._close_quietly(raw)
@@ -0,0 +1,209 @@
+"""
+In-process mirror of a Firestore collection.
+
+A snapshot listener (collection.on_snapshot) delivers the whole collection
+once and then only the documents that change, so after the initial load the
+read endpoints can answer from memory without billing a read per document.
+Until the first snapshot arrives, or as soon as the listener stops (the
+Watch's is_active goes False), ready() is False and callers fall back to
+reading Firestore directly. A supervisor thread re-subscribes when the
+listener stops.
+
+Works the same against the Firestore emulator or any object that provides
+collection(name).on_snapshot(callback). ``python firestore_mirror.py`` runs
+self_check() against the in-module fake; to watch a real listener, start
+the emulator and point the client at it:
+
+    gcloud emulators firestore start --host-port=localhost:8080
+    FIRESTORE_EMULATOR_HOST=localhost:8080 GOOGLE_CLOUD_PROJECT=demo python app.py
+
+then write documents to Inventory and compare /api/firestore_mirror/stats.
+"""
+import threading
+import time
+from datetime import datetime, timezone
+
+
+class CollectionMirror:
+    def __init__(self, collection, check_interval=30.0):
+        self.collection = collection
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._documents = {}         # doc id -> field dict (replaced, never mutated)
+        self._ready = False
+        self._watch = None
+        self._thread = None
+        self.db = None
+        self.snapshots = 0
+        self.changes_applied = 0
+        self.subscriptions = 0
+        self.last_snapshot_at = None     # wall clock when the last snapshot was applied
+        self.last_read_time = None       # Firestore read_time of the last snapshot
+        self.last_delivery_lag = None    # seconds between read_time and applying the snapshot
+        self.last_error = None
+
+    def start(self, db):
+        """Subscribe and keep the subscription alive from a daemon thread."""
+        self.db = db
+        if self._thread is None:
+            self._subscribe()
+            self._thread = threading.Thread(target=self._supervise, name=f"mirror-{self.collection}", daemon=True)
+            self._thread.start()
+
+    def _subscribe(self):
+        if self._watch is not None:
+            try:
+                self._watch.unsubscribe()
+            except Exception:
+                pass
+        with self._lock:
+            self._watch = None       # so ready() doesn't judge the new snapshot by the old listener
+            self._ready = False
+            self.subscriptions += 1
+        try:
+            self._watch = self.db.collection(self.collection).on_snapshot(self._on_snapshot)
+        except Exception as e:
+            self._watch = None
+            self.last_error = str(e)
+            print(f"Could not listen to Firestore collection {self.collection}: {e}")
+
+    def _supervise(self):
+        while True:
+            time.sleep(self.check_interval)
+            if self._watch is None or not getattr(self._watch, 'is_active', True):
+                print(f"Firestore listener for {self.collection} stopped; subscribing again")
+                self._subscribe()
+
+    def _on_snapshot(self, documents, changes, read_time):
+        applied_at = datetime.now(timezone.utc)
+        with self._lock:
+            if not self._ready:
+                # The first snapshot after (re)subscribing is the full collection.
+                self._documents = {doc.id: doc.to_dict() for doc in documents}
+            else:
+                for change in changes:
+                    doc = change.document
+                    if change.type.name == 'REMOVED':
+                        self._documents.pop(doc.id, None)
+                    else:
+                        self._documents[doc.id] = doc.to_dict()
+            self._ready = True
+            self.snapshots += 1
+            self.changes_applied += len(changes)
+            self.last_snapshot_at = applied_at
+            self.last_read_time = read_time
+            if read_time is not None:
+                self.last_delivery_lag = max(0.0, (applied_at - read_time).total_seconds())
+
+    def ready(self):
+        with self._lock:
+            if self._ready and not getattr(self._watch, 'is_active', True):
+                # The listener died; its last snapshot is no longer kept current.
+                self._ready = False
+                self.last_error = f"listener for {self.collection} stopped"
+            return self._ready
+
+    def documents(self):
+        """[(doc id, field dict), ...] as of the last snapshot; the dicts must not be modified."""
+        with self._lock:
+            return list(self._documents.items())
+
+    def stats(self):
+        with self._lock:
+            now = datetime.now(timezone.utc)
+            if self._ready and not getattr(self._watch, 'is_active', True):
+                self._ready = False
+            return {
+                "collection": self.collection,
+                "ready": self._ready,
+                "documents": len(self._documents),
+                "snapshots": self.snapshots,
+                "changes_applied": self.changes_applied,
+                "subscriptions": self.subscriptions,
+                "last_snapshot_at": self.last_snapshot_at.isoformat() if self.last_snapshot_at else None,
+                "last_read_time": self.last_read_time.isoformat() if self.last_read_time else None,
+                "seconds_since_snapshot": (
+                    round((now - self.last_snapshot_at).total_seconds(), 3) if self.last_snapshot_at else None
+                ),
+                "delivery_lag_seconds": (
+                    round(self.last_delivery_lag, 3) if self.last_delivery_lag is not None else None
+                ),
+                "last_error": self.last_error,
+            }
+
+
+# ------------------------------------------------------------------------------
+# Local fake for self_check() (no Firestore needed)
+# ------------------------------------------------------------------------------
+class FakeDocument:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class FakeChange:
+    def __init__(self, kind, document):
+        self.type = type("ChangeType", (), {"name": kind})()
+        self.document = document
+
+
+class FakeWatch:
+    def __init__(self, callback):
+        self.callback = callback
+        self.is_active = True
+
+    def unsubscribe(self):
+        self.is_active = False
+
+
+class FakeFirestore:
+    """Enough of firestore.Client for CollectionMirror: one collection, snapshots pushed by hand."""
+
+    def __init__(self):
+        self.documents = {}
+        self.watches = []
+
+    def collection(self, name):
+        return self
+
+    def on_snapshot(self, callback):
+        watch = FakeWatch(callback)
+        self.watches.append(watch)
+        callback(self._documents(), [], datetime.now(timezone.utc))
+        return watch
+
+    def _documents(self):
+        return [FakeDocument(doc_id, data) for doc_id, data in self.documents.items()]
+
+    def set(self, doc_id, data):
+        kind = 'MODIFIED' if doc_id in self.documents else 'ADDED'
+        self.documents[doc_id] = data
+        for watch in self.watches:
+            if watch.is_active:
+                watch.callback(self._documents(), [FakeChange(kind, FakeDocument(doc_id, data))],
+                               datetime.now(timezone.utc))
+
+
+def self_check():
+    """Load, apply a change, lose the listener, re-subscribe; raises AssertionError on a mismatch."""
+    db = FakeFirestore()
+    db.documents = {"1": {"price": 1.0}}
+    mirror = CollectionMirror("Inventory", check_interval=3600)
+    mirror.db = db
+    mirror._subscribe()
+    assert mirror.ready() and dict(mirror.documents()) == {"1": {"price": 1.0}}
+    db.set("2", {"price": 2.0})
+    assert dict(mirror.documents()) == {"1": {"price": 1.0}, "2": {"price": 2.0}}
+    db.watches[-1].is_active = False          # the listener dies (network error, stream closed)
+    assert not mirror.ready(), "mirror still ready after its listener stopped"
+    db.documents["1"] = {"price": 9.0}        # changed while nobody listened
+    mirror._subscribe()                       # what the supervisor does on its next check
+    assert mirror.ready() and dict(mirror.documents())["1"] == {"price": 9.0}
+    return mirror.stats()
+
+
+if __name__ == '__main__':
+    print(self_check())
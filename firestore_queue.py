@@ -0,0 +1,320 @@
+"""
+Write-behind queue for Firestore document writes.
+
+Accepted writes are journaled to a local SQLite file before the request
+returns, so a restart or a Firestore outage loses nothing: the worker thread
+picks up whatever is still pending. The worker drains the journal in
+coalesced batches (only the newest pending write per document is sent, older
+ones are marked superseded) and commits them with Firestore batch writes.
+When Firestore rejects a batch for its content the documents are retried one
+by one, so a bad document only uses up its own attempts; any other failure
+is treated as an outage: the worker backs off exponentially (up to
+``max_backoff`` seconds) and no attempts are counted. requeue_failed() puts
+writes that did run out of attempts back to pending.
+Every enqueue belongs to a job whose progress is read back from the journal.
+``on_written({doc_id: data})`` is called after each committed batch.
+"""
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from firebase_admin.firestore import SERVER_TIMESTAMP
+from google.api_core import exceptions as api_exceptions
+
+from firestore_sync import FIRESTORE_BATCH_LIMIT
+
+PENDING = 'pending'
+WRITTEN = 'written'
+SUPERSEDED = 'superseded'
+FAILED = 'failed'
+
+# Errors caused by the document itself; anything else (Unavailable, DeadlineExceeded,
+# PermissionDenied, a dropped connection, ...) is treated as Firestore being down.
+DOCUMENT_ERRORS = (api_exceptions.InvalidArgument, api_exceptions.FailedPrecondition, ValueError, TypeError)
+
+
+def is_document_error(error):
+    return isinstance(error, DOCUMENT_ERRORS)
+
+
+class WriteBehindQueue:
+    def __init__(self, path, collection, batch_size=FIRESTORE_BATCH_LIMIT, flush_interval=0.5,
+                 max_attempts=5, retry_delay=2.0, max_backoff=60.0, stamp_field=None, on_written=None):
+        self.path = path
+        self.collection = collection
+        self.batch_size = min(batch_size, FIRESTORE_BATCH_LIMIT)
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay     # first outage back-off, doubled up to max_backoff
+        self.max_backoff = max_backoff
+        self.backoff = 0.0
+        self.stamp_field = stamp_field   # set to the Firestore server time on every write
+        self.on_written = on_written
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.db = None
+        self.batches_committed = 0
+        self.batches_failed = 0
+        self.last_error = None
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    collection TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    total INTEGER NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS writes (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id TEXT NOT NULL,
+                    doc_id TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    finished_at TEXT
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS writes_state ON writes (state, seq)")
+            conn.execute("CREATE INDEX IF NOT EXISTS writes_job ON writes (job_id, state)")
+            conn.execute("CREATE INDEX IF NOT EXISTS writes_doc ON writes (doc_id, state, seq)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def start(self, db):
+        """Start the flush worker; writes journaled before a restart are sent first."""
+        self.db = db
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="firestore-write-behind", daemon=True)
+            self._thread.start()
+
+    def enqueue(self, documents):
+        """Journal [(doc_id, data), ...] as one job and return its ID."""
+        job_id = uuid.uuid4().hex
+        created_at = datetime.now().isoformat()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, collection, created_at, total) VALUES (?, ?, ?, ?)",
+                (job_id, self.collection, created_at, len(documents))
+            )
+            conn.executemany(
+                "INSERT INTO writes (job_id, doc_id, data, state) VALUES (?, ?, ?, ?)",
+                [(job_id, str(doc_id), json.dumps(data), PENDING) for doc_id, data in documents]
+            )
+        self._wake.set()
+        return job_id
+
+    # --------------------------------------------------------------------------
+    # Worker
+    # --------------------------------------------------------------------------
+    def _run(self):
+        while True:
+            try:
+                flushed = self.flush()
+            except Exception as e:
+                print(f"Write-behind flush failed: {e}")
+                flushed = 0
+            if not flushed:
+                self._wake.wait(self.flush_interval)
+                self._wake.clear()
+
+    def _next_batch(self):
+        """
+        Newest pending write for up to ``batch_size`` documents (the oldest
+        waiting ones), plus the older pending seqs of those documents, which
+        the batch supersedes.
+        """
+        with self._lock, self._connect() as conn:
+            oldest = conn.execute(
+                "SELECT doc_id FROM writes WHERE state = ? ORDER BY seq LIMIT ?",
+                (PENDING, self.batch_size * 4)
+            ).fetchall()
+            latest = {}
+            superseded = []
+            for doc_id in list(dict.fromkeys(doc_id for doc_id, in oldest))[:self.batch_size]:
+                seq, data, attempts = conn.execute(
+                    "SELECT seq, data, attempts FROM writes WHERE doc_id = ? AND state = ? ORDER BY seq DESC LIMIT 1",
+                    (doc_id, PENDING)
+                ).fetchone()
+                latest[doc_id] = (seq, data, attempts)
+                superseded.extend(older for older, in conn.execute(
+                    "SELECT seq FROM writes WHERE doc_id = ? AND state = ? AND seq < ?", (doc_id, PENDING, seq)
+                ))
+        return latest, superseded
+
+    def _commit(self, writes):
+        collection = self.db.collection(self.collection)
+        batch = self.db.batch()
+        for doc_id, (_, data, _) in writes.items():
+            document = json.loads(data)
+            if self.stamp_field:
+                document[self.stamp_field] = SERVER_TIMESTAMP
+            batch.set(collection.document(doc_id), document)
+        batch.commit()
+
+    def flush(self):
+        """Send one coalesced batch; returns the number of journal entries it settled."""
+        if self.db is None:
+            return 0
+        latest, superseded = self._next_batch()
+        if not latest:
+            return 0
+        outage = None
+        try:
+            self._commit(latest)
+            written, failed = latest, {}
+        except Exception as e:
+            print(f"Write-behind batch of {len(latest)} documents failed: {e}")
+            if is_document_error(e):
+                written, failed, outage = self._commit_each(latest)
+            else:
+                written, failed, outage = {}, {}, e
+        finished_at = datetime.now().isoformat()
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                "UPDATE writes SET state = ?, finished_at = ? WHERE seq = ?",
+                [(WRITTEN, finished_at, seq) for seq, _, _ in written.values()]
+                + [(SUPERSEDED, finished_at, seq) for seq in superseded]
+            )
+            if written:
+                self.batches_committed += 1
+        if failed:
+            self._record_failure(failed)
+        if written and self.on_written:
+            try:
+                self.on_written({doc_id: json.loads(data) for doc_id, (_, data, _) in written.items()})
+            except Exception as e:
+                print(f"Write-behind on_written hook failed: {e}")
+        if outage is not None:
+            self._back_off(outage)
+        else:
+            self.backoff = 0.0
+        return len(written) + len(superseded)
+
+    def _commit_each(self, writes):
+        """
+        Retry a batch that Firestore rejected for its content one document at
+        a time, so a bad document (an invalid ID, an oversized field) only
+        fails itself. Returns (written, failed, outage): failed maps doc_id ->
+        (seq, attempts, error) for document errors; outage is the first other
+        error, which stops the retries and leaves the rest pending.
+        """
+        written = {}
+        failed = {}
+        for doc_id, entry in writes.items():
+            try:
+                self._commit({doc_id: entry})
+                written[doc_id] = entry
+            except Exception as e:
+                if not is_document_error(e):
+                    return written, failed, e
+                failed[doc_id] = (entry[0], entry[2], e)
+        return written, failed, None
+
+    def _record_failure(self, failed):
+        """Count an attempt against each document whose own content was rejected."""
+        finished_at = datetime.now().isoformat()
+        updates = []
+        for doc_id, (seq, attempts, error) in failed.items():
+            attempts += 1
+            state = FAILED if attempts >= self.max_attempts else PENDING
+            updates.append((state, attempts, str(error), finished_at if state == FAILED else None, seq))
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                "UPDATE writes SET state = ?, attempts = ?, error = ?, finished_at = ? WHERE seq = ?", updates
+            )
+            self.batches_failed += 1
+            self.last_error = updates[-1][2]
+
+    def _back_off(self, error):
+        """Firestore itself is failing: wait longer each time, without using up any document's attempts."""
+        self.backoff = min(self.max_backoff, self.backoff * 2 if self.backoff else self.retry_delay)
+        with self._lock:
+            self.batches_failed += 1
+            self.last_error = str(error)
+        print(f"Write-behind queue backing off {self.backoff:.0f}s: {error}")
+        time.sleep(self.backoff)
+
+    def requeue_failed(self, job_id=None):
+        """
+        Put FAILED writes (of one job, or all) back to pending with fresh
+        attempts and return how many. A write is skipped when a newer write
+        of the same document has been accepted since, so old data never
+        overwrites new.
+        """
+        query = """
+            UPDATE writes SET state = ?, attempts = 0, error = NULL, finished_at = NULL
+            WHERE state = ? AND NOT EXISTS (
+                SELECT 1 FROM writes newer
+                WHERE newer.doc_id = writes.doc_id AND newer.seq > writes.seq AND newer.state != ?
+            )
+        """
+        params = [PENDING, FAILED, FAILED]
+        if job_id is not None:
+            query += " AND job_id = ?"
+            params.append(job_id)
+        with self._lock, self._connect() as conn:
+            requeued = conn.execute(query, params).rowcount
+        if requeued:
+            self._wake.set()
+        return requeued
+
+    # --------------------------------------------------------------------------
+    # Progress
+    # --------------------------------------------------------------------------
+    def job(self, job_id):
+        """Progress of one job, or None if the ID is unknown."""
+        with self._lock, self._connect() as conn:
+            job = conn.execute("SELECT created_at, total FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            counts = dict(conn.execute(
+                "SELECT state, COUNT(*) FROM writes WHERE job_id = ? GROUP BY state", (job_id,)
+            ).fetchall())
+            last_finished = conn.execute(
+                "SELECT MAX(finished_at) FROM writes WHERE job_id = ?", (job_id,)
+            ).fetchone()[0]
+            errors = conn.execute(
+                "SELECT doc_id, error FROM writes WHERE job_id = ? AND state = ? ORDER BY seq LIMIT 20",
+                (job_id, FAILED)
+            ).fetchall()
+        created_at, total = job
+        done = counts.get(WRITTEN, 0) + counts.get(SUPERSEDED, 0)
+        pending = counts.get(PENDING, 0)
+        failed = counts.get(FAILED, 0)
+        return {
+            "job_id": job_id,
+            "status": "pending" if pending else ("failed" if failed else "done"),
+            "created_at": created_at,
+            "finished_at": None if pending else last_finished,
+            "total": total,
+            "written": done,
+            "pending": pending,
+            "failed": failed,
+            "progress": round(done / total, 4) if total else 1.0,
+            "errors": [{"doc_id": doc_id, "error": error} for doc_id, error in errors],
+        }
+
+    def stats(self):
+        with self._lock, self._connect() as conn:
+            counts = dict(conn.execute("SELECT state, COUNT(*) FROM writes GROUP BY state").fetchall())
+            jobs = conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+            return {
+                "jobs": jobs,
+                "pending": counts.get(PENDING, 0),
+                "written": counts.get(WRITTEN, 0),
+                "superseded": counts.get(SUPERSEDED, 0),
+                "failed": counts.get(FAILED, 0),
+                "batches_committed": self.batches_committed,
+                "batches_failed": self.batches_failed,
+                "backoff_seconds": self.backoff,
+                "last_error": self.last_error,
+                "running": self._thread is not None,
+            }
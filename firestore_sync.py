@@ -0,0 +1,258 @@
+"""
+Batched, concurrent Firestore writes and the fingerprint table behind delta sync.
+
+BatchWriter groups set() calls into Firestore write batches (at most 500
+writes each) and commits up to ``workers`` batches in parallel. At most
+``2 * workers`` batches are held in memory; write() blocks when that many are
+pending so a streaming producer never gets far ahead of Firestore. close()
+waits for every commit and returns a throughput and failure report.
+
+FingerprintStore is a local SQLite table of doc id -> hash of the fields last
+synced, so a sync only has to write documents whose hash changed. Each
+fingerprint also records who wrote the document: the sync (SYNC) or an item
+upload (UPLOAD). plan_sync() only deletes documents the sync owns, so an
+upload that SQL Server has not imported yet is left alone.
+"""
+import concurrent.futures
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+FIRESTORE_BATCH_LIMIT = 500   # Firestore's maximum number of writes per batch
+
+SYNC = 'sync'       # written by the SQL Server -> Firestore sync
+UPLOAD = 'upload'   # written by an item upload, possibly before SQL Server has the item
+
+
+class BatchWriter:
+    def __init__(self, db, collection, batch_size=FIRESTORE_BATCH_LIMIT, workers=4, retries=1, merge=False):
+        self.db = db
+        self.collection = collection
+        self.batch_size = min(batch_size, FIRESTORE_BATCH_LIMIT)
+        self.retries = retries
+        self.merge = merge
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='firestore-batch'
+        )
+        self._slots = threading.BoundedSemaphore(workers * 2)
+        self._lock = threading.Lock()
+        self._futures = []
+        self._pending = []          # (doc_id, data, delete) not yet handed to a batch
+        self._batch_number = 0
+        self.committed = []         # (doc_id, deleted) for every write in a committed batch
+        self.documents_written = 0
+        self.documents_deleted = 0
+        self.failed_batches = []
+        self.started = time.monotonic()
+
+    def set(self, doc_id, data):
+        self._pending.append((str(doc_id), data, False))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def delete(self, doc_id):
+        self._pending.append((str(doc_id), None, True))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Hand the pending writes to a worker as one batch."""
+        if not self._pending:
+            return
+        writes, self._pending = self._pending, []
+        self._batch_number += 1
+        self._slots.acquire()   # back-pressure: wait for a free slot
+        future = self._executor.submit(self._commit, self._batch_number, writes)
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+
+    def _commit(self, number, writes):
+        collection = self.db.collection(self.collection)
+        for attempt in range(self.retries + 1):
+            try:
+                batch = self.db.batch()
+                for doc_id, data, delete in writes:
+                    if delete:
+                        batch.delete(collection.document(doc_id))
+                    else:
+                        batch.set(collection.document(doc_id), data, merge=self.merge)
+                batch.commit()
+                with self._lock:
+                    self.committed.extend((doc_id, delete) for doc_id, _, delete in writes)
+                    deleted = sum(1 for write in writes if write[2])
+                    self.documents_deleted += deleted
+                    self.documents_written += len(writes) - deleted
+                return
+            except Exception as e:
+                error = e
+                if attempt < self.retries:
+                    time.sleep(0.5 * (attempt + 1))
+        print(f"Firestore batch {number} failed: {error}")
+        with self._lock:
+            self.failed_batches.append({
+                "batch": number,
+                "documents": len(writes),
+                "first_doc": writes[0][0],
+                "last_doc": writes[-1][0],
+                "error": str(error),
+            })
+
+    def close(self):
+        """Commit what is left, wait for every batch and return the report."""
+        self.flush()
+        concurrent.futures.wait(self._futures)
+        self._executor.shutdown(wait=True)
+        return self.report()
+
+    def report(self):
+        elapsed = time.monotonic() - self.started
+        with self._lock:
+            written = self.documents_written
+            return {
+                "documents_written": written,
+                "documents_deleted": self.documents_deleted,
+                "batches": self._batch_number,
+                "failed_batches": list(self.failed_batches),
+                "documents_failed": sum(batch["documents"] for batch in self.failed_batches),
+                "seconds": round(elapsed, 3),
+                "documents_per_second": round(written / elapsed, 1) if elapsed else None,
+            }
+
+
+def fingerprint(document):
+    """Stable hash of a document's fields."""
+    return hashlib.sha1(json.dumps(document, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class FingerprintStore:
+    """SQLite table: doc_id -> (fingerprint, synced_at) for one Firestore collection."""
+
+    def __init__(self, path, collection):
+        self.path = path
+        self.collection = collection
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS fingerprints (
+                    collection TEXT NOT NULL,
+                    doc_id TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    synced_at TEXT NOT NULL,
+                    source TEXT NOT NULL DEFAULT 'sync',
+                    PRIMARY KEY (collection, doc_id)
+                )
+            """)
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(fingerprints)")]
+            if 'source' not in columns:
+                # Tables created before uploads were fingerprinted only hold sync writes.
+                conn.execute("ALTER TABLE fingerprints ADD COLUMN source TEXT NOT NULL DEFAULT 'sync'")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def load(self):
+        """doc_id -> (fingerprint, source) for everything written so far."""
+        with self._lock, self._connect() as conn:
+            rows = conn.execute(
+                "SELECT doc_id, fingerprint, source FROM fingerprints WHERE collection = ?", (self.collection,)
+            )
+            return {doc_id: (value, source) for doc_id, value, source in rows}
+
+    def record(self, synced, deleted, source=SYNC):
+        """Store new fingerprints for ``synced`` {doc_id: fingerprint} and drop ``deleted`` doc ids."""
+        synced_at = datetime.now().isoformat()
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO fingerprints (collection, doc_id, fingerprint, synced_at, source) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(self.collection, doc_id, value, synced_at, source) for doc_id, value in synced.items()]
+            )
+            conn.executemany(
+                "DELETE FROM fingerprints WHERE collection = ? AND doc_id = ?",
+                [(self.collection, doc_id) for doc_id in deleted]
+            )
+
+    def clear(self):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM fingerprints WHERE collection = ?", (self.collection,))
+
+    def stats(self):
+        with self._lock, self._connect() as conn:
+            count, last_synced = conn.execute(
+                "SELECT COUNT(*), MAX(synced_at) FROM fingerprints WHERE collection = ?", (self.collection,)
+            ).fetchone()
+            uploads = conn.execute(
+                "SELECT COUNT(*) FROM fingerprints WHERE collection = ? AND source = ?", (self.collection, UPLOAD)
+            ).fetchone()[0]
+        return {"documents": count, "uploads_not_synced": uploads, "last_synced_at": last_synced}
+
+
+def plan_sync(documents, synced):
+    """
+    Compare SQL Server's (doc_id, document) pairs with ``synced`` (from
+    FingerprintStore.load(), consumed) and yield (kind, doc_id, document,
+    fingerprint). kind is 'inserted', 'changed', 'unchanged', 'claimed' (an
+    upload SQL Server now holds unchanged; record it as SYNC) or 'deleted'
+    (document and fingerprint are None). Only SYNC documents are deleted:
+    an upload missing from SQL Server is waiting to be imported.
+    """
+    for doc_id, document in documents:
+        value = fingerprint(document)
+        previous = synced.pop(doc_id, None)
+        if previous is None:
+            kind = 'inserted'
+        elif previous[0] != value:
+            kind = 'changed'
+        elif previous[1] != SYNC:
+            kind = 'claimed'
+        else:
+            kind = 'unchanged'
+        yield kind, doc_id, document, value
+    for doc_id, (_, source) in synced.items():
+        if source == SYNC:
+            yield 'deleted', doc_id, None, None
+
+
+def self_check():
+    """Upload -> sync -> import -> sync -> delete in SQL Server -> sync, against a throwaway FingerprintStore."""
+    import os
+    import tempfile
+
+    def sync(store, sql_documents):
+        kinds = {}
+        written, claimed, deleted = {}, {}, []
+        for kind, doc_id, document, value in plan_sync(sql_documents, store.load()):
+            kinds[doc_id] = kind
+            if kind in ('inserted', 'changed'):
+                written[doc_id] = value
+            elif kind == 'claimed':
+                claimed[doc_id] = value
+            elif kind == 'deleted':
+                deleted.append(doc_id)
+        store.record({**written, **claimed}, deleted)
+        return kinds
+
+    handle, path = tempfile.mkstemp(suffix='.sqlite3')
+    os.close(handle)
+    try:
+        store = FingerprintStore(path, "Inventory")
+        sql = {"A": {"itemNum": "A", "price": 1.0}}
+        assert sync(store, sql.items()) == {"A": "inserted"}
+        uploaded = {"itemNum": "B", "price": 2.0}
+        store.record({"B": fingerprint(uploaded)}, [], source=UPLOAD)
+        assert sync(store, sql.items()) == {"A": "unchanged"}, "sync deleted an upload SQL Server has not imported"
+        sql["B"] = dict(uploaded)                   # /api/fetch_and_add_items imports it
+        assert sync(store, sql.items()) == {"A": "unchanged", "B": "claimed"}
+        del sql["B"]                                # removed from SQL Server: now the sync may delete it
+        assert sync(store, sql.items()) == {"A": "unchanged", "B": "deleted"}
+        assert store.load() == {"A": (fingerprint(sql["A"]), SYNC)}
+        return store.stats()
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    print(self_check())
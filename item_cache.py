@@ -0,0 +1,124 @@
+"""
+In-process LRU cache of Inventory rows keyed by ItemNum.
+
+Item lookups while scanning hit the same rows over and over; this keeps
+each row (as a column -> value dict) for ``ttl`` seconds and also remembers
+item numbers that do not exist for ``negative_ttl`` seconds, so repeated
+scans of an unknown UPC don't reach SQL Server either. The item write routes
+clear it, and the TTL bounds staleness from edits made at the register.
+Rows loaded across an invalidation are returned but not stored.
+"""
+import collections
+import threading
+import time
+
+from sales_aggregates import item_key
+
+NOT_FOUND = object()
+
+
+class ItemCache:
+    def __init__(self, max_entries=10000, ttl=300.0, negative_ttl=30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = collections.OrderedDict()   # item_key -> (expires at, row dict or NOT_FOUND)
+        self._lock = threading.Lock()
+        self._counters = collections.Counter()
+        self.generation = 0                          # bumped by invalidate()
+        self.last_invalidated_by = None
+
+    def _cached(self, key):
+        # Caller holds self._lock. Returns the entry value, or None on a miss.
+        entry = self._entries.get(key)
+        if entry is None:
+            self._counters['misses'] += 1
+            return None
+        if entry[0] <= time.monotonic():
+            del self._entries[key]
+            self._counters['expired'] += 1
+            self._counters['misses'] += 1
+            return None
+        self._entries.move_to_end(key)
+        self._counters['negative_hits' if entry[1] is NOT_FOUND else 'hits'] += 1
+        return entry[1]
+
+    def _store(self, key, value):
+        # Caller holds self._lock.
+        ttl = self.negative_ttl if value is NOT_FOUND else self.ttl
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counters['evicted'] += 1
+
+    def get(self, item_num, load):
+        """Row dict for ``item_num`` or None; ``load(item_num)`` runs only on a miss."""
+        key = item_key(item_num)
+        with self._lock:
+            value = self._cached(key)
+            generation = self.generation
+        if value is None:
+            row = load(item_num)
+            value = NOT_FOUND if row is None else row
+            with self._lock:
+                if generation == self.generation:
+                    self._store(key, value)
+                else:
+                    self._counters['discarded'] += 1
+        return None if value is NOT_FOUND else value
+
+    def get_many(self, item_nums, load_many):
+        """
+        item_key -> row dict for every item that exists. ``load_many(misses)``
+        gets the uncached item numbers and returns item_key -> row dict.
+        """
+        found = {}
+        misses = []
+        with self._lock:
+            generation = self.generation
+            for item_num in dict.fromkeys(item_nums):
+                key = item_key(item_num)
+                value = self._cached(key)
+                if value is None:
+                    misses.append(item_num)
+                elif value is not NOT_FOUND:
+                    found[key] = value
+        if misses:
+            loaded = load_many(misses)
+            with self._lock:
+                current = generation == self.generation
+                if not current:
+                    self._counters['discarded'] += len(misses)
+                for item_num in misses:
+                    key = item_key(item_num)
+                    row = loaded.get(key)
+                    if current:
+                        self._store(key, NOT_FOUND if row is None else row)
+                    if row is not None:
+                        found[key] = row
+        return found
+
+    def invalidate(self, reason=None):
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+            self._counters['invalidations'] += 1
+            self.last_invalidated_by = reason
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "negative_ttl": self.negative_ttl,
+                "hits": self._counters['hits'],
+                "negative_hits": self._counters['negative_hits'],
+                "misses": self._counters['misses'],
+                "expired": self._counters['expired'],
+                "evicted": self._counters['evicted'],
+                "discarded": self._counters['discarded'],
+                "invalidations": self._counters['invalidations'],
+                "last_invalidated_by": self.last_invalidated_by,
+            }
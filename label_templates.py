@@ -0,0 +1,283 @@
+"""
+Label template registry.
+
+Each design is written once as annotated ZPL with {placeholders} and compiled
+at import time: ``;`` annotations and indentation are stripped (the printer
+would otherwise receive them), every ^FD that carries data gets ^FH so values
+can be hex-escaped, and the result is kept as a single format string so
+rendering a label is one dict build and one str.format_map call.
+
+Designs that also define a stored layout (^FN slots) can be downloaded to a
+printer once with ^DF and printed afterwards with ^XF recalls.
+
+Run ``python label_templates.py`` for a rendering micro-benchmark.
+"""
+import re
+import string
+import time
+
+from stored_formats import format_version
+
+COMMENT = re.compile(r"\s+;.*$")
+DATA_FIELD = re.compile(r"\^FD(?=[^^]*\{)")   # ^FD whose data contains a placeholder
+
+# ^FH hex escapes: '_' is the escape character itself, '^' and '~' would start a command.
+FIELD_ESCAPES = str.maketrans({
+    "_": "_5F",
+    "^": "_5E",
+    "~": "_7E",
+    "\r": " ",
+    "\n": " ",
+})
+
+
+def escape_field(value):
+    """Make a value safe inside ^FH^FD...^FS."""
+    return str(value).translate(FIELD_ESCAPES)
+
+
+def compile_zpl(source):
+    """Strip annotations and blank lines, and add ^FH before data-bearing ^FD commands."""
+    lines = []
+    for line in source.splitlines():
+        line = COMMENT.sub("", line).strip()
+        if line:
+            lines.append(line)
+    return DATA_FIELD.sub("^FH^FD", "\n".join(lines))
+
+
+def label_values(item_num, item_name, price):
+    """Every value a design may reference, escaped once for all designs."""
+    cash_price = float(price)
+    return {
+        "item_num": escape_field(item_num),
+        "item_name": escape_field(item_name),
+        "raw_price": escape_field(price),
+        "price": cash_price,
+        "cash_price": cash_price,
+        "card_price": round(cash_price * 1.05, 2),
+    }
+
+
+class LabelTemplate:
+    """One design, compiled into format strings for inline and stored-format printing."""
+
+    def __init__(self, name, source, stored_layout=None, stored_fields=None):
+        self.name = name
+        compiled = compile_zpl(source)
+        head, tail = compiled.rsplit("^XZ", 1)
+        # ^PQ (copies) must come right before the closing ^XZ.
+        self._inline = f"{head}{{quantity}}^XZ{tail}\n"
+        self.fields = sorted({field for _, field, _, _ in string.Formatter().parse(compiled) if field})
+        self.stored_layout = compile_zpl(stored_layout) if stored_layout else None
+        self.stored_version = format_version(self.stored_layout) if self.stored_layout else None
+        self._recall_fields = "".join(
+            f"^FN{number}^FH^FD{value}^FS" for number, value in sorted((stored_fields or {}).items())
+        )
+
+    @property
+    def has_stored_format(self):
+        return self.stored_layout is not None
+
+    def render(self, values, copies=1):
+        """Full inline ZPL for one label."""
+        return self._inline.format_map({**values, "quantity": f"^PQ{copies}" if copies > 1 else ""})
+
+    def download(self, format_name):
+        """^DF document that saves the stored layout on the printer as ``format_name``."""
+        return f"^XA^DF{format_name}^FS\n{self.stored_layout}\n^XZ\n"
+
+    def recall(self, format_name, values, copies=1):
+        """^XF document that prints one label from the stored layout."""
+        quantity = f"^PQ{copies}" if copies > 1 else ""
+        return f"^XA^XF{format_name}^FS{self._recall_fields.format_map(values)}{quantity}^XZ\n"
+
+
+class TemplateRegistry:
+    def __init__(self):
+        self._templates = {}
+
+    def register(self, name, source, stored_layout=None, stored_fields=None):
+        self._templates[name] = LabelTemplate(name, source, stored_layout, stored_fields)
+
+    def __contains__(self, name):
+        return name in self._templates
+
+    def get(self, name):
+        return self._templates[name]
+
+    def names(self):
+        return sorted(self._templates)
+
+    def stored_format_names(self):
+        return sorted(name for name, template in self._templates.items() if template.has_stored_format)
+
+    def render(self, name, item_num, item_name, price, copies=1):
+        """The single entry point the print routes use for inline labels."""
+        return self._templates[name].render(label_values(item_num, item_name, price), copies)
+
+    def recall(self, name, format_name, item_num, item_name, price, copies=1):
+        """^XF recall of ``name``'s stored layout, saved on the printer as ``format_name``."""
+        return self._templates[name].recall(format_name, label_values(item_num, item_name, price), copies)
+
+
+templates = TemplateRegistry()
+
+# ------------------------------------------------------------------------------
+# Designs
+# ------------------------------------------------------------------------------
+templates.register('label', """
+^XA
+^FO10,20^A0N,50,50^FD Product Name: {item_name} ^FS
+^FO10,100^A0N,40,40^FD Barcode: ^FS
+^BY3,3,100^FO10,150^BCN,100,Y,N,N^FD {item_num} ^FS
+^FO10,200^A0N,50,50^FD Price: {raw_price} ^FS
+^XZ
+""")
+
+# Design 1: Uses cash_price and card_price
+templates.register('design1', """
+^XA
+^PW457           ; Set label width (approx 2.25 inches at 203 dpi)
+^LL254           ; Set label length (approx 1.25 inches at 203 dpi)
+
+^CF0,30         ; Increase product name font to 30 dots tall
+^FO10,15^FD{item_name}^FS
+
+^FO10,45
+^BY2,2,40       ; Adjust barcode module width, ratio and height
+^BCN,40,Y,N,N^FD{item_num}^FS
+
+^CF0,35         ; Increase price details font to 35 dots tall
+^FO10,150^FDCash: ${cash_price}^FS
+^FO240,150^FDCredit: ${card_price}^FS
+^XZ
+""", stored_layout="""
+^PW457
+^LL254
+^CF0,30
+^FO10,15^FN1^FS
+^FO10,45
+^BY2,2,40
+^BCN,40,Y,N,N^FN2^FS
+^CF0,35
+^FO10,150^FN3^FS
+^FO240,150^FN4^FS
+""", stored_fields={1: "{item_name}", 2: "{item_num}", 3: "Cash: ${cash_price}", 4: "Credit: ${card_price}"})
+
+# Design 2: Uses a single price field
+templates.register('design2', """
+^XA
+^CF0,30            ; Increased font for product name to 30-dots height
+^FO10,15^FD{item_name}^FS
+
+^CF0,16            ; Slightly smaller font for the "Barcode:" label
+^FO10,35^FD ^FS
+
+^BY2,2,50         ; Set barcode module width and height (adjust if needed)
+^FO10,50^BCN,50,Y,N,N^FD{item_num}^FS
+
+^CF0,70            ; Increased font for the price to 30-dots height
+^FO10,140^FD${price}^FS
+^XZ
+""", stored_layout="""
+^CF0,30
+^FO10,15^FN1^FS
+^CF0,16
+^FO10,35^FD ^FS
+^BY2,2,50
+^FO10,50^BCN,50,Y,N,N^FN2^FS
+^CF0,70
+^FO10,140^FN3^FS
+""", stored_fields={1: "{item_name}", 2: "{item_num}", 3: "${price}"})
+
+# Design 3: Uses cash_price and card_price
+templates.register('design3', """
+^XA
+^CF0,20
+^FO10,15^FD{item_name}^FS
+
+^BY2,2,50
+^FO10,55^BCN,50,N,N,N^FD{item_num}^FS
+
+^CF0,35
+^FO10,150^FDCash: ${cash_price:.2f}^FS
+^FO240,150^FDCredit: ${card_price:.2f}^FS
+^XZ
+""", stored_layout="""
+^CF0,20
+^FO10,15^FN1^FS
+^BY2,2,50
+^FO10,55^BCN,50,N,N,N^FN2^FS
+^CF0,35
+^FO10,150^FN3^FS
+^FO240,150^FN4^FS
+""", stored_fields={1: "{item_name}", 2: "{item_num}", 3: "Cash: ${cash_price:.2f}", 4: "Credit: ${card_price:.2f}"})
+
+# Design 4: Uses a single price field and prints a rotated barcode
+templates.register('design4', """
+^XA
+^CF0,30                        ; Set font for product name
+^FO10,15^FD{item_name}^FS       ; Print product name at (10,10)
+
+^CF0,60                       ; Use a slightly smaller font for the price
+^FO10,70^FD${price}^FS           ; Print price at (10,50)
+
+^BY2,2,80                      ; Set barcode parameters (module width, ratio, height)
+^FO300,10                      ; Position the barcode on the right (X=300, Y=10)
+^BCR,80,Y,N,N                  ; Print the barcode rotated 90° with height 80
+^FD{item_num}^FS               ; Barcode data
+^XZ
+""", stored_layout="""
+^CF0,30
+^FO10,15^FN1^FS
+^CF0,60
+^FO10,70^FN3^FS
+^BY2,2,80
+^FO300,10
+^BCR,80,Y,N,N
+^FN2^FS
+""", stored_fields={1: "{item_name}", 2: "{item_num}", 3: "${price}"})
+
+# Design 5: Uses a single price field with a formatted field block for item name and price
+templates.register('design5', """
+^XA
+^CF0,30                              ; Set a smaller font for the item name
+^FO0,30^FB457,1,0,L^FD{item_name}^FS    ; Left align the item name in a 457-dot wide field
+
+^CF0,80                              ; Set a larger font for the price
+^FO0,110^FB457,1,0,C^FD${price}^FS       ; Center the price below the item name
+^XZ
+""", stored_layout="""
+^CF0,30
+^FO0,30^FB457,1,0,L^FN1^FS
+^CF0,80
+^FO0,110^FB457,1,0,C^FN3^FS
+""", stored_fields={1: "{item_name}", 3: "${price}"})
+
+
+# ------------------------------------------------------------------------------
+# Micro-benchmark
+# ------------------------------------------------------------------------------
+def benchmark(labels=10000, designs=None):
+    """Render ``labels`` labels per design and report labels per second."""
+    items = [(f"{n:08d}", f"Sample item {n} with a_long^name~", 1.99 + n % 100) for n in range(labels)]
+    results = {}
+    for name in designs or templates.names():
+        render = templates.render
+        started = time.perf_counter()
+        for item_num, item_name, price in items:
+            render(name, item_num, item_name, price)
+        elapsed = time.perf_counter() - started
+        results[name] = {
+            "labels": labels,
+            "seconds": round(elapsed, 4),
+            "labels_per_second": round(labels / elapsed) if elapsed else None,
+        }
+    return results
+
+
+if __name__ == '__main__':
+    for name, result in benchmark().items():
+        print(f"{name:8s} {result['labels']} labels in {result['seconds']:.4f}s "
+              f"({result['labels_per_second']:,} labels/s)")
@@ -0,0 +1,158 @@
+"""
+Detects Inventory price changes for "print labels for everything that changed".
+
+Inventory has no last-modified column, so a background scan reads ItemNum and
+Price every ``scan_interval`` seconds (streamed with fetchmany) and records
+when each item's price was last seen to change, or when the item first
+appeared. Only one store is scanned (``store_id``) so items stocked by
+several stores do not flip between their prices. Earlier price changes
+cannot be recovered, so the first scan seeds each item with its
+Date_Created: changed_since() then reports items created since the given
+date until the scans have history of their own. State is kept in a JSON
+snapshot so a restart does not forget earlier changes.
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from sales_aggregates import item_key
+
+SCAN_QUERY = "SELECT ItemNum, Price, Date_Created FROM Inventory WHERE Store_ID = ?"
+SCAN_BATCH_SIZE = 5000
+
+
+def created_at(value):
+    """Date_Created as a datetime; the column holds datetimes or 'YYYY-MM-DD' strings."""
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(str(value).strip()) if value else None
+    except ValueError:
+        return None
+
+
+class PriceChangeTracker:
+    """item_key -> [ItemNum, price, changed_at]; changed_at is None for baseline entries without a Date_Created."""
+
+    def __init__(self, store_id, snapshot_path=None, scan_interval=300.0):
+        self.store_id = store_id
+        self.snapshot_path = snapshot_path
+        self.scan_interval = scan_interval
+        self._lock = threading.Lock()
+        self._scan_lock = threading.Lock()
+        self._items = {}
+        self.last_scan_at = None
+        self.last_scan_changes = 0
+        self._thread = None
+        if snapshot_path:
+            self._load_snapshot()
+
+    def start(self, get_connection):
+        """Scan every ``scan_interval`` seconds in a daemon thread; later calls do nothing."""
+        if self._thread is not None:
+            return   # already running: the per-request hook stays lock-free
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._scan_forever, args=(get_connection,), name="price-change-scan", daemon=True
+            )
+        self._thread.start()
+
+    def _scan_forever(self, get_connection):
+        while True:
+            try:
+                self.scan(get_connection)
+            except Exception as e:
+                print(f"Price change scan failed: {e}")
+            time.sleep(self.scan_interval)
+
+    def scan(self, get_connection):
+        """Compare current prices with the last scan; returns the number of changes found."""
+        with self._scan_lock:
+            baseline = self.last_scan_at is None and not self._items
+            now = datetime.now()
+            changes = 0
+            conn = get_connection(owner="price change scan")
+            try:
+                cursor = conn.cursor()
+                cursor.execute(SCAN_QUERY, (self.store_id,))
+                while True:
+                    rows = cursor.fetchmany(SCAN_BATCH_SIZE)
+                    if not rows:
+                        break
+                    with self._lock:
+                        for item_num, price, date_created in rows:
+                            price = float(price) if price is not None else None
+                            key = item_key(item_num)
+                            entry = self._items.get(key)
+                            if entry is None:
+                                self._items[key] = [item_num, price, created_at(date_created) if baseline else now]
+                                changes += not baseline
+                            elif entry[1] != price:
+                                entry[1] = price
+                                entry[2] = now
+                                changes += 1
+            finally:
+                conn.close()
+            with self._lock:
+                self.last_scan_at = now
+                self.last_scan_changes = changes
+            if self.snapshot_path and (changes or baseline):
+                self._save_snapshot()
+            return changes
+
+    def changed_since(self, since):
+        """ItemNums whose price changed (or that appeared) at or after ``since``."""
+        with self._lock:
+            return [entry[0] for entry in self._items.values() if entry[2] is not None and entry[2] >= since]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "items": len(self._items),
+                "store_id": self.store_id,
+                "running": self._thread is not None,
+                "scan_interval": self.scan_interval,
+                "last_scan_at": self.last_scan_at.isoformat() if self.last_scan_at else None,
+                "last_scan_changes": self.last_scan_changes,
+            }
+
+    # --------------------------------------------------------------------------
+    # Snapshot persistence
+    # --------------------------------------------------------------------------
+    def _save_snapshot(self):
+        with self._lock:
+            snapshot = {
+                "last_scan_at": self.last_scan_at.isoformat() if self.last_scan_at else None,
+                "items": [
+                    [entry[0], entry[1], entry[2].isoformat() if entry[2] else None]
+                    for entry in self._items.values()
+                ],
+            }
+        tmp_path = self.snapshot_path + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            print(f"Could not save price change snapshot: {e}")
+
+    def _load_snapshot(self):
+        if not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+            items = {}
+            for item_num, price, changed_at in snapshot["items"]:
+                changed_at = datetime.fromisoformat(changed_at) if changed_at else None
+                items[item_key(item_num)] = [item_num, price, changed_at]
+            last_scan_at = snapshot["last_scan_at"]
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Ignoring unreadable price change snapshot: {e}")
+            return
+        self._items = items
+        self.last_scan_at = datetime.fromisoformat(last_scan_at) if last_scan_at else None
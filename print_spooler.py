@@ -0,0 +1,321 @@
+"""
+Print spooler for raw-socket (port 9100) label printers.
+
+Each printer IP gets its own FIFO queue, a worker thread that drains it and a
+long-lived connection that is reused across jobs, re-opened after a send error
+and closed again after the queue has been idle for a while (Zebra printers
+accept one 9100 client at a time, so an idle connection would lock others
+out). Routes submit a job and get a job ID back immediately.
+
+Queues are bounded (``max_queued_jobs`` per printer, ``max_printers`` in
+total) and a worker that has had nothing to do for ``reap_after`` seconds
+exits and drops its queue, so stray addresses don't pin threads forever.
+"""
+import collections
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from printer_health import PrinterUnavailableError
+
+
+class SpoolerFullError(Exception):
+    """Raised when a printer's queue, or the number of printers, is at its limit."""
+
+
+class PrintJob:
+    """One submission: a list of ZPL documents bound for one printer."""
+
+    def __init__(self, printer, documents, labels=None, on_finish=None, on_sent=None):
+        self.id = uuid.uuid4().hex
+        self.printer = printer
+        self.on_finish = on_finish           # called with the job once it is done or failed
+        self.on_sent = on_sent               # called with (job, index) after each document is sent
+        self.failover_job_id = None          # set when a printer group re-routed the unsent rest
+        self.documents = documents
+        self.document_count = len(documents)
+        self.labels = labels or []          # per-document metadata echoed in status()
+        self.status = "queued"               # queued -> printing -> done | failed
+        self.sent = 0                        # documents handed to the socket so far
+        self.attempts = 0
+        self.error = None
+        self.submitted_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+
+    def status_dict(self):
+        return {
+            "job_id": self.id,
+            "printer": self.printer,
+            "status": self.status,
+            "documents": self.document_count,
+            "sent": self.sent,
+            "attempts": self.attempts,
+            "error": self.error,
+            "failover_job_id": self.failover_job_id,
+            "labels": self.labels,
+            "submitted_at": self.submitted_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class PrinterQueue:
+    """FIFO of jobs for one printer, drained by a single worker over one connection."""
+
+    def __init__(self, spooler, printer):
+        self.spooler = spooler
+        self.printer = printer
+        self._jobs = collections.deque()
+        self._cond = threading.Condition()
+        self._socket = None
+        self._current = None
+        self.documents_per_second = None     # moving average over finished jobs
+        self.connects = 0
+        self.jobs_done = 0
+        self.jobs_failed = 0
+        self.documents_sent = 0
+        self.last_error = None
+        self.closed = False                  # set by the spooler when the worker is reaped
+        self._worker = threading.Thread(target=self._run, name=f"print-spooler-{printer}", daemon=True)
+        self._worker.start()
+
+    def put(self, job):
+        with self._cond:
+            self._jobs.append(job)
+            self._cond.notify()
+
+    def depth(self):
+        with self._cond:
+            return len(self._jobs)
+
+    def pending_documents(self):
+        """Documents not yet sent: queued jobs plus the rest of the one printing now."""
+        with self._cond:
+            pending = sum(job.document_count for job in self._jobs)
+            current = self._current
+        if current is not None:
+            pending += current.document_count - current.sent
+        return pending
+
+    # --------------------------------------------------------------------------
+    # Worker
+    # --------------------------------------------------------------------------
+    def _run(self):
+        idle_since = time.monotonic()
+        while True:
+            with self._cond:
+                if not self._jobs:
+                    self._cond.wait(self.spooler.idle_close)
+                if not self._jobs:
+                    # Queue stayed empty: give the printer back to other clients.
+                    self._disconnect()
+                    idle = time.monotonic() - idle_since
+                else:
+                    job = self._jobs.popleft()
+                    self._current = job
+                    idle = None
+            if idle is None:
+                try:
+                    self._print(job)
+                except Exception as e:
+                    # Not a connection error: fail the job but keep the worker alive.
+                    job.status = "failed"
+                    job.error = str(e)
+                    job.finished_at = datetime.now()
+                    self.jobs_failed += 1
+                    self.spooler._finish(job)
+                    print(f"Print job {job.id} to {self.printer} failed: {e}")
+                finally:
+                    self._current = None
+                    if self.spooler.health:
+                        self.spooler.health.release_trial(self.printer)
+                idle_since = time.monotonic()
+            elif idle >= self.spooler.reap_after and self.spooler._reap(self):
+                return
+
+    def _print(self, job):
+        job.status = "printing"
+        job.started_at = datetime.now()
+        started = time.monotonic()
+        while job.sent < len(job.documents):
+            job.attempts += 1
+            try:
+                sock = self._connection()
+                for zpl_code in job.documents[job.sent:]:
+                    sock.sendall(zpl_code.encode('utf-8'))
+                    job.sent += 1
+                    self.documents_sent += 1
+                    if job.on_sent:
+                        job.on_sent(job, job.sent - 1)
+            except OSError as e:
+                self._disconnect()
+                self.last_error = str(e)
+                health = self.spooler.health
+                if health and not isinstance(e, PrinterUnavailableError):
+                    health.record_failure(self.printer, e)
+                if job.attempts > self.spooler.max_retries:
+                    job.status = "failed"
+                    job.error = f"Error sending print command: {e}"
+                    job.finished_at = datetime.now()
+                    self.jobs_failed += 1
+                    self.spooler._finish(job)
+                    print(f"Print job {job.id} to {self.printer} failed: {e}")
+                    return
+                time.sleep(self.spooler.retry_delay)
+        if self.spooler.health:
+            self.spooler.health.record_success(self.printer)
+        elapsed = time.monotonic() - started
+        if elapsed > 0 and job.document_count:
+            rate = job.document_count / elapsed
+            average = self.documents_per_second
+            self.documents_per_second = rate if average is None else 0.7 * average + 0.3 * rate
+        job.status = "done"
+        job.finished_at = datetime.now()
+        self.jobs_done += 1
+        self.spooler._finish(job)
+
+    def _connection(self):
+        if self._socket is None:
+            if self.spooler.health:
+                self.spooler.health.allow(self.printer)  # fails fast while the circuit is open
+            self._socket = socket.create_connection(
+                (self.printer, self.spooler.port), timeout=self.spooler.connect_timeout
+            )
+            self._socket.settimeout(self.spooler.send_timeout)
+            self.connects += 1
+        return self._socket
+
+    def _disconnect(self):
+        if self._socket is not None:
+            try:
+                self._socket.close()
+            except OSError:
+                pass
+            self._socket = None
+
+    @property
+    def connected(self):
+        return self._socket is not None
+
+    def stats(self):
+        return {
+            "printer": self.printer,
+            "queued": self.depth(),
+            "connected": self.connected,
+            "connects": self.connects,
+            "jobs_done": self.jobs_done,
+            "jobs_failed": self.jobs_failed,
+            "documents_sent": self.documents_sent,
+            "pending_documents": self.pending_documents(),
+            "documents_per_second": round(self.documents_per_second, 2) if self.documents_per_second else None,
+            "last_error": self.last_error,
+        }
+
+
+class PrintSpooler:
+    """Printer IP -> PrinterQueue, plus a bounded history of finished jobs."""
+
+    def __init__(self, port=9100, connect_timeout=5.0, send_timeout=10.0, idle_close=30.0,
+                 max_retries=2, retry_delay=1.0, max_finished_jobs=1000, health=None,
+                 max_queued_jobs=100, max_printers=64, reap_after=600.0):
+        self.port = port
+        self.health = health                       # optional PrinterHealth circuit breaker
+        self.connect_timeout = connect_timeout
+        self.send_timeout = send_timeout
+        self.idle_close = idle_close
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_finished_jobs = max_finished_jobs
+        self.max_queued_jobs = max_queued_jobs
+        self.max_printers = max_printers
+        self.reap_after = reap_after
+        self._queues = {}
+        self._rates = {}                           # printer -> send rate kept when its worker is reaped
+        self._jobs = {}                            # job id -> queued or running job
+        self._finished = collections.OrderedDict() # job id -> finished job, oldest first
+        self._lock = threading.Lock()
+
+    def submit(self, printer, documents, labels=None, on_finish=None, on_sent=None):
+        """Queue ``documents`` (ZPL strings) for ``printer`` and return the job."""
+        job = PrintJob(printer, list(documents), labels, on_finish, on_sent)
+        with self._lock:
+            queue = self._queues.get(printer)
+            if queue is None:
+                if len(self._queues) >= self.max_printers:
+                    raise SpoolerFullError(f"Print spooler already serves {self.max_printers} printers.")
+                queue = self._queues[printer] = PrinterQueue(self, printer)
+                queue.documents_per_second = self._rates.pop(printer, None)
+            if queue.depth() >= self.max_queued_jobs:
+                raise SpoolerFullError(f"{self.max_queued_jobs} jobs are already waiting for {printer}.")
+            self._jobs[job.id] = job
+            # Put under the spooler lock so the worker cannot be reaped in between.
+            queue.put(job)
+        return job
+
+    def _reap(self, queue):
+        """Drop an idle worker's queue; False if a job arrived meanwhile."""
+        with self._lock:
+            if queue.depth():
+                return False
+            queue.closed = True
+            if self._queues.get(queue.printer) is queue:
+                del self._queues[queue.printer]
+            if queue.documents_per_second:
+                self._rates[queue.printer] = queue.documents_per_second
+            return True
+
+    def connected(self, printer):
+        """True while the spooler holds an open connection to ``printer``."""
+        with self._lock:
+            queue = self._queues.get(printer)
+        return bool(queue and queue.connected)
+
+    def pending_documents(self, printer):
+        with self._lock:
+            queue = self._queues.get(printer)
+        return queue.pending_documents() if queue else 0
+
+    def documents_per_second(self, printer):
+        """Measured send rate for ``printer``, or None before its first finished job."""
+        with self._lock:
+            queue = self._queues.get(printer)
+            if queue is None:
+                return self._rates.get(printer)
+        return queue.documents_per_second
+
+    def queue_depth(self, printer):
+        """Jobs waiting for ``printer`` (not counting the one being printed)."""
+        with self._lock:
+            queue = self._queues.get(printer)
+        return queue.depth() if queue else 0
+
+    def job(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id) or self._finished.get(job_id)
+
+    def _finish(self, job):
+        if job.on_finish:
+            try:
+                job.on_finish(job)
+            except Exception as e:
+                print(f"Print job {job.id} completion hook failed: {e}")
+        job.documents = []   # history keeps the status, not the ZPL
+        with self._lock:
+            self._jobs.pop(job.id, None)
+            self._finished[job.id] = job
+            while len(self._finished) > self.max_finished_jobs:
+                self._finished.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            queues = list(self._queues.values())
+            active = len(self._jobs)
+        return {
+            "active_jobs": active,
+            "max_queued_jobs": self.max_queued_jobs,
+            "max_printers": self.max_printers,
+            "printers": [queue.stats() for queue in queues],
+        }
@@ -0,0 +1,181 @@
+"""
+Printer groups: several label printers addressed by one name.
+
+A job sent to a group is cut into chunks and each chunk goes to the printer
+that is expected to finish it first, judged by the documents already waiting
+for that printer and its measured send rate. Printers whose circuit is open
+are skipped, and when a chunk fails on one printer the unsent remainder is
+re-queued on another printer of the same group.
+"""
+import json
+import os
+import threading
+
+DEFAULT_DOCUMENTS_PER_SECOND = 2.0   # assumed rate for a printer with no finished jobs yet
+
+
+class NoPrinterAvailableError(Exception):
+    """Raised when every printer of a group is unavailable (or the group is empty)."""
+
+
+class PrinterGroups:
+    def __init__(self, spooler, health, groups=None, snapshot_path=None, chunk_size=100):
+        self.spooler = spooler
+        self.health = health
+        self.snapshot_path = snapshot_path
+        self.chunk_size = chunk_size
+        self._groups = dict(groups or {})   # name -> [printer IP, ...]
+        self._lock = threading.Lock()
+        self.failovers = 0
+        if snapshot_path:
+            self._load_snapshot()
+
+    # --------------------------------------------------------------------------
+    # Group definitions
+    # --------------------------------------------------------------------------
+    def set_group(self, name, printers):
+        with self._lock:
+            self._groups[name] = list(dict.fromkeys(printers))
+        self._save_snapshot()
+
+    def delete_group(self, name):
+        with self._lock:
+            removed = self._groups.pop(name, None) is not None
+        if removed:
+            self._save_snapshot()
+        return removed
+
+    def printers(self, name):
+        with self._lock:
+            return list(self._groups.get(name, []))
+
+    def members(self):
+        """Every printer that belongs to some group."""
+        with self._lock:
+            return {printer for printers in self._groups.values() for printer in printers}
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self._groups
+
+    # --------------------------------------------------------------------------
+    # Routing
+    # --------------------------------------------------------------------------
+    def _rate(self, printer):
+        return self.spooler.documents_per_second(printer) or DEFAULT_DOCUMENTS_PER_SECOND
+
+    def _pick(self, name, planned, size, exclude=()):
+        """Printer expected to finish ``size`` more documents first."""
+        candidates = [
+            printer for printer in self.printers(name)
+            if printer not in exclude and self.health.available(printer)
+        ]
+        if not candidates:
+            raise NoPrinterAvailableError(f"No printer available in group '{name}'.")
+        for printer in candidates:
+            if printer not in planned:
+                planned[printer] = self.spooler.pending_documents(printer)
+        return min(candidates, key=lambda printer: (planned[printer] + size) / self._rate(printer))
+
+    def submit(self, name, documents, labels=None, preamble=None, on_preamble_sent=None):
+        """
+        Split ``documents`` across the group and return the spooler jobs.
+        ``preamble(printer)`` may return documents that must precede the
+        chunk on that printer (e.g. a stored-format download);
+        ``on_preamble_sent(printer)`` is called once they have been sent.
+        """
+        documents = list(documents)
+        labels = labels or []
+        planned = {}
+        jobs = []
+        for start in range(0, len(documents), self.chunk_size):
+            chunk = documents[start:start + self.chunk_size]
+            printer = self._pick(name, planned, len(chunk))
+            planned[printer] += len(chunk)
+            jobs.append(self._submit_chunk(
+                name, printer, chunk, labels[start:start + self.chunk_size], preamble, on_preamble_sent,
+                tried={printer}
+            ))
+        return jobs
+
+    def _submit_chunk(self, name, printer, chunk, labels, preamble, on_preamble_sent, tried):
+        head = [document for document in (preamble(printer) if preamble else []) if document]
+        on_sent = None
+        if head and on_preamble_sent:
+            def on_sent(job, index):
+                if index == len(head) - 1:
+                    on_preamble_sent(printer)
+        return self.spooler.submit(
+            printer, head + chunk, labels,
+            on_finish=lambda job: self._failover(name, job, len(head), labels, preamble, on_preamble_sent, tried),
+            on_sent=on_sent,
+        )
+
+    def _failover(self, name, job, head_size, labels, preamble, on_preamble_sent, tried):
+        if job.status != "failed":
+            return
+        # Everything after the preamble that did not reach the failed printer.
+        unsent_from = max(job.sent, head_size)
+        remaining = job.documents[unsent_from:]
+        if not remaining:
+            return
+        try:
+            printer = self._pick(name, {}, len(remaining), exclude=tried)
+        except NoPrinterAvailableError as e:
+            print(f"Print job {job.id} could not fail over: {e}")
+            return
+        replacement = self._submit_chunk(
+            name, printer, remaining, labels[unsent_from - head_size:], preamble, on_preamble_sent,
+            tried | {printer}
+        )
+        job.failover_job_id = replacement.id
+        with self._lock:
+            self.failovers += 1
+        print(f"Print job {job.id} failed on {job.printer}; {len(remaining)} labels moved to {printer}")
+
+    # --------------------------------------------------------------------------
+    # Stats and persistence
+    # --------------------------------------------------------------------------
+    def stats(self):
+        with self._lock:
+            groups = {name: list(printers) for name, printers in self._groups.items()}
+            failovers = self.failovers
+        return {
+            "failovers": failovers,
+            "groups": {
+                name: [
+                    {
+                        "printer": printer,
+                        "available": self.health.available(printer),
+                        "pending_documents": self.spooler.pending_documents(printer),
+                        "documents_per_second": round(self.spooler.documents_per_second(printer) or 0, 2),
+                    }
+                    for printer in printers
+                ]
+                for name, printers in groups.items()
+            },
+        }
+
+    def _save_snapshot(self):
+        if not self.snapshot_path:
+            return
+        with self._lock:
+            groups = dict(self._groups)
+        tmp_path = self.snapshot_path + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(groups, f, indent=2)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            print(f"Could not save printer groups: {e}")
+
+    def _load_snapshot(self):
+        if not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path) as f:
+                groups = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable printer groups file: {e}")
+            return
+        self._groups.update({name: list(printers) for name, printers in groups.items()})
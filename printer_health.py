@@ -0,0 +1,209 @@
+"""
+Per-printer circuit breaker and health cache.
+
+Every send to a printer goes through PrinterHealth.allow() first. After
+``failure_threshold`` consecutive errors the circuit opens and sends fail
+immediately instead of waiting on a dead host; after ``reset_timeout`` seconds
+it half-opens and lets a single trial through, which closes it again on
+success. A background thread probes every known printer with a short TCP
+connect so the health endpoint (and a recovering printer) stays current
+without a user having to hit it first.
+"""
+import socket
+import threading
+import time
+from datetime import datetime
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class PrinterUnavailableError(ConnectionError):
+    """Raised when a printer's circuit is open and the send is refused up front."""
+
+
+class PrinterState:
+    def __init__(self, printer):
+        self.printer = printer
+        self.circuit = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None           # time.monotonic() the circuit last opened
+        self.trial_in_flight = False    # half-open admits one caller at a time
+        self.last_error = None
+        self.last_success_at = None     # wall clock, for display
+        self.last_failure_at = None
+        self.last_used = None           # time.monotonic() of the last successful send
+        self.last_probe_at = None
+        self.last_probe_ok = None
+        self.last_probe_ms = None
+
+    def status_dict(self):
+        return {
+            "printer": self.printer,
+            "circuit": self.circuit,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+            "last_success_at": self.last_success_at.isoformat() if self.last_success_at else None,
+            "last_failure_at": self.last_failure_at.isoformat() if self.last_failure_at else None,
+            "last_probe_at": self.last_probe_at.isoformat() if self.last_probe_at else None,
+            "last_probe_ok": self.last_probe_ok,
+            "last_probe_ms": self.last_probe_ms,
+        }
+
+
+class PrinterHealth:
+    """Printer IP -> circuit state, plus the background prober that refreshes it."""
+
+    def __init__(self, port=9100, failure_threshold=3, reset_timeout=30.0,
+                 probe_interval=15.0, probe_timeout=2.0):
+        self.port = port
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self._printers = {}
+        self._lock = threading.Lock()
+        self._prober = None
+        self._failure_listeners = []
+        self._busy = None
+
+    def skip_probes_while(self, busy):
+        """Don't probe a printer while ``busy(printer)`` is true (e.g. the spooler holds its 9100 connection)."""
+        self._busy = busy
+
+    def add_failure_listener(self, callback):
+        """Call ``callback(printer, reason=...)`` after every recorded send failure."""
+        self._failure_listeners.append(callback)
+
+    def _state(self, printer):
+        # Caller holds self._lock.
+        state = self._printers.get(printer)
+        if state is None:
+            state = self._printers[printer] = PrinterState(printer)
+        return state
+
+    # --------------------------------------------------------------------------
+    # Circuit breaker
+    # --------------------------------------------------------------------------
+    def allow(self, printer):
+        """Raise PrinterUnavailableError unless a send to ``printer`` may be attempted now."""
+        self._ensure_prober()
+        with self._lock:
+            state = self._state(printer)
+            if state.circuit == OPEN and time.monotonic() - state.opened_at >= self.reset_timeout:
+                state.circuit = HALF_OPEN
+            if state.circuit == CLOSED:
+                return
+            if state.circuit == HALF_OPEN and not state.trial_in_flight:
+                state.trial_in_flight = True
+                return
+            raise PrinterUnavailableError(
+                f"Printer {printer} is unavailable after {state.consecutive_failures} failed attempts "
+                f"(last error: {state.last_error}); retrying automatically."
+            )
+
+    def available(self, printer):
+        """False while ``printer``'s circuit is open and not yet due for a trial send."""
+        with self._lock:
+            state = self._printers.get(printer)
+            if state is None or state.circuit != OPEN:
+                return True
+            return time.monotonic() - state.opened_at >= self.reset_timeout
+
+    def release_trial(self, printer):
+        """
+        End a half-open trial that finished without record_success() or
+        record_failure() (e.g. the sender raised something other than a
+        connection error), so the next caller may try again.
+        """
+        with self._lock:
+            state = self._printers.get(printer)
+            if state is not None:
+                state.trial_in_flight = False
+
+    def record_success(self, printer):
+        with self._lock:
+            state = self._state(printer)
+            state.circuit = CLOSED
+            state.consecutive_failures = 0
+            state.trial_in_flight = False
+            state.last_success_at = datetime.now()
+            state.last_used = time.monotonic()
+
+    def record_failure(self, printer, error):
+        with self._lock:
+            state = self._state(printer)
+            state.consecutive_failures += 1
+            state.trial_in_flight = False
+            state.last_error = str(error)
+            state.last_failure_at = datetime.now()
+            if state.circuit == HALF_OPEN or state.consecutive_failures >= self.failure_threshold:
+                if state.circuit != OPEN:
+                    print(f"Printer {printer} circuit opened: {error}")
+                state.circuit = OPEN
+                state.opened_at = time.monotonic()
+        for callback in self._failure_listeners:
+            callback(printer, reason=str(error))
+
+    # --------------------------------------------------------------------------
+    # Background probes
+    # --------------------------------------------------------------------------
+    def _ensure_prober(self):
+        if self._prober is not None:
+            return
+        with self._lock:
+            if self._prober is None:
+                self._prober = threading.Thread(target=self._probe_forever, name="printer-prober", daemon=True)
+                self._prober.start()
+
+    def _probe_forever(self):
+        while True:
+            time.sleep(self.probe_interval)
+            try:
+                self.probe_all()
+            except Exception as e:
+                print(f"Printer prober error: {e}")
+
+    def probe(self, printer):
+        """TCP-connect to ``printer`` and record the outcome; returns True when reachable."""
+        started = time.monotonic()
+        try:
+            with socket.create_connection((printer, self.port), timeout=self.probe_timeout):
+                pass
+            ok, error = True, None
+        except OSError as e:
+            ok, error = False, e
+        elapsed_ms = round((time.monotonic() - started) * 1000, 1)
+        with self._lock:
+            state = self._state(printer)
+            state.last_probe_at = datetime.now()
+            state.last_probe_ok = ok
+            state.last_probe_ms = elapsed_ms
+            if ok and state.circuit == OPEN:
+                # Reachable again: let the next real send through as the trial.
+                state.circuit = HALF_OPEN
+            elif not ok:
+                state.last_error = str(error)
+        return ok
+
+    def probe_all(self):
+        now = time.monotonic()
+        with self._lock:
+            # A printer that just took a send is known to be up, and a Zebra
+            # serves one 9100 client at a time, so don't compete with the spooler.
+            due = [
+                state.printer for state in self._printers.values()
+                if state.last_used is None or now - state.last_used > self.probe_interval
+            ]
+        for printer in due:
+            if self._busy and self._busy(printer):
+                continue
+            self.probe(printer)
+
+    def status(self, printer=None):
+        with self._lock:
+            if printer is not None:
+                state = self._printers.get(printer)
+                return state.status_dict() if state else None
+            return [state.status_dict() for state in self._printers.values()]
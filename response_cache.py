@@ -0,0 +1,199 @@
+"""
+Keyed, size-bounded TTL cache for whole JSON responses, plus conditional GET.
+
+Routes opt in with the ``cached`` decorator (one TTL per endpoint) and write
+routes that change inventory opt in to ``invalidates`` so the next poll after
+an edit is recomputed instead of served stale. ``conditional`` answers
+``If-None-Match`` with 304 when the data version behind a route is unchanged.
+A view that returns a degraded 200 (e.g. some sections timed out) calls
+``uncacheable()`` so neither decorator keeps or tags it.
+"""
+import collections
+import functools
+import hashlib
+import threading
+import time
+
+from flask import Response, g, make_response, request
+
+
+class ResponseCache:
+    """LRU-bounded map of cache key -> (expires_at, body, status, headers)."""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = collections.defaultdict(collections.Counter)  # endpoint -> counts
+        self.invalidations = 0
+        self.last_invalidated_by = None
+        self.generation = 0   # bumped by invalidate(); a set() from an older generation is dropped
+
+    def get(self, key):
+        endpoint = key[0]
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self._counters[endpoint]['hits'] += 1
+                return entry
+            if entry is not None:
+                del self._entries[key]
+                self._counters[endpoint]['expired'] += 1
+            self._counters[endpoint]['misses'] += 1
+            return None
+
+    def set(self, key, ttl, body, status, headers, generation=None):
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                # Invalidated while the response was being computed: it may be stale.
+                self._counters[key[0]]['discarded'] += 1
+                return
+            self._entries[key] = (time.monotonic() + ttl, body, status, headers)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted_key, _ = self._entries.popitem(last=False)
+                self._counters[evicted_key[0]]['evicted'] += 1
+
+    def invalidate(self, reason=None):
+        """Drop every cached response (inventory changed)."""
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+            self.generation += 1
+            self.last_invalidated_by = reason
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "invalidations": self.invalidations,
+                "last_invalidated_by": self.last_invalidated_by,
+                "endpoints": {endpoint: dict(counts) for endpoint, counts in self._counters.items()},
+            }
+
+
+class DataVersions:
+    """
+    Cheap version tokens for the data behind a response.
+
+    ``probes`` maps a source name (e.g. 'inventory') to a callable returning a
+    value that changes whenever that data changes. Each value is reused for
+    ``ttl`` seconds so a burst of polls costs one probe query, not one each.
+    """
+
+    def __init__(self, probes, ttl=2.0):
+        self.probes = probes
+        self.ttl = ttl
+        self._values = {}   # source -> (value, computed at)
+        self._lock = threading.Lock()
+
+    def value(self, source):
+        with self._lock:
+            memo = self._values.get(source)
+        if memo is not None and time.monotonic() - memo[1] < self.ttl:
+            return memo[0]
+        value = self.probes[source]()
+        with self._lock:
+            self._values[source] = (value, time.monotonic())
+        return value
+
+    def token(self, sources):
+        """Combined version string for ``sources``."""
+        return "|".join(f"{source}={self.value(source)}" for source in sources)
+
+    def invalidate(self, reason=None):
+        """Forget memoised values so the next request re-probes (a local write happened)."""
+        with self._lock:
+            self._values.clear()
+
+
+def request_cache_key():
+    """Endpoint plus its path and query arguments, independent of argument order."""
+    view_args = tuple(sorted((request.view_args or {}).items()))
+    query_args = tuple(sorted(request.args.items(multi=True)))
+    # Under ``conditional`` the data version is part of the key, so a cached body
+    # never outlives the data it was built from.
+    return (request.endpoint, view_args, query_args, g.get('data_version'))
+
+
+def uncacheable():
+    """Mark the current response as not fit for caching or an ETag (e.g. a partial result)."""
+    g.response_uncacheable = True
+
+
+def cached(cache, ttl):
+    """Serve a view's successful (200) responses from ``cache`` for ``ttl`` seconds."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request_cache_key()
+            entry = cache.get(key)
+            if entry is not None:
+                _, body, status, headers = entry
+                response = Response(body, status=status, headers=headers)
+                response.headers['X-Cache'] = 'HIT'
+                return response
+            generation = cache.generation
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed and not g.get('response_uncacheable'):
+                headers = [(name, value) for name, value in response.headers.items()
+                           if name.lower() != 'content-length']
+                cache.set(key, ttl, response.get_data(), response.status_code, headers, generation=generation)
+            response.headers['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
+
+
+def invalidate(*caches):
+    """Clear every cache in ``caches`` now, for writes whose outcome the status code doesn't tell."""
+    for cache in caches:
+        cache.invalidate(reason=f"{request.method} {request.path}")
+
+
+def invalidates(*caches):
+    """Clear every cache in ``caches`` after a write view succeeds (any status below 400)."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            response = make_response(view(*args, **kwargs))
+            if response.status_code < 400:
+                invalidate(*caches)
+            return response
+        return wrapper
+    return decorator
+
+
+def conditional(versions, *sources):
+    """
+    Tag a GET view's 200 responses with an ETag derived from the version of
+    ``sources`` and answer a matching ``If-None-Match`` with an empty 304
+    before the view runs. If the version probe fails the view runs untagged.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                version = versions.token(sources)
+            except Exception as e:
+                print(f"Data version probe failed for {request.endpoint}: {e}")
+                return view(*args, **kwargs)
+            g.data_version = version
+            # Same data, different query string -> different representation.
+            view_args = sorted((request.view_args or {}).items())
+            query_args = sorted(request.args.items(multi=True))
+            etag = hashlib.sha1(
+                repr((request.endpoint, view_args, query_args, version)).encode('utf-8')
+            ).hexdigest()
+            if etag in request.if_none_match:
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not g.get('response_uncacheable'):
+                response.set_etag(etag)
+            return response
+        return wrapper
+    return decorator
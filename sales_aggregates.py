@@ -0,0 +1,220 @@
+"""
+Per-item sales aggregates (units sold, revenue, last sale) kept in memory and
+advanced incrementally from an Invoice_Number high-water mark, so dashboard
+routes no longer re-sum the whole invoice_itemized table on every call.
+
+Invoices can still gain lines after they first appear (held or open
+invoices), so the newest ``rescan_window`` invoice numbers are never folded
+in for good: they are re-read on every refresh and kept apart from the
+settled totals, which only advance past invoices older than the window.
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+# Only invoices in (high-water mark, upper bound] are read on each refresh.
+DELTA_QUERY = """
+    SELECT
+        ii.ItemNum,
+        SUM(ii.Quantity) AS UnitsSold,
+        SUM(ii.Quantity * ii.PricePer) AS Revenue,
+        MAX(it.DateTime) AS LastSold
+    FROM invoice_itemized ii
+    LEFT JOIN invoice_totals it
+        ON it.Invoice_Number = ii.Invoice_Number AND it.Store_ID = ii.Store_ID
+    WHERE ii.Invoice_Number > ? AND ii.Invoice_Number <= ?
+    GROUP BY ii.ItemNum
+"""
+
+
+def item_key(item_num):
+    """Normalise an ItemNum the way SQL Server compares it (case-insensitive, trailing blanks ignored)."""
+    return str(item_num).rstrip().upper()
+
+
+def add_sales(entries, item_num, units, revenue, last_sold):
+    """Add one item's sales to an item_key -> [ItemNum, units, revenue, last_sold] dict."""
+    key = item_key(item_num)
+    entry = entries.get(key)
+    if entry is None:
+        entries[key] = [item_num, units, revenue, last_sold]
+        return
+    entry[1] += units
+    entry[2] += revenue
+    if last_sold is not None and (entry[3] is None or last_sold > entry[3]):
+        entry[3] = last_sold
+
+
+class SalesAggregateStore:
+    """ItemNum -> {units sold, revenue, last sold}, refreshed from new invoices only."""
+
+    def __init__(self, snapshot_path=None, refresh_interval=5.0, rescan_window=500):
+        self.snapshot_path = snapshot_path
+        self.refresh_interval = refresh_interval
+        self.rescan_window = rescan_window
+        self._lock = threading.Lock()          # guards the aggregates below
+        self._refresh_lock = threading.RLock() # one refresh at a time
+        self._items = {}                       # item_key -> [ItemNum, units, revenue, last_sold], settled invoices
+        self._recent = {}                      # same shape, invoices in the rescan window only
+        self.high_water_mark = 0               # invoices at or below this are settled
+        self.latest_invoice = 0
+        self.total_revenue = 0.0               # settled invoices
+        self.recent_revenue = 0.0
+        self.last_refreshed = None             # time.monotonic() of the last refresh
+        self.last_refreshed_at = None          # wall-clock datetime of the last refresh
+        self.last_refresh_rows = 0
+        self.last_refresh_seconds = 0.0
+        if snapshot_path:
+            self._load_snapshot()
+
+    # --------------------------------------------------------------------------
+    # Refresh
+    # --------------------------------------------------------------------------
+    def refresh(self, get_connection):
+        """Settle invoices that left the rescan window and re-read the ones still in it."""
+        with self._refresh_lock:
+            started = time.monotonic()
+            conn = get_connection()
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT ISNULL(MAX(Invoice_Number), 0) FROM invoice_itemized")
+                upper = cursor.fetchone()[0]
+                settle_to = max(self.high_water_mark, upper - self.rescan_window)
+                settled_rows = []
+                if settle_to > self.high_water_mark:
+                    cursor.execute(DELTA_QUERY, (self.high_water_mark, settle_to))
+                    settled_rows = cursor.fetchall()
+                recent_rows = []
+                if upper > settle_to:
+                    cursor.execute(DELTA_QUERY, (settle_to, upper))
+                    recent_rows = cursor.fetchall()
+            finally:
+                conn.close()
+
+            recent = {}
+            recent_revenue = 0.0
+            for row in recent_rows:
+                revenue = float(row[2] or 0)
+                recent[item_key(row[0])] = [row[0], float(row[1] or 0), revenue, row[3]]
+                recent_revenue += revenue
+
+            with self._lock:
+                for row in settled_rows:
+                    revenue = float(row[2] or 0)
+                    add_sales(self._items, row[0], float(row[1] or 0), revenue, row[3])
+                    self.total_revenue += revenue
+                self.high_water_mark = settle_to
+                self.latest_invoice = upper
+                self._recent = recent
+                self.recent_revenue = recent_revenue
+                self.last_refreshed = time.monotonic()
+                self.last_refreshed_at = datetime.now()
+                self.last_refresh_rows = len(settled_rows) + len(recent_rows)
+                self.last_refresh_seconds = self.last_refreshed - started
+
+            if settled_rows and self.snapshot_path:
+                self._save_snapshot()
+            return len(settled_rows) + len(recent_rows)
+
+    def refresh_if_stale(self, get_connection):
+        """Refresh unless the last refresh is younger than ``refresh_interval`` seconds."""
+        if self.last_refreshed is not None and time.monotonic() - self.last_refreshed < self.refresh_interval:
+            return 0
+        return self.refresh(get_connection)
+
+    def rebuild(self, get_connection):
+        """Drop everything and re-aggregate the full history (e.g. after invoices were edited)."""
+        with self._refresh_lock:
+            with self._lock:
+                self._items = {}
+                self._recent = {}
+                self.high_water_mark = 0
+                self.total_revenue = 0.0
+                self.recent_revenue = 0.0
+        return self.refresh(get_connection)
+
+    # --------------------------------------------------------------------------
+    # Reads
+    # --------------------------------------------------------------------------
+    @property
+    def revenue(self):
+        """Revenue over every invoice, settled or still in the rescan window."""
+        with self._lock:
+            return self.total_revenue + self.recent_revenue
+
+    def get(self, item_num):
+        """Return {TotalSold, TotalRevenue, LastSold} for one item (zeros if never sold)."""
+        key = item_key(item_num)
+        with self._lock:
+            totals = {}
+            for entries in (self._items, self._recent):
+                entry = entries.get(key)
+                if entry is not None:
+                    add_sales(totals, entry[0], entry[1], entry[2], entry[3])
+        entry = totals.get(key)
+        if entry is None:
+            return {"TotalSold": 0.0, "TotalRevenue": 0.0, "LastSold": None}
+        return {"TotalSold": entry[1], "TotalRevenue": entry[2], "LastSold": entry[3]}
+
+    def ranked_by_units(self):
+        """All (ItemNum, units, revenue) tuples, best sellers first."""
+        with self._lock:
+            totals = {key: list(entry) for key, entry in self._items.items()}
+            for entry in self._recent.values():
+                add_sales(totals, entry[0], entry[1], entry[2], entry[3])
+        ranked = [(entry[0], entry[1], entry[2]) for entry in totals.values()]
+        ranked.sort(key=lambda entry: entry[1], reverse=True)
+        return ranked
+
+    def stats(self):
+        with self._lock:
+            return {
+                "items": len(self._items.keys() | self._recent.keys()),
+                "high_water_mark": self.high_water_mark,
+                "latest_invoice": self.latest_invoice,
+                "rescan_window": self.rescan_window,
+                "total_revenue": self.total_revenue + self.recent_revenue,
+                "last_refreshed_at": self.last_refreshed_at.isoformat() if self.last_refreshed_at else None,
+                "last_refresh_rows": self.last_refresh_rows,
+                "last_refresh_seconds": round(self.last_refresh_seconds, 3),
+            }
+
+    # --------------------------------------------------------------------------
+    # Snapshot persistence (so a restart does not rescan the whole history)
+    # --------------------------------------------------------------------------
+    def _save_snapshot(self):
+        with self._lock:
+            snapshot = {
+                "high_water_mark": self.high_water_mark,
+                "total_revenue": self.total_revenue,
+                "items": [
+                    [entry[0], entry[1], entry[2], entry[3].isoformat() if entry[3] else None]
+                    for entry in self._items.values()
+                ],
+            }
+        tmp_path = self.snapshot_path + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            print(f"Could not save sales aggregate snapshot: {e}")
+
+    def _load_snapshot(self):
+        if not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+            items = {}
+            for item_num, units, revenue, last_sold in snapshot["items"]:
+                last_sold = datetime.fromisoformat(last_sold) if last_sold else None
+                items[item_key(item_num)] = [item_num, units, revenue, last_sold]
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Ignoring unreadable sales aggregate snapshot: {e}")
+            return
+        self._items = items
+        self.high_water_mark = snapshot["high_water_mark"]
+        self.total_revenue = snapshot["total_revenue"]
@@ -0,0 +1,62 @@
+"""
+Tracks which label formats each printer already holds.
+
+A stored format is downloaded once with ^DF and afterwards recalled with ^XF
+plus the field values, so a label costs a few dozen bytes instead of the full
+layout. The printer gives no cheap way to list its formats, so this keeps an
+in-memory record of what was downloaded where. Entries expire after ``ttl``
+seconds and are dropped when a send to that printer fails (it may have been
+power-cycled or replaced), which makes the next batch download the format
+again.
+"""
+import hashlib
+import threading
+import time
+
+
+def format_version(body):
+    """Short content hash of a format body; a layout edit produces a new version."""
+    return hashlib.sha1(body.encode('utf-8')).hexdigest()[:12]
+
+
+class StoredFormatRegistry:
+    """Printer -> {format name: (version, downloaded at)}."""
+
+    def __init__(self, ttl=3600.0):
+        self.ttl = ttl
+        self._printers = {}
+        self._lock = threading.Lock()
+        self.downloads = 0
+        self.recalls = 0
+
+    def holds(self, printer, name, version):
+        with self._lock:
+            entry = self._printers.get(printer, {}).get(name)
+            held = entry is not None and entry[0] == version and time.monotonic() - entry[1] < self.ttl
+            if held:
+                self.recalls += 1
+            return held
+
+    def mark(self, printer, name, version):
+        with self._lock:
+            self._printers.setdefault(printer, {})[name] = (version, time.monotonic())
+            self.downloads += 1
+
+    def forget(self, printer, reason=None):
+        with self._lock:
+            self._printers.pop(printer, None)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "downloads": self.downloads,
+                "batches_using_stored_format": self.recalls,
+                "printers": {
+                    printer: {
+                        name: {"version": version, "age_seconds": round(now - downloaded_at, 1)}
+                        for name, (version, downloaded_at) in formats.items()
+                    }
+                    for printer, formats in self._printers.items()
+                },
+            }